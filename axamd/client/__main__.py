@@ -20,16 +20,29 @@ import logging
 import os
 import sys
 import textwrap
+import time
 import re
 
 from . import __version__
+from .broker import POLICIES, Broker, BrokerClient
 from .client import Anomaly, Client
-from .exceptions import ProblemDetails
+from .compression import TransferStats
+from .daemon import Daemon
+from .encoding import ENCODINGS, encoded
+from .enrich import Enricher
+from .exceptions import AXAMDException, ProblemDetails
+from .partition import KEYS, Relay
+from .prefilter import RecordFilter
+from .profiling import Profiler, clock
+from .projection import FORMATS, Projection
+from .replay import ReplayClient
+from .sinks import open_sinks
+from .spool import Spool, spooled
+from .validation import OutputValidator
 import jsonschema
 import option_merge
 import pkg_resources
 import yaml
-import signal
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +61,7 @@ _config_schema = yaml.safe_load(pkg_resources.resource_stream(__name__, 'client-
 def _load_config(filename=None, allow_exceptions=True):
     configs = [ _default_config ]
     config_files = list(_default_config_files)
-    config_files = filter(os.path.isfile, config_files)
+    config_files = list(filter(os.path.isfile, config_files))
     if filename:
         config_files.append(filename)
 
@@ -80,14 +93,6 @@ def _percentage(arg):
         raise argparse.ArgumentTypeError('invalid percentage value: {!r}'.format(arg))
 
 
-def duration_handler(signum, frame):
-    """
-    this is called if the --duration parameter is specified
-    """
-    if signum == signal.SIGALRM:
-        sys.exit(0)
-
-
 def timespec_to_seconds(ts):
     """
     turn either hh:mm:ss or %dw%dd%dh%dm%ds
@@ -117,6 +122,29 @@ def timespec_to_seconds(ts):
            c['m'] * 60     + c['s']
 
 
+def _run_daemon(args):
+    def load_config():
+        config = _load_config(args.config)
+        for key in ('server', 'apikey', 'proxy', 'timeout'):
+            if getattr(args, key):
+                config[key] = getattr(args, key)
+        return config
+
+    logging.basicConfig(level=args.debug and logging.DEBUG or logging.INFO,
+            format='%(asctime)s %(levelname)s %(message)s')
+    daemon = Daemon(load_config)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        if args.debug:
+            raise
+        print ('{}: {}'.format(e.__class__.__name__, str(e)), file=sys.stderr)
+        return 1
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(
             description='Client for the AXA RESTful Interface')
@@ -154,6 +182,58 @@ def main():
     parser.add_argument('--anomaly', '-A', nargs='*',
             metavar=('MODULE', 'OPTIONS'),
             help='RAD mode: Anomaly module and options')
+    parser.add_argument('--ops', nargs='+', metavar='OP',
+            help='Only output messages with these ops (e.g. "WATCH HIT")')
+    parser.add_argument('--exclude-ops', nargs='+', metavar='OP',
+            help='Do not output messages with these ops (e.g. MISSED)')
+    parser.add_argument('--enrich-ip', action='append', metavar='NAME=TABLE',
+            help='Add values from an IP table (see axamd.client.enrich) as enrichment.NAME; may be repeated')
+    parser.add_argument('--public-suffixes', metavar='FILE',
+            help='Add registrable domains of rrname and qname using this public_suffix_list.dat')
+    parser.add_argument('--fields', nargs='+', metavar='FIELD',
+            help='Output only these fields (dotted paths, e.g. nmsg.message.rrname)')
+    parser.add_argument('--fields-format', choices=FORMATS, default='json',
+            help='Output format for --fields (default: json)')
+    parser.add_argument('--encoding', choices=ENCODINGS, default='json',
+            help='Output encoding; msgpack and cbor messages are length-prefixed (default: json)')
+    parser.add_argument('--output', '-o', nargs='+', metavar='SINK',
+            help='Write messages to these sinks: -, PATH, rotate:PATH?size=N, tcp:HOST:PORT, udp:HOST:PORT, unix:PATH, unixgram:PATH or pipe:COMMAND (default: -)')
+    parser.add_argument('--sink-drop', action='store_true',
+            help='Drop messages while a slow sink\'s queue is full instead of waiting')
+    parser.add_argument('--relay', metavar='ADDRESS',
+            help='Serve the stream to partition consumers on unix:PATH or HOST:PORT instead of writing it')
+    parser.add_argument('--relay-mode', type=lambda s: int(s, 8), default=0o600, metavar='MODE',
+            help='Permissions of the --relay Unix socket, in octal (default: 600)')
+    parser.add_argument('--partition-by', choices=KEYS, default='rrname',
+            help='Partition key for --relay (default: rrname)')
+    parser.add_argument('--replay', nargs='+', metavar='FILE',
+            help='Read messages from captures (plain, .gz, .bz2 or .xz) instead of the server')
+    parser.add_argument('--replay-speed', type=float, metavar='X',
+            help='Replay at X times the original rate (default: as fast as possible)')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+            help='Replay captures in N parallel processes (default: 1)')
+    parser.add_argument('--serve', metavar='ADDRESS',
+            help='Run a local broker on unix:PATH or HOST:PORT sharing upstream streams between subscribers')
+    parser.add_argument('--serve-mode', type=lambda s: int(s, 8), default=0o600, metavar='MODE',
+            help='Permissions of the --serve Unix socket, in octal (default: 600)')
+    parser.add_argument('--broker', metavar='ADDRESS',
+            help='Subscribe through the local broker at ADDRESS instead of connecting to the server')
+    parser.add_argument('--overflow', choices=POLICIES, default='block',
+            help='What the broker does when this subscriber falls behind (default: block)')
+    parser.add_argument('--spool', metavar='DIRECTORY',
+            help='Buffer messages in an on-disk spool, resuming unprocessed messages on restart')
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+            help='Report sampled stream timings and transfer sizes on exit or SIGUSR1, and write cProfile statistics to FILE if given')
+    parser.add_argument('--profile-every', type=int, default=100, metavar='N',
+            help='Time one in N events when profiling (default: 100)')
+    parser.add_argument('--validate-output', type=int, metavar='N',
+            help='Validate one in N messages against the AXA JSON schema, reporting failures on stderr')
+    parser.add_argument('--preconnect', action='store_true',
+            help='Connect to the server (and fetch the --list-* lists) while the rest of the startup runs')
+    parser.add_argument('--no-compression', action='store_true',
+            help='Do not ask the server to compress streams')
+    parser.add_argument('--daemon', '-D', action='store_true',
+            help='Run every subscription in the configuration; reload on SIGHUP')
     parser.add_argument('--debug', action='store_true', help='Debug mode')
     parser.add_argument('--version', '-V', action='version', version="%(prog)s ({})".format(__version__))
     args = parser.parse_args()
@@ -163,15 +243,18 @@ def main():
         config['server'] = args.server
     if args.apikey:
         config['apikey'] = args.apikey
-    if not config.get('apikey'):
+
+    if args.daemon:
+        return _run_daemon(args)
+
+    if not config.get('apikey') and not (args.broker or args.replay):
         parser.error('API key is not set')
     if args.proxy:
         config['proxy'] = args.proxy
     if args.duration:
-        stoptime = timespec_to_seconds(args.duration)
-        if stoptime is None:
+        duration = timespec_to_seconds(args.duration)
+        if duration is None:
             parser.error('Duration must be specified as hh:mm:ss or #w#d#h#m#s')
-        signal.signal(signal.SIGALRM, duration_handler)
     if args.number:
         if args.number < 0:
             parser.error('Number parameter must be greater than zero')
@@ -188,6 +271,35 @@ def main():
         if args.retry_backoff < 0:
             parser.error('Retry-backoff must be a positive real number')
         config['retry_backoff'] = args.retry_backoff
+    if args.replay and (args.replay_speed is not None and args.replay_speed <= 0 or args.workers < 1):
+        parser.error('Replay-speed and workers must be positive')
+
+    profiler = None
+    if args.profile is not None:
+        if args.profile_every < 1:
+            parser.error('Profile-every must be a positive integer')
+        profiler = Profiler(every=args.profile_every, cprofile=bool(args.profile))
+        profiler.install_signal_handler(filename=args.profile or None)
+
+    if args.replay:
+        client = ReplayClient(args.replay, speed=args.replay_speed,
+                workers=args.workers, profiler=profiler)
+    elif args.broker:
+        client = BrokerClient(args.broker, overflow=args.overflow, profiler=profiler)
+    else:
+        client = Client(server=config['server'],
+                        apikey=config['apikey'],
+                        proxy=config.get('proxy'),
+                        retries=config.get('retries', 3),
+                        retry_backoff=config.get('retry_backoff', 0.3),
+                        profiler=profiler,
+                        compression=not args.no_compression)
+        if args.preconnect:
+            # connects while the remaining options, enrichment tables and
+            # the like are loaded
+            client.preconnect(prefetch=bool(args.list_channels or args.list_anomalies),
+                    timeout=config.get('timeout'))
+
     if args.rate_limit:
         if args.rate_limit < 0:
             parser.error('Rate limit must be a positive integer')
@@ -204,14 +316,20 @@ def main():
     if args.channels and args.anomaly:
         parser.error('Channels (SRA mode) and anomaly (RAD mode) are mutually exclusive')
 
-    if not (args.list_channels or args.list_anomalies or args.watches):
+    if not (args.list_channels or args.list_anomalies or args.watches or args.replay or args.serve):
         parser.error('A watch list is required unless listing available channels or anomaly modules')
 
-    client = Client(server=config['server'],
-                    apikey=config['apikey'],
-                    proxy=config.get('proxy'),
-                    retries=config.get('retries', 3),
-                    retry_backoff=config.get('retry_backoff', 0.3))
+    if args.serve:
+        logging.basicConfig(level=args.debug and logging.DEBUG or logging.INFO,
+                format='%(asctime)s %(levelname)s %(message)s')
+        broker = Broker(client, args.serve, mode=args.serve_mode)
+        try:
+            broker.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.close()
+        return None
 
     timeout = config.get('timeout')
 
@@ -222,6 +340,48 @@ def main():
         client_args['report_interval'] = config['report-interval']
     if 'sample-rate' in config:
         client_args['sample_rate'] = config['sample-rate'] / 100
+    if args.number:
+        client_args['max_messages'] = args.number
+    output_validator = None
+    if args.validate_output is not None:
+        if args.validate_output < 1:
+            parser.error('Validate-output must be a positive integer')
+        def _report(message, error):
+            print ('invalid message: {}: {}'.format(error, message), file=sys.stderr)
+        output_validator = OutputValidator(every=args.validate_output,
+                on_failure=_report)
+        client_args['output_validator'] = output_validator
+    transfer_stats = None
+    if profiler is not None and not (args.replay or args.broker):
+        transfer_stats = TransferStats()
+        client_args['transfer_stats'] = transfer_stats
+    if args.ops or args.exclude_ops:
+        client_args['record_filter'] = RecordFilter(ops=args.ops,
+                drop_ops=args.exclude_ops)
+    if args.enrich_ip or args.public_suffixes:
+        ip_tables = {}
+        for spec in args.enrich_ip or []:
+            name, sep, path = spec.partition('=')
+            if not sep or not name or not path:
+                parser.error('Enrich-ip must be NAME=TABLE')
+            ip_tables[name] = path
+        try:
+            client_args['enricher'] = Enricher(ip_tables=ip_tables,
+                    public_suffixes=args.public_suffixes)
+        except (AXAMDException, IOError, OSError) as e:
+            parser.error(str(e))
+    header = None
+    if args.fields:
+        try:
+            projection = Projection(args.fields, args.fields_format)
+        except AXAMDException as e:
+            parser.error(str(e))
+        if args.fields_format == 'tsv':
+            header = projection.header()
+        client_args['fields'] = args.fields
+        client_args['fields_format'] = args.fields_format
+    if args.encoding != 'json' and args.fields and args.fields_format != 'json':
+        parser.error('Binary encodings need --fields-format json')
 
     try:
         if args.list_channels:
@@ -253,27 +413,45 @@ def main():
                     print('{}:\n\t{}'.format(module, "\n\t".join(textwrap.wrap(desc))))
                 else:
                     print('{}: {}'.format(module, desc))
-        elif args.channels:
-            count = 0
-            if args.duration: signal.alarm(stoptime)
-            for result in client.sra(args.channels, args.watches,
-                    timeout=timeout, **client_args):
-                print (result)
-                sys.stdout.flush()
-                count += 1
-                if args.number and count >= args.number:
-                    break
-        elif args.anomaly:
-            count = 0
-            anomaly = Anomaly(args.anomaly[0], watches=args.watches,
-                    options=' '.join(args.anomaly[1:]))
-            if args.duration: signal.alarm(stoptime)
-            for result in client.rad([anomaly], timeout=timeout, **client_args):
-                print (result)
-                sys.stdout.flush()
-                count += 1
-                if args.number and count >= args.number:
-                    break
+        elif args.channels or args.anomaly or args.replay:
+            if args.duration:
+                client_args['deadline'] = time.time() + duration
+            if not args.anomaly:
+                results = client.sra(args.channels, args.watches,
+                        timeout=timeout, **client_args)
+            else:
+                anomaly = Anomaly(args.anomaly[0], watches=args.watches,
+                        options=' '.join(args.anomaly[1:]))
+                results = client.rad([anomaly], timeout=timeout, **client_args)
+            if args.spool:
+                results = spooled(results, Spool(args.spool))
+            if args.relay:
+                Relay(results, args.relay, by=args.partition_by, mode=args.relay_mode).run()
+                return None
+
+            sink_args = {'block': not args.sink_drop}
+            if args.encoding != 'json':
+                results = encoded(results, args.encoding)
+                sink_args['terminator'] = b''
+            with open_sinks(args.output or ['-'], **sink_args) as sink:
+                count = 0
+                for result in results:
+                    if header is not None:
+                        sink.write(header)
+                        header = None
+                    timed = profiler is not None and profiler.sample('write')
+                    if timed:
+                        t = clock()
+                    dropped = sink.dropped
+                    sink.write(result)
+                    if timed:
+                        profiler.record('write', clock() - t)
+                    if sink.dropped == dropped:
+                        count += 1
+                    if args.number and count >= args.number:
+                        break
+            if sink.dropped:
+                print ('{} messages dropped by slow sinks'.format(sink.dropped), file=sys.stderr)
         else:
             parser.error('Need channels and watches for SRA mode or anomaly for RAD mode')
     except ProblemDetails as e:
@@ -288,6 +466,16 @@ def main():
         return 1
     except KeyboardInterrupt:
         return None
+    finally:
+        if output_validator is not None:
+            print (output_validator.summary(), file=sys.stderr)
+        if profiler is not None:
+            profiler.stop()
+            print (profiler.summary(), file=sys.stderr)
+            if transfer_stats is not None:
+                print (transfer_stats, file=sys.stderr)
+            if args.profile:
+                profiler.dump(args.profile)
     return None
 
 
@@ -0,0 +1,329 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Columnar batching of AXA watch and anomaly hits.
+
+Hits are accumulated into per-column arrays so that vectorized consumers
+never handle one Python object per message.  Batches are built with
+pyarrow when it is available, NumPy otherwise, and plain lists as a last
+resort.  Arrow IPC and Parquet files can be written with pyarrow.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.batch import iter_batches, write_batches
+c = Client('https://axamd.sie-remote.net', apikey)
+for batch in iter_batches(c.sra(channels=[212], watches=['ch=212'])):
+    ...
+# or
+write_batches(c.sra(channels=[212], watches=['ch=212']),
+        'hits-{:05d}.parquet', rows_per_file=1000000)
+```
+'''
+
+import calendar
+import json
+
+from .exceptions import AXAMDException
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HIT_OPS = frozenset(['WATCH HIT', 'ANOMALY HIT'])
+
+# (name, kind) pairs.  'int' columns are nullable 64-bit integers, 'str'
+# columns are nullable strings.  `time` is nanoseconds since the epoch.
+COLUMNS = (
+    ('tag', 'int'),
+    ('op', 'str'),
+    ('channel', 'str'),
+    ('time', 'int'),
+    ('an', 'str'),
+    ('af', 'str'),
+    ('src', 'str'),
+    ('dst', 'str'),
+    ('ttl', 'int'),
+    ('proto', 'str'),
+    ('src_port', 'int'),
+    ('dst_port', 'int'),
+    ('vname', 'str'),
+    ('mname', 'str'),
+    ('rrname', 'str'),
+    ('rrtype', 'str'),
+    ('payload', 'str'),
+)
+
+# (date prefix, seconds since the epoch) of the last date parsed; hits of
+# a stream almost always share it
+_last_day = (None, None)
+
+def parse_time_ns(s):
+    '''
+    Converts an AXA timestamp ("1970-01-01 00:00:01.000000002") to integer
+    nanoseconds since the epoch.  Returns None if `s` is None.
+    '''
+    global _last_day
+    if s is None:
+        return None
+    if len(s) < 19 or s[4] != '-' or s[7] != '-' or s[10] != ' ' or s[13] != ':' or \
+            s[16] != ':' or s[19:20] not in ('', '.'):
+        raise ValueError('Invalid AXA timestamp: {!r}'.format(s))
+    day, day_seconds = _last_day
+    if s[:10] != day:
+        day = s[:10]
+        day_seconds = calendar.timegm((int(day[:4]), int(day[5:7]), int(day[8:10]),
+            0, 0, 0, 0, 0, 0))
+        _last_day = (day, day_seconds)
+    t = day_seconds + int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+    return t * 1000000000 + int((s[20:] + '000000000')[:9])
+
+def _extract(msg, name):
+    if name == 'time':
+        return parse_time_ns(msg.get('time'))
+    if name == 'tag':
+        tag = msg.get('tag')
+        return tag if isinstance(tag, int) else None
+    if name == 'af':
+        af = msg.get('af')
+        return None if af is None else str(af)
+    if name in ('rrname', 'rrtype', 'vname', 'mname'):
+        if name in msg:
+            return msg[name]
+        nmsg = msg.get('nmsg')
+        if not nmsg:
+            return None
+        if name in nmsg:
+            return nmsg[name]
+        return nmsg.get('message', {}).get(name)
+    return msg.get(name)
+
+def _available_backends():
+    backends = []
+    if pyarrow is not None:
+        backends.append('arrow')
+    if numpy is not None:
+        backends.append('numpy')
+    backends.append('list')
+    return backends
+
+class RecordBatcher:
+    '''
+    Accumulates parsed hit messages into columnar batches.
+
+    Batches are returned as a `pyarrow.RecordBatch` (backend 'arrow'), a dict
+    of column name to NumPy array (backend 'numpy'; integer columns are
+    masked arrays) or a dict of column name to list (backend 'list').
+    '''
+    def __init__(self, batch_size=65536, columns=None, backend=None):
+        '''
+        Args:
+            batch_size (int): Rows per batch.
+            columns (list[string]): Column names to keep (default: all).
+            backend (string): One of 'arrow', 'numpy' or 'list'.
+                Defaults to the best available.
+        '''
+        if backend is None:
+            backend = _available_backends()[0]
+        if backend not in _available_backends():
+            raise AXAMDException('Batch backend {!r} is not available'.format(backend))
+        if columns is None:
+            self.columns = COLUMNS
+        else:
+            kinds = dict(COLUMNS)
+            try:
+                self.columns = tuple((c, kinds[c]) for c in columns)
+            except KeyError as e:
+                raise AXAMDException('Unknown column: {}'.format(e.args[0]))
+        self.batch_size = batch_size
+        self.backend = backend
+        self._reset()
+
+    def _reset(self):
+        self._data = dict((name, []) for name, _ in self.columns)
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def add(self, msg):
+        '''
+        Appends a parsed message.  Returns a completed batch when batch_size
+        rows have been accumulated, None otherwise.
+        '''
+        for name, _ in self.columns:
+            self._data[name].append(_extract(msg, name))
+        self._rows += 1
+        if self._rows >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        '''
+        Returns the pending rows as a batch, or None if there are none.
+        '''
+        if not self._rows:
+            return None
+        data = self._data
+        self._reset()
+        if self.backend == 'arrow':
+            return self._to_arrow(data)
+        if self.backend == 'numpy':
+            return self._to_numpy(data)
+        return data
+
+    def schema(self):
+        '''
+        Returns the pyarrow schema of batches built by this batcher.
+        '''
+        types = {'int': pyarrow.int64(), 'str': pyarrow.string()}
+        return pyarrow.schema([(name, types[kind]) for name, kind in self.columns])
+
+    def _to_arrow(self, data):
+        schema = self.schema()
+        arrays = [pyarrow.array(data[name], type=schema.field(name).type)
+                for name, _ in self.columns]
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def _to_numpy(self, data):
+        out = {}
+        for name, kind in self.columns:
+            values = data[name]
+            if kind == 'int':
+                mask = [v is None for v in values]
+                out[name] = numpy.ma.masked_array(
+                        [0 if v is None else v for v in values],
+                        mask=mask, dtype=numpy.int64)
+            else:
+                out[name] = numpy.array(values, dtype=object)
+        return out
+
+def _parse(lines, ops):
+    for line in lines:
+        if isinstance(line, dict):
+            msg = line
+        else:
+            msg = json.loads(line)
+        if ops is None or msg.get('op') in ops:
+            yield msg
+
+def iter_batches(lines, batch_size=65536, columns=None, backend=None, ops=HIT_OPS):
+    '''
+    Groups a stream of messages into columnar batches.
+
+    Args:
+        lines (iterable): Strings as returned by Client.sra() or Client.rad(),
+            or already parsed dicts.
+        batch_size (int): Rows per batch.
+        columns (list[string]): Column names to keep (default: all).
+        backend (string): One of 'arrow', 'numpy' or 'list'.
+        ops (set[string]): Ops to keep, default WATCH HIT and ANOMALY HIT.
+            None keeps every message.
+    Returns:
+        iterator of batches, see RecordBatcher.
+    '''
+    batcher = RecordBatcher(batch_size=batch_size, columns=columns, backend=backend)
+    for msg in _parse(lines, ops):
+        batch = batcher.add(msg)
+        if batch is not None:
+            yield batch
+    batch = batcher.flush()
+    if batch is not None:
+        yield batch
+
+class _Writer:
+    def __init__(self, path, fmt, schema):
+        self.path = path
+        self.rows = 0
+        if fmt == 'parquet':
+            self._writer = pyarrow.parquet.ParquetWriter(path, schema)
+            self._write = self._writer.write_table
+            self._wrap = lambda b: pyarrow.Table.from_batches([b])
+        else:
+            self._sink = pyarrow.OSFile(path, 'wb')
+            self._writer = pyarrow.ipc.new_file(self._sink, schema)
+            self._write = self._writer.write_batch
+            self._wrap = lambda b: b
+
+    def write(self, batch):
+        self._write(self._wrap(batch))
+        self.rows += batch.num_rows
+
+    def close(self):
+        self._writer.close()
+        if hasattr(self, '_sink'):
+            self._sink.close()
+
+def write_batches(lines, path_template, format='parquet', batch_size=65536,
+        rows_per_file=None, columns=None, ops=HIT_OPS):
+    '''
+    Writes a stream of messages to Parquet or Arrow IPC files.  Each batch
+    becomes one row group (Parquet) or record batch (Arrow).  A new file is
+    started once rows_per_file rows have been written; a batch crossing the
+    limit is split between the two files.
+
+    Args:
+        lines (iterable): Strings or parsed dicts.
+        path_template (string): Output path, formatted with the file index,
+            e.g. 'hits-{:05d}.parquet'.
+        format (string): One of 'parquet' or 'arrow'.
+        batch_size (int): Rows per row group.
+        rows_per_file (int): Rows before rotating to a new file.
+        columns (list[string]): Column names to keep (default: all).
+        ops (set[string]): Ops to keep, see iter_batches().
+    Returns:
+        list of paths written
+    Raises:
+        AXAMDException
+    '''
+    if pyarrow is None:
+        raise AXAMDException('pyarrow is required to write {} files'.format(format))
+    if format not in ('parquet', 'arrow'):
+        raise AXAMDException('Unknown batch file format: {!r}'.format(format))
+
+    batcher = RecordBatcher(batch_size=batch_size, columns=columns, backend='arrow')
+    schema = batcher.schema()
+    paths = []
+    writer = None
+    try:
+        for batch in iter_batches(lines, batch_size=batch_size,
+                columns=columns, backend='arrow', ops=ops):
+            while batch is not None:
+                if writer is None:
+                    writer = _Writer(path_template.format(len(paths)), format, schema)
+                    paths.append(writer.path)
+                room = rows_per_file and rows_per_file - writer.rows
+                if room and batch.num_rows > room:
+                    writer.write(batch.slice(0, room))
+                    batch = batch.slice(room)
+                else:
+                    writer.write(batch)
+                    batch = None
+                if rows_per_file and writer.rows >= rows_per_file:
+                    writer.close()
+                    writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+    return paths
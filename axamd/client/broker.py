@@ -0,0 +1,444 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Local broker sharing upstream streams between processes.
+
+A Broker listens on a Unix domain (or TCP) socket.  Each subscriber sends
+the kind (sra or rad) and server-side parameters of the stream it wants.
+Subscribers asking for the same parameters share one upstream stream, which
+is opened for the first of them and closed when the last one leaves.  Every
+subscriber has its own queue, so each reads from its own position, and an
+overflow policy deciding what happens when it falls behind:
+
+    block       wait for the subscriber, slowing the upstream stream
+    drop-new    drop new messages
+    drop-old    drop the oldest queued messages
+    disconnect  disconnect the subscriber
+
+BrokerClient offers the sra() and rad() interface of Client.  Filtering,
+validation, enrichment, projection and limits are applied in the
+subscriber's process.
+
+Example usage:
+
+```python
+# axamd_client --serve unix:/run/axamd.sock
+from axamd.client.broker import BrokerClient
+c = BrokerClient('unix:/run/axamd.sock', overflow='drop-old')
+for line in c.sra(channels=[212], watches=['ch=212']):
+    ...
+```
+'''
+
+import collections
+import json
+import logging
+import socket
+import threading
+import time
+
+from .client import Anomaly, _records
+from .exceptions import AXAMDException, ProblemDetails
+from .partition import close_listener, listen, parse_address
+from .projection import Projection
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop-new', 'drop-old', 'disconnect')
+
+# arguments of sra()/rad() handled in the subscriber's process
+_local = ('timeout', 'record_filter', 'max_messages', 'deadline', 'max_bytes',
+        'output_validator', 'transfer_stats', 'enricher', 'fields', 'fields_format')
+
+def _error_line(e):
+    error = {'type': e.__class__.__name__, 'message': str(e)}
+    if isinstance(e, ProblemDetails):
+        error['problem'] = e._problem
+    return b'!' + json.dumps(error).encode('utf-8') + b'\n'
+
+class _Subscriber:
+    def __init__(self, conn, policy='block', size=10000):
+        self.conn = conn
+        self.policy = policy
+        self.size = max(1, size)
+        self.dropped = 0
+        self.upstream = None
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._ending = False
+        self._error = None
+
+    def start(self):
+        t = threading.Thread(target=self._write, name='axamd-broker-subscriber')
+        t.daemon = True
+        t.start()
+
+    def offer(self, line):
+        'Queues a message according to the overflow policy.'
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self.size:
+                if self.policy == 'block':
+                    while len(self._queue) >= self.size and not self._closed:
+                        self._cond.wait(0.5)
+                    if self._closed:
+                        return
+                elif self.policy == 'drop-new':
+                    self.dropped += 1
+                    return
+                elif self.policy == 'drop-old':
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._ending = True
+                    self._error = AXAMDException('subscriber fell behind')
+                    self._cond.notify_all()
+                    return
+            self._queue.append(line)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        'Sends what is queued, then the error if any, and disconnects.'
+        with self._cond:
+            self._ending = True
+            self._error = self._error or error
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _write(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._ending and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    batch = list(self._queue)
+                    self._queue.clear()
+                    ending, error = self._ending, self._error
+                    self._cond.notify_all()
+                data = b''.join((isinstance(l, bytes) and l or l.encode('utf-8')) + b'\n'
+                        for l in batch)
+                if ending and error is not None:
+                    data += _error_line(error)
+                if data:
+                    self.conn.sendall(data)
+                if ending:
+                    return
+        except socket.error:
+            pass
+        finally:
+            self.close()
+            self.conn.close()
+
+class _Upstream:
+    def __init__(self, broker, key, kind, params):
+        self.broker = broker
+        self.key = key
+        self.kind = kind
+        self.params = params
+        self.client = broker.client.fork()
+        self.subscribers = set()
+
+    def start(self):
+        t = threading.Thread(target=self._run, name='axamd-broker-upstream')
+        t.daemon = True
+        t.start()
+
+    def _open(self):
+        params = dict(self.params)
+        if self.kind == 'rad':
+            anomalies = [Anomaly(a['module'], watches=a.get('watches'), options=a.get('options'))
+                    for a in params.pop('anomalies', [])]
+            return self.client.rad(anomalies, **params)
+        return self.client.sra(params.pop('channels', []), params.pop('watches', []), **params)
+
+    def _run(self):
+        error = None
+        try:
+            for line in self._open():
+                with self.broker._lock:
+                    subscribers = list(self.subscribers)
+                if not subscribers:
+                    break
+                for subscriber in subscribers:
+                    subscriber.offer(line)
+        except Exception as e:
+            error = e
+            logger.error('upstream {} failed: {}: {}'.format(self.key, e.__class__.__name__, e))
+        with self.broker._lock:
+            subscribers = list(self.subscribers)
+            self.subscribers.clear()
+            if self.broker._upstreams.get(self.key) is self:
+                del self.broker._upstreams[self.key]
+        for subscriber in subscribers:
+            subscriber.finish(error)
+
+    def stop(self):
+        self.client.close()
+
+class Broker:
+    '''
+    Shares upstream streams of one Client between local subscribers.
+    '''
+    def __init__(self, client, address, queue_size=10000, mode=0o600):
+        '''
+        Args:
+            client (Client): Client for the upstream streams; each is
+                opened with a Client.fork().
+            address (string): 'unix:PATH' or 'HOST:PORT' to listen on.  A
+                stale Unix socket file is replaced.
+            queue_size (int): Default per-subscriber queue size.
+            mode (int): Permissions of the Unix socket.  Anyone who can
+                connect streams with the client's API key; the default
+                admits only the broker's user.
+        Raises:
+            AXAMDException: if another broker is listening on the socket.
+        '''
+        self.client = client
+        self.queue_size = queue_size
+        self._upstreams = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listener = listen(address, mode=mode)
+        self.address = self._listener.getsockname()
+
+    @property
+    def upstreams(self):
+        'Maps each open upstream parameter set to its number of subscribers.'
+        with self._lock:
+            return dict((key, len(u.subscribers)) for key, u in self._upstreams.items())
+
+    def _attach(self, subscriber, kind, params):
+        key = json.dumps({'kind': kind, 'params': params}, sort_keys=True)
+        with self._lock:
+            upstream = self._upstreams.get(key)
+            new = upstream is None
+            if new:
+                upstream = _Upstream(self, key, kind, params)
+                self._upstreams[key] = upstream
+            upstream.subscribers.add(subscriber)
+            subscriber.upstream = upstream
+        if new:
+            logger.info('opening upstream {}'.format(key))
+            upstream.start()
+
+    def _detach(self, subscriber):
+        upstream = subscriber.upstream
+        with self._lock:
+            upstream.subscribers.discard(subscriber)
+            last = not upstream.subscribers and self._upstreams.get(upstream.key) is upstream
+            if last:
+                del self._upstreams[upstream.key]
+        subscriber.close()
+        if last:
+            logger.info('closing upstream {}'.format(upstream.key))
+            upstream.stop()
+
+    def _serve(self, conn):
+        f = conn.makefile('rb')
+        subscriber = None
+        try:
+            request = json.loads(f.readline().decode('utf-8'))
+            kind = request.get('kind')
+            policy = request.get('overflow', 'block')
+            if kind not in ('sra', 'rad') or policy not in POLICIES:
+                raise AXAMDException('Invalid subscription request')
+            subscriber = _Subscriber(conn, policy, request.get('queue', self.queue_size))
+            subscriber.start()
+            self._attach(subscriber, kind, request.get('params') or {})
+            # the subscriber sends nothing more; EOF means it left
+            while f.read(4096):
+                pass
+        except (ValueError, AttributeError, AXAMDException) as e:
+            try:
+                conn.sendall(_error_line(e))
+            except socket.error:
+                pass
+        except socket.error:
+            pass
+        finally:
+            f.close()
+            if subscriber is None:
+                conn.close()
+            elif subscriber.upstream is not None:
+                self._detach(subscriber)
+
+    def run(self):
+        '''
+        Accepts subscribers until close() is called.
+        '''
+        while not self._stopping.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.error:
+                if self._stopping.is_set():
+                    break
+                raise
+            t = threading.Thread(target=self._serve, args=(conn,), name='axamd-broker-connection')
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        'Stops accepting subscribers and closes every upstream stream.'
+        self._stopping.set()
+        try:
+            self._listener.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        close_listener(self._listener)
+        with self._lock:
+            upstreams = list(self._upstreams.values())
+        for upstream in upstreams:
+            upstream.stop()
+
+def _raise(line):
+    error = json.loads(line[1:].split(b'\n', 1)[0].decode('utf-8'))
+    if 'problem' in error:
+        raise ProblemDetails(error['problem'])
+    raise AXAMDException('{}: {}'.format(error['type'], error['message']))
+
+class BrokerClient:
+    '''
+    Stands in for a Client, subscribing to streams through a Broker.
+    '''
+    def __init__(self, address, overflow='block', queue_size=10000, profiler=None):
+        '''
+        Args:
+            address (string): Broker address, 'unix:PATH' or 'HOST:PORT'.
+            overflow (string): Overflow policy, one of POLICIES.
+            queue_size (int): Messages the broker queues for this client.
+            profiler (Profiler): Collects sampled stream timings.
+        '''
+        if overflow not in POLICIES:
+            raise AXAMDException('Overflow policy must be one of {}'.format(', '.join(POLICIES)))
+        self.address = address
+        self.overflow = overflow
+        self.queue_size = queue_size
+        self._profiler = profiler
+        self._socks = set()
+        self._lock = threading.Lock()
+
+    def _chunks(self, sock, timeout=None, deadline=None, max_bytes=None, stats=None):
+        '''
+        Yields complete lines from the broker as they arrive.  As in
+        Client, the socket timeout is renewed before each read so that
+        `deadline` is never overrun, reading stops once `max_bytes` have
+        been received, and byte counts are added to `stats`.
+        '''
+        if stats is not None:
+            stats.encoding = 'identity'
+        pending = b''
+        nbytes = 0
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                sock.settimeout(remaining if timeout is None else min(timeout, remaining))
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                if deadline is not None and time.time() >= deadline:
+                    return
+                raise
+            if not chunk:
+                return
+            nbytes += len(chunk)
+            if stats is not None:
+                stats.compressed += len(chunk)
+                stats.decompressed += len(chunk)
+            data = pending + chunk
+            end = data.rfind(b'\n') + 1
+            data, pending = data[:end], data[end:]
+            # the broker ends a failed stream with one '!' error line
+            if data.startswith(b'!'):
+                _raise(data)
+            error = data.find(b'\n!')
+            if error != -1:
+                yield data[:error + 1]
+                _raise(data[error + 1:])
+            if data:
+                yield data
+            if max_bytes is not None and nbytes >= max_bytes:
+                return
+
+    def _stream(self, kind, params):
+        local = dict((k, params.pop(k)) for k in _local if k in params)
+        timeout = local.get('timeout')
+        deadline = local.get('deadline')
+        if deadline is not None and deadline <= time.time():
+            return
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        if deadline is not None:
+            remaining = deadline - time.time()
+            sock.settimeout(remaining if timeout is None else min(timeout, remaining))
+        with self._lock:
+            self._socks.add(sock)
+        try:
+            sock.connect(address)
+            sock.sendall(json.dumps({'kind': kind, 'params': params,
+                'overflow': self.overflow, 'queue': self.queue_size}).encode('utf-8') + b'\n')
+            fields = local.get('fields')
+            projection = fields is not None and \
+                    Projection(fields, local.get('fields_format', 'json')) or None
+            chunks = self._chunks(sock, timeout, deadline, local.get('max_bytes'),
+                    local.get('transfer_stats'))
+            for line in _records(chunks, self._profiler,
+                    local.get('record_filter'), local.get('max_messages'),
+                    local.get('output_validator'), local.get('enricher'), projection):
+                yield line
+        finally:
+            with self._lock:
+                self._socks.discard(sock)
+            sock.close()
+
+    def sra(self, channels=[], watches=[], **params):
+        'Subscribes to an SRA stream; see Client.sra().'
+        params.update(channels=channels, watches=watches)
+        return self._stream('sra', params)
+
+    def rad(self, anomalies=[], **params):
+        'Subscribes to a RAD stream; see Client.rad().'
+        params['anomalies'] = [a.to_dict() for a in anomalies]
+        return self._stream('rad', params)
+
+    def list_channels(self, timeout=None):
+        raise AXAMDException('Channels cannot be listed through the broker')
+
+    def list_anomalies(self, timeout=None):
+        raise AXAMDException('Anomalies cannot be listed through the broker')
+
+    def close(self):
+        'Ends every stream opened by this client.'
+        with self._lock:
+            socks = list(self._socks)
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
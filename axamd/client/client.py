@@ -32,16 +32,26 @@ for line in c.sra(channels=[212], watches=['ch=212']):
 '''
 
 import json
+import logging
 import platform
+import socket
+import threading
+import time
 
 from . import __version__
 from .exceptions import ProblemDetails, ValidationError, Timeout
+from .compression import accept_encoding, decompressor
+from .profiling import clock
+from .projection import Projection
 from .six_mini import reraise
 
 import requests
 from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import ReadTimeoutError
 from requests.packages.urllib3.util.retry import Retry
 
+logger = logging.getLogger(__name__)
+
 try:
     import pkg_resources
     import yaml
@@ -73,6 +83,7 @@ def requests_retry_session(
     backoff_factor=0.3,
     status_forcelist=(500, 502, 504),
     session=None,
+    pool_maxsize=10,
 ):
     session = session or requests.Session()
     retry = Retry(
@@ -83,7 +94,7 @@ def requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -121,6 +132,178 @@ class Anomaly:
                 self.options and ' '+self.options or '', # prefix with space
                 ', '.join('[{}]'.format(w) for w in self.watches))
 
+def _socket(r):
+    sock = getattr(getattr(r.raw, '_connection', None), 'sock', None)
+    if sock is None:
+        # the connection hands its socket to the response when it will close
+        fp = getattr(getattr(r.raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    return sock
+
+def _reader(r):
+    '''
+    Returns a read(n) that returns the bytes that have arrived, up to n,
+    rather than waiting for all n.  Python 3's HTTPResponse has read1().
+    On Python 2, chunked bodies are read chunk by chunk through urllib3,
+    and other bodies without a length from the socket itself, which httplib
+    reads unbuffered.  Failing both, read(n) waits for n bytes, so records
+    of a quiet stream are delayed.
+    '''
+    read1 = getattr(getattr(r.raw, '_fp', None), 'read1', None)
+    if read1 is not None:
+        return read1
+    if getattr(r.raw, 'chunked', False) and hasattr(r.raw, 'read_chunked'):
+        chunks = r.raw.read_chunked(decode_content=False)
+        return lambda n: next(chunks, b'')
+    sock = r.headers.get('Content-Length') is None and _socket(r) or None
+    if sock is not None:
+        return sock.recv
+    return lambda n: r.raw.read(n, decode_content=False)
+
+def _chunks(r, size, timeout=None, deadline=None, max_bytes=None, stats=None):
+    '''
+    Yields the body of a streaming response as soon as bytes arrive, rather
+    than waiting for `size` bytes as iter_content() does.  Compressed bodies
+    are decompressed incrementally as they arrive.  Stops cleanly once
+    `deadline` (seconds since the epoch) passes, waiting on the socket no
+    longer than that, or once `max_bytes` have been received.  Byte counts
+    are added to `stats`, a TransferStats.
+    '''
+    read = _reader(r)
+    coding = r.headers.get('Content-Encoding', 'identity')
+    decoder = decompressor(coding)
+    if stats is not None:
+        stats.encoding = coding
+    sock = deadline is not None and _socket(r) or None
+    nbytes = 0
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if sock is not None:
+                sock.settimeout(remaining if timeout is None else min(timeout, remaining))
+        try:
+            chunk = read(size)
+        except (socket.timeout, ReadTimeoutError, requests.ConnectionError):
+            if deadline is not None and time.time() >= deadline:
+                return
+            raise
+        if not chunk:
+            if decoder is not None:
+                chunk = decoder.flush()
+                if stats is not None:
+                    stats.decompressed += len(chunk)
+                if chunk:
+                    yield chunk
+            return
+        nbytes += len(chunk)
+        if stats is not None:
+            stats.compressed += len(chunk)
+        if decoder is not None:
+            chunk = decoder.decompress(chunk)
+        if stats is not None:
+            stats.decompressed += len(chunk)
+        if chunk:
+            yield chunk
+        if max_bytes is not None and nbytes >= max_bytes:
+            return
+
+def _frame(chunks, profiler=None):
+    '''
+    Splits a stream of byte chunks into records, stripping the RFC 7464
+    record separator.  An unterminated record at the end of the stream is
+    incomplete and is discarded.
+    '''
+    pending = b''
+    for chunk in chunks:
+        timed = profiler is not None and profiler.sample('frame')
+        if timed:
+            t = clock()
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        if timed:
+            profiler.record('frame', clock() - t)
+        for line in lines:
+            line = line.lstrip(b'\x1e')
+            if line:
+                yield line
+
+def _records(chunks, profiler=None, record_filter=None, max_messages=None,
+        output_validator=None, enricher=None, projection=None):
+    '''
+    Runs byte chunks through framing, the record filter, decoding, output
+    validation, enrichment and projection, yielding the resulting lines.
+    '''
+    count = 0
+    if profiler is not None:
+        chunks = profiler.timed('read', chunks)
+    for line in _frame(chunks, profiler):
+        if record_filter is not None and not record_filter(line):
+            continue
+        if profiler is None:
+            line = line.decode('utf-8')
+            if output_validator is not None:
+                output_validator(line)
+            if enricher is not None:
+                line = enricher(line)
+            if projection is not None:
+                line = projection(line)
+            yield line
+        else:
+            timed = profiler.sample('decode')
+            if timed:
+                t = clock()
+            line = line.decode('utf-8')
+            if timed:
+                profiler.record('decode', clock() - t)
+
+            if output_validator is not None:
+                timed = profiler.sample('validate')
+                if timed:
+                    t = clock()
+                output_validator(line)
+                if timed:
+                    profiler.record('validate', clock() - t)
+
+            if enricher is not None:
+                timed = profiler.sample('enrich')
+                if timed:
+                    t = clock()
+                line = enricher(line)
+                if timed:
+                    profiler.record('enrich', clock() - t)
+
+            if projection is not None:
+                timed = profiler.sample('project')
+                if timed:
+                    t = clock()
+                line = projection(line)
+                if timed:
+                    profiler.record('project', clock() - t)
+
+            timed = profiler.sample('callback')
+            if timed:
+                t = clock()
+            yield line
+            if timed:
+                profiler.record('callback', clock() - t)
+        count += 1
+        if max_messages is not None and count >= max_messages:
+            return
+
+def _abort(r):
+    '''
+    Shuts down the socket of a streaming response so that the thread
+    reading it sees the end of the stream and closes it.
+    '''
+    sock = _socket(r)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+
 class _rq_ctx:
     def __enter__(self): pass
     def __exit__(self, e, v, tb):
@@ -129,7 +312,7 @@ class _rq_ctx:
                 reraise(ProblemDetails, ProblemDetails(v.response.json()), tb)
             except (KeyError, ValueError):
                 pass
-        elif isinstance(v, requests.Timeout):
+        elif isinstance(v, (requests.Timeout, socket.timeout, ReadTimeoutError)):
             reraise(Timeout, Timeout(v), tb)
 
 class Client:
@@ -137,13 +320,27 @@ class Client:
             platform.python_implementation(), platform.python_version(),
             platform.platform())
     __doc__ = __doc__
-    def __init__(self, server, apikey, retries=3, retry_backoff=0.3, proxy=None):
+    def __init__(self, server, apikey, retries=3, retry_backoff=0.3, proxy=None,
+            profiler=None, session=None, compression=True):
         '''
         Args:
             server (string): Server URI
             apikey (string): API key
+            profiler (Profiler): Collects sampled stream timings.
+            session (requests.Session): Session to share with other clients,
+                see requests_retry_session().  A new session is created per
+                request by default.
+            compression (bool): Ask the server to compress streams with the
+                best supported content coding.
         '''
         self._server = server
+        self._compression = compression
+        self._accept_encoding = compression and accept_encoding() or 'identity'
+        self._profiler = profiler
+        self._session = session
+        self._responses = set()
+        self._closed = False
+        self._lock = threading.Lock()
         self._apikey = apikey
         self._retries = retries
         self._backoff = retry_backoff
@@ -151,26 +348,160 @@ class Client:
         if proxy:
             self._proxies['http'] = proxy
             self._proxies['https'] = proxy
+        self._warming = None
+        self._prefetched = {}
 
-    def _stream(self, uri, validate=None, timeout=None, **stream_params):
+    def _stream(self, uri, validate=None, timeout=None, record_filter=None,
+            deadline=None, max_messages=None, max_bytes=None, output_validator=None,
+            transfer_stats=None, enricher=None, fields=None, fields_format='json',
+            **stream_params):
         if validate:
             validate(stream_params)
+        self._wait_warm()
+        projection = None
+        if fields is not None:
+            projection = Projection(fields, fields_format)
+        request_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            request_timeout = remaining if timeout is None else min(timeout, remaining)
         with _rq_ctx():
-            r = requests_retry_session(retries=self._retries, backoff_factor=self._backoff)\
-                .post(uri, data=json.dumps(stream_params),
+            r = self._new_session().post(uri, data=json.dumps(stream_params),
                     headers={
                         'X-API-Key': self._apikey,
                         'User-Agent': Client.user_agent,
+                        'Accept-Encoding': self._accept_encoding,
                         },
                     proxies = self._proxies,
-                    timeout=timeout, stream=True)
+                    timeout=request_timeout, stream=True)
             r.raise_for_status()
-            for line in r.iter_lines():
-                yield line.lstrip(b'\x1e').decode('utf-8')
+            with self._lock:
+                if self._closed:
+                    r.close()
+                    return
+                self._responses.add(r)
+            try:
+                chunks = _chunks(r, 65536, timeout=timeout, deadline=deadline,
+                        max_bytes=max_bytes, stats=transfer_stats)
+                for line in _records(chunks, self._profiler, record_filter,
+                        max_messages, output_validator, enricher, projection):
+                    yield line
+            finally:
+                with self._lock:
+                    self._responses.discard(r)
+                r.close()
+
+    def preconnect(self, prefetch=False, timeout=None):
+        '''
+        Starts resolving the server name and connecting to it (including
+        the TLS handshake) in a background thread, so that this overlaps
+        with the caller's other startup work.  The next request uses the
+        open connection.  Errors are left for that request to report.
+
+        The client keeps the session it creates for this unless it was
+        given one.
+
+        Args:
+            prefetch (bool): Also fetch the channel and anomaly lists,
+                which the next list_channels() and list_anomalies() return.
+            timeout (float): Socket timeout.
+        '''
+        if self._session is None:
+            self._session = self._new_session()
+        t = threading.Thread(target=self._warm, args=(prefetch, timeout),
+                name='axamd-preconnect')
+        t.daemon = True
+        self._warming = t
+        t.start()
+
+    def _connect_pooled(self, uri, timeout):
+        # Opens a connection in the pool the next request to `uri` draws
+        # from.  This uses urllib3 internals; returns False if they are not
+        # available.
+        session = self._session
+        adapter = session.get_adapter(uri)
+        # the same proxies and TLS settings as requests uses, so the
+        # connection lands in the pool the request will draw from
+        settings = session.merge_environment_settings(uri, self._proxies,
+                True, None, None)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            pool = adapter.get_connection_with_tls_context(
+                    requests.Request('GET', uri).prepare(), settings['verify'],
+                    settings['proxies'], settings['cert'])
+        else:
+            pool = adapter.get_connection(uri, settings['proxies'])
+        if not (hasattr(pool, '_get_conn') and hasattr(pool, '_put_conn')):
+            return False
+        try:
+            conn = pool._get_conn(timeout=timeout)
+        except TypeError:
+            return False
+        try:
+            if getattr(conn, 'sock', None) is None:
+                if timeout is not None:
+                    conn.timeout = timeout
+                conn.connect()
+        finally:
+            pool._put_conn(conn)
+        return True
+
+    def _warm(self, prefetch, timeout):
+        uri = '{}/v1/sra/channels'.format(self._server)
+        try:
+            # prefetching opens the connection anyway
+            if not prefetch and not self._connect_pooled(uri, timeout):
+                # a small request through the public API does the same
+                self._fetch(uri, timeout=timeout)
+            if prefetch:
+                for uri in (uri, '{}/v1/rad/anomalies'.format(self._server)):
+                    self._prefetched[uri] = self._fetch(uri, timeout=timeout)
+        except Exception as e:
+            logger.debug('preconnect failed: {}: {}'.format(e.__class__.__name__, e))
+
+    def _wait_warm(self):
+        t = self._warming
+        if t is not None and t is not threading.current_thread():
+            t.join()
+            self._warming = None
+
+    def _new_session(self):
+        if self._session is not None:
+            return self._session
+        return requests_retry_session(retries=self._retries, backoff_factor=self._backoff)
+
+    def fork(self):
+        '''
+        Returns a new Client with the same settings and session.  Streams of
+        the two clients can be closed independently.
+        '''
+        return Client(self._server, self._apikey, retries=self._retries,
+                retry_backoff=self._backoff, proxy=self._proxies.get('https'),
+                profiler=self._profiler, session=self._session,
+                compression=self._compression)
+
+    def close(self):
+        '''
+        Ends every stream opened by this client, including streams still
+        connecting.  May be called from another thread; iterators blocked on
+        the network return.  The client cannot be used for streams afterwards.
+        '''
+        with self._lock:
+            self._closed = True
+            responses = list(self._responses)
+        for r in responses:
+            _abort(r)
 
     def _get(self, uri, timeout=None):
+        self._wait_warm()
+        if uri in self._prefetched:
+            return self._prefetched.pop(uri)
+        return self._fetch(uri, timeout=timeout)
+
+    def _fetch(self, uri, timeout=None):
         with _rq_ctx():
-            r = requests_retry_session(retries=self._retries, backoff_factor=self._backoff).get(uri,
+            r = self._new_session().get(uri,
                     headers={
                         'X-API-Key': self._apikey,
                         'User-Agent': Client.user_agent,
@@ -195,8 +526,24 @@ class Client:
             report_interval (int): Seconds between statistics messages.
             output_format (str): One of 'axa+json', or 'nmsg+json'.
             timeout (float): Socket timeout.
+            record_filter (RecordFilter): Drops or routes records before
+                they are decoded.
+            deadline (float): Time (seconds since the epoch) at which to
+                close the stream.
+            max_messages (int): Close the stream after this many messages.
+            max_bytes (int): Close the stream after reading this many bytes.
+            output_validator (OutputValidator): Validates a sample of the
+                messages against the AXA JSON schema.
+            transfer_stats (TransferStats): Receives the content coding and
+                the received and decompressed byte counts.
+            enricher (Enricher): Adds IP and domain information to each
+                message.
+            fields (list[string]): Reduce each message to these dotted
+                field paths, e.g. 'nmsg.message.rrname'.
+            fields_format (str): Projection output, 'json' or 'tsv'.
         Returns:
-            iterator returning strings formatted per output_format
+            iterator returning strings formatted per output_format, or
+            projected per fields_format
         Raises:
             ProblemDetails
             ValidationError
@@ -220,8 +567,24 @@ class Client:
             report_interval (int): Seconds between statistics messages.
             output_format (str): One of 'axa+json', or 'nmsg+json'.
             timeout (float): Socket timeout.
+            record_filter (RecordFilter): Drops or routes records before
+                they are decoded.
+            deadline (float): Time (seconds since the epoch) at which to
+                close the stream.
+            max_messages (int): Close the stream after this many messages.
+            max_bytes (int): Close the stream after reading this many bytes.
+            output_validator (OutputValidator): Validates a sample of the
+                messages against the AXA JSON schema.
+            transfer_stats (TransferStats): Receives the content coding and
+                the received and decompressed byte counts.
+            enricher (Enricher): Adds IP and domain information to each
+                message.
+            fields (list[string]): Reduce each message to these dotted
+                field paths, e.g. 'nmsg.message.rrname'.
+            fields_format (str): Projection output, 'json' or 'tsv'.
         Returns:
-            iterator returning strings formatted per output_format
+            iterator returning strings formatted per output_format, or
+            projected per fields_format
         Raises:
             ProblemDetails
             ValidationError
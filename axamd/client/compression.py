@@ -0,0 +1,146 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Content codings for compressed stream transfer.
+
+gzip and deflate are always available.  zstd and br are offered when the
+`zstandard` and `brotli` modules are installed.  Decompressors work
+incrementally so records can be framed as soon as their bytes arrive.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.compression import TransferStats
+stats = TransferStats()
+c = Client('https://axamd.sie-remote.net', apikey)
+for line in c.sra(channels=[212], watches=['ch=212'], transfer_stats=stats):
+    ...
+print(stats)
+```
+'''
+
+import zlib
+
+from .exceptions import AXAMDException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class _Deflate:
+    # RFC 7230 deflate is zlib-wrapped, but some servers send raw deflate
+    def __init__(self):
+        self._obj = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._obj.decompress(data)
+        self._first = False
+        try:
+            return self._obj.decompress(data)
+        except zlib.error:
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+class _Zstd:
+    def __init__(self):
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return b''
+
+class _Brotli:
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return b''
+
+def codings():
+    '''
+    Returns the supported content codings, most preferred first.
+    '''
+    result = []
+    if zstandard is not None:
+        result.append('zstd')
+    if brotli is not None:
+        result.append('br')
+    result.extend(['gzip', 'deflate'])
+    return result
+
+def accept_encoding():
+    'Returns an Accept-Encoding header value for the supported codings.'
+    return ', '.join(codings())
+
+def decompressor(coding):
+    '''
+    Returns an incremental decompressor with decompress(data) and flush()
+    methods for a Content-Encoding value, or None for identity.
+
+    Raises:
+        AXAMDException: if the coding is not supported.
+    '''
+    coding = (coding or 'identity').strip().lower()
+    if coding == 'identity':
+        return None
+    if coding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if coding == 'deflate':
+        return _Deflate()
+    if coding == 'zstd' and zstandard is not None:
+        return _Zstd()
+    if coding == 'br' and brotli is not None:
+        return _Brotli()
+    raise AXAMDException('Unsupported content encoding: {}'.format(coding))
+
+class TransferStats:
+    '''
+    Byte counts for one stream.
+
+    Attributes:
+        encoding (string): Content coding used by the server.
+        compressed (int): Bytes received from the network.
+        decompressed (int): Bytes after decompression.
+    '''
+    def __init__(self):
+        self.encoding = None
+        self.compressed = 0
+        self.decompressed = 0
+
+    @property
+    def ratio(self):
+        'Decompressed bytes per received byte.'
+        return self.compressed and float(self.decompressed) / self.compressed or 0.0
+
+    def __str__(self):
+        return '{}: {} bytes received, {} bytes decompressed ({:.1f}x)'.format(
+                self.encoding or 'identity', self.compressed, self.decompressed, self.ratio)
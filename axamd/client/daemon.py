@@ -0,0 +1,255 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Long-running daemon serving many named subscriptions from one process.
+
+Each entry of the `subscriptions` configuration key describes one SRA
+(`channels` and `watches`) or RAD (`anomalies`) stream and the sinks its
+output goes to (see axamd.client.sinks).  Every subscription runs in its
+own thread; subscriptions to the same server share one connection pool.
+Streams that end or fail are restarted with exponential backoff.  On
+reload only subscriptions whose definition changed are restarted.
+'''
+
+import json
+import logging
+import signal
+import threading
+
+from .client import Anomaly, Client, requests_retry_session
+from .exceptions import AXAMDException
+from .sinks import open_sinks
+
+logger = logging.getLogger(__name__)
+
+# subscription/global config key -> Client.sra()/Client.rad() argument
+_stream_options = {
+    'rate-limit': 'rate_limit',
+    'report-interval': 'report_interval',
+    'output-format': 'output_format',
+}
+
+class Subscription(threading.Thread):
+    '''
+    Runs one named stream until stopped.
+    '''
+    min_backoff = 1.0
+    max_backoff = 60.0
+
+    def __init__(self, name, spec, client):
+        '''
+        Args:
+            name (string): Subscription name.
+            spec (dict): Subscription configuration.
+            client (Client): Client used for this subscription only.
+        '''
+        super(Subscription, self).__init__(name='axamd-{}'.format(name))
+        self.daemon = True
+        self.subscription = name
+        self.spec = spec
+        self.client = client
+        self.messages = 0
+        self._stopping = threading.Event()
+
+    def _open(self):
+        spec = self.spec
+        params = {}
+        for key, arg in _stream_options.items():
+            if key in spec:
+                params[arg] = spec[key]
+        if 'sample-rate' in spec:
+            params['sample_rate'] = spec['sample-rate'] / 100.0
+        timeout = spec.get('timeout')
+        if 'anomalies' in spec:
+            anomalies = [Anomaly(a['module'], watches=a.get('watches'),
+                options=a.get('options')) for a in spec['anomalies']]
+            return self.client.rad(anomalies, timeout=timeout, **params)
+        return self.client.sra(spec.get('channels', []), spec.get('watches', []),
+                timeout=timeout, **params)
+
+    def run(self):
+        backoff = self.min_backoff
+        outputs = self.spec.get('output', '-')
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        while not self._stopping.is_set():
+            try:
+                # reopened on reconnect so a failed sink gets another chance
+                with open_sinks(outputs) as output:
+                    for line in self._open():
+                        output.write(line)
+                        self.messages += 1
+                        backoff = self.min_backoff
+                if output.dropped:
+                    logger.warning('{}: {} messages dropped by slow sinks'.format(
+                        self.subscription, output.dropped))
+                if not self._stopping.is_set():
+                    logger.warning('{}: stream ended, reconnecting'.format(self.subscription))
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                logger.error('{}: {}: {}'.format(self.subscription, e.__class__.__name__, e))
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def stop(self):
+        '''
+        Asks the subscription to stop and closes its stream.
+        '''
+        self._stopping.set()
+        self.client.close()
+
+def _canonical(spec):
+    return json.dumps(spec, sort_keys=True)
+
+def _server_key(spec):
+    return (spec['server'], spec.get('proxy'))
+
+class Daemon:
+    '''
+    Runs the subscriptions listed in a configuration and reloads them on
+    demand.
+    '''
+    def __init__(self, load_config):
+        '''
+        Args:
+            load_config (callable): Returns the merged, validated
+                configuration dict.  Called at start and on every reload.
+        '''
+        self._load_config = load_config
+        self._sessions = {}
+        self._subscriptions = {}
+        self._specs = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._reload = threading.Event()
+
+    def _session(self, config, size):
+        # One session per server, with room for `size` streams.  A reload
+        # adding subscriptions mounts a larger pool and closes the old one:
+        # its idle connections close at once, and those of streams still
+        # open close when the streams end and return them.
+        key = _server_key(config)
+        session, pool_maxsize = self._sessions.get(key, (None, 0))
+        if size > pool_maxsize:
+            replaced = session is not None and set(session.adapters.values()) or set()
+            pool_maxsize = max(10, size)
+            session = requests_retry_session(
+                    retries=config.get('retries', 3),
+                    backoff_factor=config.get('retry-backoff', 0.3),
+                    session=session, pool_maxsize=pool_maxsize)
+            for adapter in replaced - set(session.adapters.values()):
+                adapter.close()
+            self._sessions[key] = (session, pool_maxsize)
+        return session
+
+    def _specs_from(self, config):
+        subscriptions = config.get('subscriptions') or {}
+        if not subscriptions:
+            raise AXAMDException('No subscriptions are configured')
+        specs = {}
+        for name, spec in subscriptions.items():
+            merged = dict((k, v) for k, v in config.items() if k != 'subscriptions')
+            merged.update(spec)
+            if not merged.get('apikey'):
+                raise AXAMDException('{}: API key is not set'.format(name))
+            if not (merged.get('watches') or merged.get('anomalies')):
+                raise AXAMDException('{}: a watch list or anomalies are required'.format(name))
+            specs[name] = merged
+        return specs
+
+    def _start(self, name, spec, size):
+        client = Client(server=spec['server'], apikey=spec['apikey'],
+                proxy=spec.get('proxy'), session=self._session(spec, size))
+        subscription = Subscription(name, spec, client)
+        self._subscriptions[name] = subscription
+        self._specs[name] = _canonical(spec)
+        subscription.start()
+        logger.info('{}: started'.format(name))
+
+    def _stop(self, name):
+        subscription = self._subscriptions.pop(name)
+        del self._specs[name]
+        subscription.stop()
+        subscription.join()
+        logger.info('{}: stopped'.format(name))
+
+    def apply(self, config):
+        '''
+        Starts, restarts and stops subscriptions to match `config`.
+        Returns (started, stopped) lists of subscription names.
+        '''
+        specs = self._specs_from(config)
+        started, stopped = [], []
+        with self._lock:
+            for name in sorted(self._subscriptions):
+                if name not in specs or _canonical(specs[name]) != self._specs[name]:
+                    self._stop(name)
+                    stopped.append(name)
+            sizes = {}
+            for spec in specs.values():
+                key = _server_key(spec)
+                sizes[key] = sizes.get(key, 0) + 1
+            for name in sorted(specs):
+                if name not in self._subscriptions:
+                    self._start(name, specs[name], sizes[_server_key(specs[name])])
+                    started.append(name)
+        return started, stopped
+
+    @property
+    def subscriptions(self):
+        'Maps subscription names to running Subscription threads.'
+        with self._lock:
+            return dict(self._subscriptions)
+
+    def reload(self):
+        '''
+        Reloads the configuration, keeping the current subscriptions if it
+        fails to load.
+        '''
+        try:
+            config = self._load_config()
+            started, stopped = self.apply(config)
+        except Exception as e:
+            logger.error('reload failed: {}: {}'.format(e.__class__.__name__, e))
+            return
+        logger.info('reloaded: restarted or started {}, stopped {}'.format(
+            started or 'none', stopped or 'none'))
+
+    def stop(self):
+        '''
+        Stops every subscription and makes run() return.
+        '''
+        self._stopping.set()
+
+    def run(self, install_signals=True):
+        '''
+        Starts the configured subscriptions and blocks until stop() is
+        called.  With install_signals, SIGHUP reloads the configuration and
+        SIGTERM stops the daemon; this must be called from the main thread.
+        '''
+        self.apply(self._load_config())
+        if install_signals:
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._reload.set())
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        try:
+            while not self._stopping.is_set():
+                if self._reload.wait(0.5):
+                    self._reload.clear()
+                    self.reload()
+        finally:
+            with self._lock:
+                for name in list(self._subscriptions):
+                    self._stop(name)
@@ -0,0 +1,414 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Binary re-encoding of stream messages.
+
+Messages can be re-encoded from JSON text to msgpack or CBOR.  Keys listed
+in KEYS (the field names of AXA messages) are replaced by their index in
+that tuple, at any depth, so that each costs one byte; other keys stay
+strings.  KEYS is part of the encoding and may only be appended to.
+
+Each encoded message is framed by its length as a 4-byte big-endian
+unsigned integer.  The `msgpack` and `cbor2` modules are used when they
+are installed, and a built-in encoder for the JSON data model otherwise.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.encoding import encoded, read_messages
+c = Client('https://axamd.sie-remote.net', apikey)
+with open('sra.msgpack', 'wb') as f:
+    for frame in encoded(c.sra(channels=[212], watches=['ch=212']), 'msgpack'):
+        f.write(frame)
+with open('sra.msgpack', 'rb') as f:
+    for msg in read_messages(f, 'msgpack'):
+        ...
+```
+'''
+
+import json
+import struct
+
+from .exceptions import AXAMDException
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+ENCODINGS = ('json', 'msgpack', 'cbor')
+
+KEYS = (
+    'tag', 'op', 'channel', 'time', 'af', 'src', 'dst', 'ttl', 'payload',
+    'proto', 'src_port', 'dst_port', 'flags', 'nmsg', 'field', 'field_idx',
+    'val_idx', 'vname', 'vid', 'mname', 'msgtype', 'an', 'missed', 'dropped',
+    'rlimit', 'filtered', 'last_report', 'sra_missed', 'sra_dropped',
+    'sra_rlimit', 'sra_filtered', 'message', 'source', 'operator', 'group',
+    'rrname', 'rrtype', 'rrclass', 'rdata', 'qname', 'qtype', 'qclass',
+    'enrichment',
+)
+
+_key_index = dict((k, i) for i, k in enumerate(KEYS))
+
+_length = struct.Struct('>I')
+
+_text = type(u'')
+
+try:
+    _integers = (int, long)
+except NameError:
+    _integers = (int,)
+
+def intern_keys(obj):
+    'Replaces the KEYS in the dict keys of `obj`, at any depth, by their index.'
+    if isinstance(obj, dict):
+        return dict((_key_index.get(k, k), intern_keys(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [intern_keys(v) for v in obj]
+    return obj
+
+def restore_keys(obj):
+    'Reverses intern_keys().'
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if isinstance(k, _integers) and not isinstance(k, bool):
+                if not 0 <= k < len(KEYS):
+                    raise AXAMDException('Unknown key index: {}'.format(k))
+                k = KEYS[k]
+            out[k] = restore_keys(v)
+        return out
+    if isinstance(obj, list):
+        return [restore_keys(v) for v in obj]
+    return obj
+
+def _pack_msgpack(obj, out):
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True:
+        out.append(b'\xc3')
+    elif obj is False:
+        out.append(b'\xc2')
+    elif isinstance(obj, _integers):
+        if 0 <= obj < 0x80:
+            out.append(struct.pack('B', obj))
+        elif -0x20 <= obj < 0:
+            out.append(struct.pack('b', obj))
+        elif obj >= 0:
+            for code, fmt, limit in ((0xcc, 'B', 1 << 8), (0xcd, 'H', 1 << 16),
+                    (0xce, 'I', 1 << 32), (0xcf, 'Q', 1 << 64)):
+                if obj < limit:
+                    out.append(struct.pack('>B' + fmt, code, obj))
+                    break
+            else:
+                raise AXAMDException('Integer too large: {}'.format(obj))
+        else:
+            for code, fmt, limit in ((0xd0, 'b', 1 << 7), (0xd1, 'h', 1 << 15),
+                    (0xd2, 'i', 1 << 31), (0xd3, 'q', 1 << 63)):
+                if obj >= -limit:
+                    out.append(struct.pack('>B' + fmt, code, obj))
+                    break
+            else:
+                raise AXAMDException('Integer too small: {}'.format(obj))
+    elif isinstance(obj, float):
+        out.append(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, _text):
+        data = obj.encode('utf-8')
+        n = len(data)
+        if n < 32:
+            out.append(struct.pack('B', 0xa0 | n))
+        elif n < 1 << 8:
+            out.append(struct.pack('>BB', 0xd9, n))
+        elif n < 1 << 16:
+            out.append(struct.pack('>BH', 0xda, n))
+        else:
+            out.append(struct.pack('>BI', 0xdb, n))
+        out.append(data)
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('B', 0x90 | n))
+        elif n < 1 << 16:
+            out.append(struct.pack('>BH', 0xdc, n))
+        else:
+            out.append(struct.pack('>BI', 0xdd, n))
+        for v in obj:
+            _pack_msgpack(v, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack('B', 0x80 | n))
+        elif n < 1 << 16:
+            out.append(struct.pack('>BH', 0xde, n))
+        else:
+            out.append(struct.pack('>BI', 0xdf, n))
+        for k, v in obj.items():
+            _pack_msgpack(k, out)
+            _pack_msgpack(v, out)
+    else:
+        raise AXAMDException('Cannot encode {!r}'.format(obj))
+
+def _cbor_head(major, n, out):
+    major <<= 5
+    if n < 24:
+        out.append(struct.pack('B', major | n))
+    elif n < 1 << 8:
+        out.append(struct.pack('>BB', major | 24, n))
+    elif n < 1 << 16:
+        out.append(struct.pack('>BH', major | 25, n))
+    elif n < 1 << 32:
+        out.append(struct.pack('>BI', major | 26, n))
+    elif n < 1 << 64:
+        out.append(struct.pack('>BQ', major | 27, n))
+    else:
+        raise AXAMDException('Integer too large: {}'.format(n))
+
+def _pack_cbor(obj, out):
+    if obj is None:
+        out.append(b'\xf6')
+    elif obj is True:
+        out.append(b'\xf5')
+    elif obj is False:
+        out.append(b'\xf4')
+    elif isinstance(obj, _integers):
+        if obj >= 0:
+            _cbor_head(0, obj, out)
+        else:
+            _cbor_head(1, -1 - obj, out)
+    elif isinstance(obj, float):
+        out.append(struct.pack('>Bd', 0xfb, obj))
+    elif isinstance(obj, _text):
+        data = obj.encode('utf-8')
+        _cbor_head(3, len(data), out)
+        out.append(data)
+    elif isinstance(obj, bytes):
+        _cbor_head(2, len(obj), out)
+        out.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        _cbor_head(4, len(obj), out)
+        for v in obj:
+            _pack_cbor(v, out)
+    elif isinstance(obj, dict):
+        _cbor_head(5, len(obj), out)
+        for k, v in obj.items():
+            _pack_cbor(k, out)
+            _pack_cbor(v, out)
+    else:
+        raise AXAMDException('Cannot encode {!r}'.format(obj))
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, n):
+        if self.offset + n > len(self.data):
+            raise AXAMDException('Truncated message')
+        chunk = self.data[self.offset:self.offset + n]
+        self.offset += n
+        return chunk
+
+    def unpack(self, fmt):
+        fmt = struct.Struct(fmt)
+        return fmt.unpack(self.take(fmt.size))[0]
+
+def _unpack_msgpack(r):
+    b = r.unpack('B')
+    if b < 0x80:
+        return b
+    if b >= 0xe0:
+        return b - 0x100
+    if 0xa0 <= b < 0xc0:
+        return r.take(b & 0x1f).decode('utf-8')
+    if 0x90 <= b < 0xa0:
+        return [_unpack_msgpack(r) for _ in range(b & 0x0f)]
+    if 0x80 <= b < 0x90:
+        return _unpack_map(r, b & 0x0f, _unpack_msgpack)
+    simple = {0xc0: None, 0xc2: False, 0xc3: True}
+    if b in simple:
+        return simple[b]
+    numbers = {0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+            0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+            0xca: '>f', 0xcb: '>d'}
+    if b in numbers:
+        return r.unpack(numbers[b])
+    sizes = {0xd9: '>B', 0xda: '>H', 0xdb: '>I', 0xc4: '>B', 0xc5: '>H', 0xc6: '>I',
+            0xdc: '>H', 0xdd: '>I', 0xde: '>H', 0xdf: '>I'}
+    if b not in sizes:
+        raise AXAMDException('Unsupported msgpack type 0x{:02x}'.format(b))
+    n = r.unpack(sizes[b])
+    if b in (0xd9, 0xda, 0xdb):
+        return r.take(n).decode('utf-8')
+    if b in (0xc4, 0xc5, 0xc6):
+        return r.take(n)
+    if b in (0xdc, 0xdd):
+        return [_unpack_msgpack(r) for _ in range(n)]
+    return _unpack_map(r, n, _unpack_msgpack)
+
+def _unpack_map(r, n, unpack):
+    out = {}
+    for _ in range(n):
+        k = unpack(r)
+        out[k] = unpack(r)
+    return out
+
+def _unpack_cbor(r):
+    b = r.unpack('B')
+    major, info = b >> 5, b & 0x1f
+    if major == 7:
+        simple = {20: False, 21: True, 22: None}
+        if info in simple:
+            return simple[info]
+        floats = {26: '>f', 27: '>d'}
+        if info in floats:
+            return r.unpack(floats[info])
+        if info == 25:
+            return _half(r.unpack('>H'))
+        raise AXAMDException('Unsupported CBOR value 0x{:02x}'.format(b))
+    if info < 24:
+        n = info
+    elif info <= 27:
+        n = r.unpack(('>B', '>H', '>I', '>Q')[info - 24])
+    else:
+        raise AXAMDException('Unsupported CBOR length 0x{:02x}'.format(b))
+    if major == 0:
+        return n
+    if major == 1:
+        return -1 - n
+    if major == 2:
+        return r.take(n)
+    if major == 3:
+        return r.take(n).decode('utf-8')
+    if major == 4:
+        return [_unpack_cbor(r) for _ in range(n)]
+    if major == 5:
+        return _unpack_map(r, n, _unpack_cbor)
+    # tags (major 6) are not produced for the JSON data model
+    raise AXAMDException('Unsupported CBOR type {}'.format(major))
+
+def _half(h):
+    # IEEE 754 half precision, as emitted by some CBOR encoders
+    sign = -1.0 if h & 0x8000 else 1.0
+    exponent, fraction = (h >> 10) & 0x1f, h & 0x3ff
+    if exponent == 0:
+        return sign * fraction * 2.0 ** -24
+    if exponent == 0x1f:
+        return sign * float('inf') if not fraction else float('nan')
+    return sign * (1 + fraction / 1024.0) * 2.0 ** (exponent - 15)
+
+def _dumps(obj, encoding):
+    if encoding == 'msgpack':
+        if msgpack is not None:
+            return msgpack.packb(obj, use_bin_type=True)
+        out = []
+        _pack_msgpack(obj, out)
+    else:
+        if cbor2 is not None:
+            return cbor2.dumps(obj)
+        out = []
+        _pack_cbor(obj, out)
+    return b''.join(out)
+
+def _loads(data, encoding):
+    if encoding == 'msgpack':
+        if msgpack is not None:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        r = _Reader(data)
+        obj = _unpack_msgpack(r)
+    else:
+        if cbor2 is not None:
+            return cbor2.loads(data)
+        r = _Reader(data)
+        obj = _unpack_cbor(r)
+    if r.offset != len(data):
+        raise AXAMDException('Trailing data after message')
+    return obj
+
+def _check(encoding):
+    if encoding not in ENCODINGS[1:]:
+        raise AXAMDException('Binary encoding must be one of {}'.format(', '.join(ENCODINGS[1:])))
+
+def encode(message, encoding='msgpack', intern=True):
+    '''
+    Encodes a message as one length-prefixed frame.
+
+    Args:
+        message (string or dict): A JSON message, or a parsed one.
+        encoding (string): 'msgpack' or 'cbor'.
+        intern (bool): Replace KEYS by their index.
+    Returns:
+        bytes
+    Raises:
+        AXAMDException: if the encoding is unknown.
+    '''
+    _check(encoding)
+    if not isinstance(message, dict):
+        message = json.loads(message)
+    if intern:
+        message = intern_keys(message)
+    data = _dumps(message, encoding)
+    return _length.pack(len(data)) + data
+
+def decode(data, encoding='msgpack'):
+    '''
+    Decodes one message (without its length prefix), restoring interned
+    keys.
+    '''
+    _check(encoding)
+    return restore_keys(_loads(data, encoding))
+
+def encoded(lines, encoding='msgpack', intern=True):
+    '''
+    Yields each message of `lines` as a length-prefixed frame; with
+    encoding 'json' the lines are passed through unchanged.
+    '''
+    if encoding == 'json':
+        for line in lines:
+            yield line
+        return
+    _check(encoding)
+    for line in lines:
+        yield encode(line, encoding, intern)
+
+def read_frames(f):
+    '''
+    Yields the payloads of the length-prefixed frames read from the binary
+    file `f`.
+
+    Raises:
+        AXAMDException: if the last frame is truncated.
+    '''
+    while True:
+        header = f.read(_length.size)
+        if not header:
+            return
+        if len(header) < _length.size:
+            raise AXAMDException('Truncated frame header')
+        n = _length.unpack(header)[0]
+        data = f.read(n)
+        if len(data) < n:
+            raise AXAMDException('Truncated frame')
+        yield data
+
+def read_messages(f, encoding='msgpack'):
+    'Yields the decoded messages of the frames read from `f`.'
+    for data in read_frames(f):
+        yield decode(data, encoding)
@@ -0,0 +1,429 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Enrichment of stream messages with IP and domain information.
+
+IP tables map address ranges to a value such as an ASN or prefix.  They
+are compiled once to a binary file of sorted, disjoint ranges, which
+IPTable opens with mmap and searches in place, so every process using a
+table shares one copy of its pages.  Nested prefixes are resolved to the
+most specific one when the table is compiled.  A PublicSuffixList is a trie
+built from public_suffix_list.dat and gives the registrable domain of a
+name.
+
+An Enricher adds an `enrichment` member to each message with the values
+found for the `src` and `dst` addresses, for addresses in the nmsg
+payload's `rdata`, and the registrable domains of its `rrname` and `qname`.
+Lookups go through an LRU cache.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.enrich import Enricher, IPTable, PublicSuffixList
+IPTable.compile(open('pfx2as.txt'), '/var/lib/axamd/asn.iptable')
+enricher = Enricher(ip_tables={'asn': '/var/lib/axamd/asn.iptable'},
+        public_suffixes='/usr/share/publicsuffix/public_suffix_list.dat')
+c = Client('https://axamd.sie-remote.net', apikey)
+for line in c.sra(channels=[212], watches=['ch=212'], enricher=enricher):
+    ...
+```
+
+Tables can also be compiled with
+`python -m axamd.client.enrich SOURCE TABLE`.
+'''
+
+from __future__ import print_function
+
+import binascii
+import collections
+import json
+import mmap
+import socket
+import struct
+import sys
+
+from .exceptions import AXAMDException
+
+_text = (type(u''), str)
+
+_magic = b'AXIP'
+_header = struct.Struct('>4sHHII')  # magic, version, reserved, IPv4 count, IPv6 count
+_v4 = struct.Struct('>4s4sI')       # start, end, value offset
+_v6 = struct.Struct('>16s16sI')
+_length = struct.Struct('>H')
+
+def _to_int(packed):
+    return int(binascii.hexlify(packed), 16)
+
+def _to_bytes(n, size):
+    return binascii.unhexlify('{:0{}x}'.format(n, size * 2))
+
+def _parse_address(s):
+    family = ':' in s and socket.AF_INET6 or socket.AF_INET
+    return socket.inet_pton(family, s)
+
+def _parse_range(s):
+    '''
+    Returns (start, end, size) for 'ADDRESS/LENGTH' or 'START-END'.
+    '''
+    if '-' in s:
+        first, _, last = s.partition('-')
+        start, end = _parse_address(first.strip()), _parse_address(last.strip())
+        if len(start) != len(end):
+            raise ValueError('mixed address families')
+        return _to_int(start), _to_int(end), len(start)
+    address, _, length = s.partition('/')
+    packed = _parse_address(address)
+    bits = len(packed) * 8
+    length = int(length) if length else bits
+    if not 0 <= length <= bits:
+        raise ValueError('invalid prefix length')
+    host = (1 << (bits - length)) - 1
+    start = _to_int(packed) & ~host
+    return start, start | host, len(packed)
+
+def _flatten(ranges):
+    '''
+    Turns ranges sorted by (start, -end), possibly nested, into disjoint
+    ranges labelled with the value of the innermost range.
+    '''
+    out = []
+    stack = []
+    cursor = [None]
+
+    def emit(start, end, value):
+        if start > end:
+            return
+        if out and out[-1][1] + 1 == start and out[-1][2] == value:
+            out[-1] = (out[-1][0], end, value)
+        else:
+            out.append((start, end, value))
+        cursor[0] = end + 1
+
+    for start, end, value in ranges:
+        while stack and stack[-1][1] < start:
+            _, top_end, top_value = stack.pop()
+            emit(cursor[0], top_end, top_value)
+        if stack:
+            if end > stack[-1][1]:
+                raise AXAMDException('Overlapping ranges at {:x}'.format(start))
+            emit(cursor[0], start - 1, stack[-1][2])
+        cursor[0] = start
+        stack.append((start, end, value))
+    while stack:
+        _, top_end, top_value = stack.pop()
+        emit(cursor[0], top_end, top_value)
+    return out
+
+class IPTable:
+    '''
+    A memory-mapped table of IP address ranges.
+    '''
+    def __init__(self, path):
+        '''
+        Args:
+            path (string): File written by IPTable.compile().
+        Raises:
+            AXAMDException: if the file is not an IP table.
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise AXAMDException('{}: not an IP table'.format(path))
+        if len(self._mm) < _header.size:
+            raise AXAMDException('{}: not an IP table'.format(path))
+        magic, version, _, self._n4, self._n6 = _header.unpack_from(self._mm, 0)
+        if magic != _magic or version != 1:
+            raise AXAMDException('{}: not an IP table'.format(path))
+        self._base4 = _header.size
+        self._base6 = self._base4 + self._n4 * _v4.size
+
+    def __len__(self):
+        return self._n4 + self._n6
+
+    def lookup(self, address):
+        '''
+        Returns the value of the range containing `address` (a string), or
+        None if there is none or the address is invalid.
+        '''
+        try:
+            packed = _parse_address(address)
+        except (socket.error, ValueError, TypeError):
+            return None
+        if len(packed) == 4:
+            record, base, n = _v4, self._base4, self._n4
+        else:
+            record, base, n = _v6, self._base6, self._n6
+        mm = self._mm
+        size = len(packed)
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = base + mid * record.size
+            if mm[off:off + size] <= packed:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start, end, value = record.unpack_from(mm, base + (lo - 1) * record.size)
+        if packed > end:
+            return None
+        length, = _length.unpack_from(mm, value)
+        value += _length.size
+        return mm[value:value + length].decode('utf-8')
+
+    def close(self):
+        self._mm.close()
+
+    @staticmethod
+    def compile(lines, path):
+        '''
+        Writes an IP table from lines of 'ADDRESS/LENGTH VALUE' or
+        'START-END VALUE'.  Blank lines and lines starting with # are
+        skipped.  Nested ranges resolve to the most specific one.
+
+        Args:
+            lines (iterable[string]): Source lines.
+            path (string): Output file.
+        Returns:
+            the number of disjoint ranges written
+        Raises:
+            AXAMDException: if a line is invalid or ranges partially overlap.
+        '''
+        ranges = {4: [], 16: []}
+        for n, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(None, 1)
+            try:
+                start, end, size = _parse_range(parts[0])
+            except (socket.error, ValueError) as e:
+                raise AXAMDException('line {}: {}: {}'.format(n, parts[0], e))
+            ranges[size].append((start, end, len(parts) > 1 and parts[1] or ''))
+
+        flat = {}
+        for size in (4, 16):
+            ranges[size].sort(key=lambda r: (r[0], -r[1]))
+            flat[size] = _flatten(ranges[size])
+
+        # values are stored once each, after the ranges
+        values = {}
+        blob = []
+        tail = [_header.size + len(flat[4]) * _v4.size + len(flat[16]) * _v6.size]
+        def value_offset(value):
+            if value not in values:
+                data = value.encode('utf-8')
+                values[value] = tail[0]
+                blob.append(_length.pack(len(data)) + data)
+                tail[0] += len(blob[-1])
+            return values[value]
+
+        with open(path, 'wb') as f:
+            f.write(_header.pack(_magic, 1, 0, len(flat[4]), len(flat[16])))
+            for size, record in ((4, _v4), (16, _v6)):
+                for start, end, value in flat[size]:
+                    f.write(record.pack(_to_bytes(start, size), _to_bytes(end, size),
+                        value_offset(value)))
+            for data in blob:
+                f.write(data)
+        return len(flat[4]) + len(flat[16])
+
+class PublicSuffixList:
+    '''
+    A trie of public suffix rules in the format of public_suffix_list.dat.
+    '''
+    def __init__(self, lines):
+        '''
+        Args:
+            lines (iterable[string]): Rules, one per line; // comments and
+                blank lines are skipped.
+        '''
+        self._root = {}
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            rule = line.strip().split(None, 1)
+            if not rule or rule[0].startswith('//'):
+                continue
+            rule = rule[0].lower()
+            exception = rule.startswith('!')
+            node = self._root
+            for label in reversed(rule.lstrip('!').split('.')):
+                node = node.setdefault(label, {})
+            node[exception and '!' or ''] = True
+
+    @classmethod
+    def load(cls, path):
+        'Builds the trie from a file.'
+        with open(path, 'rb') as f:
+            return cls(f)
+
+    def suffix_labels(self, labels):
+        '''
+        Returns the number of trailing labels of `labels` (most significant
+        last) that form its public suffix.
+        '''
+        length = 1
+        nodes = [self._root]
+        for i, label in enumerate(reversed(labels)):
+            # follow both the exact label and a wildcard: the longest
+            # matching rule wins, whichever branch it is on
+            children = [node[key] for node in nodes for key in (label, '*') if key in node]
+            if not children:
+                break
+            for child in children:
+                if '!' in child:
+                    return i
+                if '' in child:
+                    length = i + 1
+            nodes = children
+        return length
+
+    def registrable_domain(self, name):
+        '''
+        Returns the registrable domain (public suffix plus one label) of
+        `name`, or None if it is a public suffix itself.
+        '''
+        labels = name.rstrip('.').lower().split('.')
+        n = self.suffix_labels(labels) + 1
+        if not labels[0] or len(labels) < n:
+            return None
+        return '.'.join(labels[-n:])
+
+class LRUCache:
+    '''
+    A least-recently-used cache of `size` entries.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+
+    def get(self, key, compute):
+        '''
+        Returns the cached value for `key`, calling compute(key) on a miss.
+        '''
+        data = self._data
+        try:
+            value = data.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = compute(key)
+            self.misses += 1
+            if len(data) >= self.size:
+                data.popitem(last=False)
+        data[key] = value
+        return value
+
+class Enricher:
+    '''
+    Adds IP table values and registrable domains to messages.
+    '''
+    def __init__(self, ip_tables=None, public_suffixes=None, cache_size=65536):
+        '''
+        Args:
+            ip_tables (dict): Maps a name (e.g. 'asn') to an IPTable or the
+                path of one.
+            public_suffixes (PublicSuffixList or string): Suffix list, or
+                the path of public_suffix_list.dat.
+            cache_size (int): Entries in each LRU cache.
+        '''
+        self.ip_tables = dict((name, isinstance(t, IPTable) and t or IPTable(t))
+                for name, t in (ip_tables or {}).items())
+        if public_suffixes is not None and not isinstance(public_suffixes, PublicSuffixList):
+            public_suffixes = PublicSuffixList.load(public_suffixes)
+        self.public_suffixes = public_suffixes
+        self.ip_cache = LRUCache(cache_size)
+        self.domain_cache = LRUCache(cache_size)
+
+    def _ip(self, address):
+        info = {}
+        for name, table in self.ip_tables.items():
+            value = table.lookup(address)
+            if value is not None:
+                info[name] = value
+        return info
+
+    def _domain(self, name):
+        return self.public_suffixes.registrable_domain(name)
+
+    def enrich(self, msg):
+        '''
+        Returns the enrichment dict for a decoded message, or None if
+        nothing was found.
+        '''
+        result = {}
+        if self.ip_tables:
+            for field in ('src', 'dst'):
+                address = msg.get(field)
+                if isinstance(address, _text):
+                    info = self.ip_cache.get(address, self._ip)
+                    if info:
+                        result[field] = info
+        message = (msg.get('nmsg') or {}).get('message') or {}
+        if not isinstance(message, dict):
+            return result or None
+        if self.ip_tables:
+            rdata = message.get('rdata')
+            found = {}
+            for item in isinstance(rdata, list) and rdata or [rdata]:
+                if isinstance(item, _text) and (':' in item or item[:1].isdigit()):
+                    info = self.ip_cache.get(item, self._ip)
+                    if info:
+                        found[item] = info
+            if found:
+                result['rdata'] = found
+        if self.public_suffixes is not None:
+            for field in ('rrname', 'qname'):
+                name = message.get(field)
+                if isinstance(name, _text):
+                    domain = self.domain_cache.get(name, self._domain)
+                    if domain is not None:
+                        result[field] = {'domain': domain}
+        return result or None
+
+    def __call__(self, line):
+        '''
+        Returns `line` (a JSON message) with an `enrichment` member added
+        when anything was found.
+        '''
+        msg = json.loads(line)
+        if not isinstance(msg, dict):
+            return line
+        enrichment = self.enrich(msg)
+        if enrichment is None:
+            return line
+        msg['enrichment'] = enrichment
+        return json.dumps(msg, separators=(',', ':'))
+
+def main():
+    if len(sys.argv) != 3:
+        print('usage: python -m axamd.client.enrich SOURCE TABLE', file=sys.stderr)
+        return 2
+    with open(sys.argv[1], 'rb') as f:
+        n = IPTable.compile(f, sys.argv[2])
+    print('{}: {} ranges'.format(sys.argv[2], n))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Compact representations of IP watch hits.
+
+IP hits (darknet and other IP-only channels) are decoded either into IPHit
+records, which use __slots__, or appended to IPHitColumns, which keeps one
+contiguous array per field.  In both, addresses are integers, TCP flags a
+bitmask (see FLAGS), protocol and channel names are interned, and the
+base64 payload is only decoded when it is accessed.
+
+In IPHitColumns an address is split into two unsigned 64-bit columns
+(`src_hi`/`src_lo`, `dst_hi`/`dst_lo`), with IPv4 addresses stored as
+IPv4-mapped IPv6 addresses, so prefix and port selections are simple
+integer comparisons.  to_numpy() exposes the columns as NumPy arrays
+without copying.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.iphit import IPHitColumns
+c = Client('https://axamd.sie-remote.net', apikey)
+hits = IPHitColumns()
+for line in c.sra(channels=[25], watches=['ip=10.0.0.0/8'], max_messages=1000000):
+    hits.append(line)
+scanners = hits.in_network('192.0.2.0/24')
+```
+'''
+
+import array
+import base64
+import binascii
+import json
+import socket
+import sys
+
+from .batch import parse_time_ns
+from .exceptions import AXAMDException
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    _intern = intern
+except NameError:
+    _intern = sys.intern
+
+# bit values of the TCP flags
+FLAGS = {'FIN': 1, 'SYN': 2, 'ACK': 4, 'RST': 8}
+
+_MAPPED = 0xffff << 32
+_LOW = (1 << 64) - 1
+
+try:
+    array.array('q')
+    _INT64, _UINT64 = 'q', 'Q'
+except ValueError:
+    # Python 2 arrays have no 64-bit codes; double holds times to ~0.2us
+    _INT64, _UINT64 = 'd', 'd'
+
+def _address(s):
+    # returns (version, integer)
+    family, version = (socket.AF_INET6, 6) if ':' in s else (socket.AF_INET, 4)
+    try:
+        packed = socket.inet_pton(family, s)
+    except (socket.error, ValueError):
+        raise AXAMDException('Invalid address: {!r}'.format(s))
+    return version, int(binascii.hexlify(packed), 16)
+
+def _format_address(version, value):
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, binascii.unhexlify('{:08x}'.format(value)))
+    return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify('{:032x}'.format(value)))
+
+def _mapped(version, value):
+    # the 128-bit value of an address, IPv4 addresses mapped into IPv6
+    return value | _MAPPED if version == 4 else value
+
+def _flags(names):
+    mask = 0
+    for name in names or ():
+        try:
+            mask |= FLAGS[name]
+        except KeyError:
+            raise AXAMDException('Unknown TCP flag: {!r}'.format(name))
+    return mask
+
+def flag_names(mask):
+    'Returns the names of the flags set in a bitmask, in FLAGS order.'
+    return [name for name, bit in sorted(FLAGS.items(), key=lambda i: i[1]) if mask & bit]
+
+def _message(msg):
+    if isinstance(msg, dict):
+        return msg
+    return json.loads(msg)
+
+def is_ip_hit(msg):
+    'Returns whether a parsed message is an IP watch hit.'
+    return msg.get('op') == 'WATCH HIT' and 'af' in msg and 'src' in msg
+
+class IPHit(object):
+    '''
+    An IP watch hit.  `src` and `dst` are integers of address `version`
+    4 or 6, `flags` a bitmask of FLAGS and `time` nanoseconds since the
+    epoch.  Missing fields are None.
+    '''
+    __slots__ = ('tag', 'channel', 'time', 'version', 'src', 'dst', 'ttl',
+            'proto', 'src_port', 'dst_port', 'flags', '_payload')
+
+    def __init__(self, msg):
+        '''
+        Args:
+            msg (dict or string): An IP watch hit.
+        Raises:
+            AXAMDException: if it is not one, or an address is invalid.
+        '''
+        msg = _message(msg)
+        if not is_ip_hit(msg):
+            raise AXAMDException('Not an IP watch hit')
+        self.tag = msg.get('tag')
+        channel = msg.get('channel')
+        self.channel = channel and _intern(str(channel))
+        self.time = parse_time_ns(msg.get('time'))
+        self.version, self.src = _address(msg['src'])
+        self.dst = None
+        if msg.get('dst') is not None:
+            _, self.dst = _address(msg['dst'])
+        self.ttl = msg.get('ttl')
+        proto = msg.get('proto')
+        self.proto = proto and _intern(str(proto))
+        self.src_port = msg.get('src_port')
+        self.dst_port = msg.get('dst_port')
+        self.flags = _flags(msg.get('flags'))
+        self._payload = msg.get('payload')
+
+    @property
+    def src_address(self):
+        return _format_address(self.version, self.src)
+
+    @property
+    def dst_address(self):
+        return None if self.dst is None else _format_address(self.version, self.dst)
+
+    @property
+    def flag_names(self):
+        return flag_names(self.flags)
+
+    @property
+    def payload(self):
+        'The decoded payload (bytes, decoded on each access) or None.'
+        return None if self._payload is None else base64.b64decode(self._payload)
+
+    def __repr__(self):
+        return '<IPHit {} {}:{} > {}:{}>'.format(self.proto, self.src_address,
+                self.src_port, self.dst_address, self.dst_port)
+
+def iter_ip_hits(lines):
+    '''
+    Yields an IPHit for each IP watch hit in `lines` (strings as returned
+    by Client.sra(), or parsed dicts), skipping other messages.
+    '''
+    for line in lines:
+        msg = _message(line)
+        if is_ip_hit(msg):
+            yield IPHit(msg)
+
+# column name -> array typecode.  Missing integers are -1 (0 for flags).
+COLUMNS = (
+    ('tag', 'l'),
+    ('channel', 'H'),
+    ('time', _INT64),
+    ('version', 'B'),
+    ('src_hi', _UINT64),
+    ('src_lo', _UINT64),
+    ('dst_hi', _UINT64),
+    ('dst_lo', _UINT64),
+    ('ttl', 'h'),
+    ('proto', 'B'),
+    ('src_port', 'l'),
+    ('dst_port', 'l'),
+    ('flags', 'B'),
+)
+
+def _int(value):
+    return -1 if value is None else value
+
+class IPHitColumns:
+    '''
+    IP watch hits stored column-wise in arrays.
+
+    `channel` and `proto` columns hold 1-based indexes into the `channels`
+    and `protocols` lists, 0 if missing.  Payloads are kept base64-encoded in a list and
+    decoded by payload().
+
+    Attributes:
+        columns (dict): Column name to array.array, see COLUMNS.
+        channels (list[string]): Interned channel names.
+        protocols (list[string]): Interned protocol names.
+    '''
+    def __init__(self):
+        self.columns = dict((name, array.array(code)) for name, code in COLUMNS)
+        self.channels = []
+        self.protocols = []
+        self._payloads = []
+        self._channel_index = {}
+        self._proto_index = {}
+
+    @staticmethod
+    def _intern(table, index, value, limit):
+        # 1-based index of value in table, 0 for None
+        if value is None:
+            return 0
+        i = index.get(value)
+        if i is None:
+            if len(table) >= limit:
+                raise AXAMDException('Too many distinct values: {!r}'.format(value))
+            table.append(_intern(str(value)))
+            i = index[value] = len(table)
+        return i
+
+    def __len__(self):
+        return len(self.columns['version'])
+
+    def append(self, msg):
+        '''
+        Appends `msg` (a string or parsed dict) if it is an IP watch hit.
+        Returns whether it was appended.
+        '''
+        msg = _message(msg)
+        if not is_ip_hit(msg):
+            return False
+        c = self.columns
+        version, src = _address(msg['src'])
+        src = _mapped(version, src)
+        dst = 0
+        if msg.get('dst') is not None:
+            dst = _mapped(*_address(msg['dst']))
+        tag = msg.get('tag')
+        t = parse_time_ns(msg.get('time'))
+        c['tag'].append(tag if isinstance(tag, int) else -1)
+        c['channel'].append(self._intern(self.channels, self._channel_index,
+                msg.get('channel'), 0xffff))
+        c['time'].append(_int(t))
+        c['version'].append(version)
+        c['src_hi'].append(src >> 64)
+        c['src_lo'].append(src & _LOW)
+        c['dst_hi'].append(dst >> 64)
+        c['dst_lo'].append(dst & _LOW)
+        c['ttl'].append(_int(msg.get('ttl')))
+        c['proto'].append(self._intern(self.protocols, self._proto_index,
+                msg.get('proto'), 0xff))
+        c['src_port'].append(_int(msg.get('src_port')))
+        c['dst_port'].append(_int(msg.get('dst_port')))
+        c['flags'].append(_flags(msg.get('flags')))
+        self._payloads.append(msg.get('payload'))
+        return True
+
+    def extend(self, lines):
+        'Appends the IP watch hits of `lines`; returns how many there were.'
+        return sum(1 for line in lines if self.append(line))
+
+    def address(self, i, column='src'):
+        'Returns the `src` or `dst` address of hit `i` as a string.'
+        value = (int(self.columns[column + '_hi'][i]) << 64) | int(self.columns[column + '_lo'][i])
+        if self.columns['version'][i] == 4:
+            return _format_address(4, value & 0xffffffff)
+        return _format_address(6, value)
+
+    def proto(self, i):
+        'Returns the protocol name of hit `i`, or None.'
+        p = self.columns['proto'][i]
+        return self.protocols[p - 1] if p else None
+
+    def payload(self, i):
+        'Returns the decoded payload of hit `i` (bytes) or None.'
+        p = self._payloads[i]
+        return None if p is None else base64.b64decode(p)
+
+    def _network(self, network):
+        address, _, length = network.partition('/')
+        version, value = _address(address)
+        bits = 32 if version == 4 else 128
+        length = int(length) if length else bits
+        if not 0 <= length <= bits:
+            raise AXAMDException('Invalid network: {!r}'.format(network))
+        if version == 4:
+            length += 96
+        mask = ((1 << 128) - 1) ^ ((1 << (128 - length)) - 1)
+        value = _mapped(version, value) & mask
+        return value >> 64, value & _LOW, mask >> 64, mask & _LOW
+
+    def in_network(self, network, column='src'):
+        '''
+        Returns, for each hit, whether its `src` or `dst` address is in
+        `network` ('192.0.2.0/24', '2001:db8::/32').  The result is a NumPy
+        boolean array if NumPy is available, a list otherwise.
+        '''
+        value_hi, value_lo, mask_hi, mask_lo = self._network(network)
+        hi, lo = self.columns[column + '_hi'], self.columns[column + '_lo']
+        if numpy is not None and _UINT64 == 'Q':
+            hi = numpy.frombuffer(hi, dtype=numpy.uint64)
+            lo = numpy.frombuffer(lo, dtype=numpy.uint64)
+            return ((hi & numpy.uint64(mask_hi)) == numpy.uint64(value_hi)) & \
+                    ((lo & numpy.uint64(mask_lo)) == numpy.uint64(value_lo))
+        return [int(h) & mask_hi == value_hi and int(l) & mask_lo == value_lo
+                for h, l in zip(hi, lo)]
+
+    def to_numpy(self):
+        '''
+        Returns the columns as a dict of NumPy arrays sharing the arrays'
+        memory; appending afterwards invalidates them.
+
+        Raises:
+            AXAMDException: if NumPy is not available.
+        '''
+        if numpy is None:
+            raise AXAMDException('NumPy is required for to_numpy()')
+        return dict((name, numpy.frombuffer(a, dtype=a.typecode) if len(a)
+                else numpy.array([], dtype=a.typecode))
+                for name, a in self.columns.items())
+
+    def __getitem__(self, i):
+        'Returns hit `i` as an IPHit.'
+        c = self.columns
+        hit = IPHit.__new__(IPHit)
+        hit.tag = c['tag'][i] if c['tag'][i] >= 0 else None
+        hit.channel = self.channels[c['channel'][i] - 1] if c['channel'][i] else None
+        hit.time = int(c['time'][i]) if c['time'][i] >= 0 else None
+        hit.version = c['version'][i]
+        low = 0xffffffff if hit.version == 4 else (1 << 128) - 1
+        hit.src = ((int(c['src_hi'][i]) << 64) | int(c['src_lo'][i])) & low
+        hit.dst = None
+        if c['dst_hi'][i] or c['dst_lo'][i]:
+            hit.dst = ((int(c['dst_hi'][i]) << 64) | int(c['dst_lo'][i])) & low
+        for name in ('ttl', 'src_port', 'dst_port'):
+            setattr(hit, name, c[name][i] if c[name][i] >= 0 else None)
+        hit.proto = self.proto(i)
+        hit.flags = c['flags'][i]
+        hit._payload = self._payloads[i]
+        return hit
@@ -0,0 +1,347 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Streams whose watches or anomalies can be changed without a gap.
+
+A LiveStream yields the messages of an SRA or RAD stream.  update() opens a
+second stream with the new parameters while the first keeps delivering.
+The new stream's messages are held back until it delivers a hit the old
+stream has already delivered, showing that the two overlap, or until a
+grace period has passed since its first message.  It then becomes current
+and the old one is closed.  Messages the new stream repeats from the
+overlap are dropped.
+
+The server numbers tags by position, so the same watch may get a different
+tag in the new stream.  A LiveStream gives every distinct watch (SRA) or
+anomaly (RAD) a stable tag the first time it is seen and rewrites the
+`tag` of each message to it.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.live import LiveStream
+c = Client('https://axamd.sie-remote.net', apikey)
+stream = LiveStream(c, channels=[212], watches=['ip=10.0.0.0/8'])
+for line in stream:
+    ...
+# from another thread
+stream.update(watches=['ip=10.0.0.0/8', 'ip=192.168.0.0/16'])
+```
+'''
+
+import collections
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .prefilter import scan_op
+from .six_mini import reraise
+
+logger = logging.getLogger(__name__)
+
+# the tag as the first member of the top-level object, as servers send it
+_tag_re = re.compile(r'\A\s*\{\s*"tag"\s*:\s*([0-9]+)')
+
+_hit_ops = frozenset([b'WATCH HIT', b'ANOMALY HIT'])
+
+_end = object()
+
+class _Error:
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+def _anomaly_key(anomaly):
+    return json.dumps(anomaly.to_dict(), sort_keys=True)
+
+class _Generation:
+    def __init__(self, live, client, channels, watches, anomalies, tags):
+        self.client = client
+        self.channels = channels
+        self.watches = watches
+        self.anomalies = anomalies
+        self.tags = tags
+        self.delivered = 0
+        self.stopping = threading.Event()
+        self._live = live
+        self._thread = threading.Thread(target=self._read, name='axamd-live')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def _open(self):
+        params = self._live.params
+        if self.anomalies is not None:
+            return self.client.rad(self.anomalies, **params)
+        return self.client.sra(self.channels, self.watches, **params)
+
+    def _read(self):
+        try:
+            for line in self._open():
+                if not self._put(line):
+                    return
+        except Exception:
+            if not self.stopping.is_set():
+                self._put(_Error(sys.exc_info()))
+            return
+        self._put(_end)
+
+    def _put(self, item):
+        q = self._live._queue
+        while not self.stopping.is_set():
+            try:
+                q.put((self, item), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def stop(self):
+        self.stopping.set()
+        self.client.close()
+
+class LiveStream:
+    '''
+    An SRA or RAD stream that can be updated in place.
+
+    Attributes:
+        switches (int): Updates that have taken over.
+        duplicates (int): Overlapping messages dropped.
+    '''
+    def __init__(self, client, channels=None, watches=None, anomalies=None,
+            dedupe=10000, queue_size=10000, grace=2.0, **params):
+        '''
+        Args:
+            client (Client): Client whose settings and session are used;
+                each stream is opened with a Client.fork().
+            channels (list[int]): SRA channels.
+            watches (list[string]): SRA watches.
+            anomalies (list[Anomaly]): RAD anomalies; selects RAD mode.
+            dedupe (int): Messages remembered to detect overlap, and the
+                number of messages of a new stream checked against them.
+            queue_size (int): Messages buffered from the streams.
+            grace (float): Seconds after its first message at which an
+                update takes over even if it has not caught up with the
+                current stream.
+            params: Other sra() or rad() arguments, e.g. rate_limit.
+        '''
+        self.client = client
+        self.params = params
+        self.dedupe = dedupe
+        self.grace = grace
+        self.switches = 0
+        self.duplicates = 0
+        self._stable = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max(1, queue_size))
+        self._recent = collections.deque()
+        self._recent_set = set()
+        self._current = self._generation(channels or [], watches or [], anomalies)
+        self._pending = None
+        self._closed = False
+
+    def _stable_tag(self, key):
+        if key not in self._stable:
+            self._stable[key] = len(self._stable) + 1
+        return self._stable[key]
+
+    def _generation(self, channels, watches, anomalies):
+        if anomalies is not None:
+            keys = [_anomaly_key(a) for a in anomalies]
+        else:
+            keys = list(watches)
+        tags = dict((i + 1, self._stable_tag(key)) for i, key in enumerate(keys))
+        return _Generation(self, self.client.fork(), channels, watches, anomalies, tags)
+
+    @property
+    def tags(self):
+        '''
+        Maps each watch string (SRA) or anomaly (RAD, as canonical JSON of
+        Anomaly.to_dict()) seen so far to its stable tag.
+        '''
+        with self._lock:
+            return dict(self._stable)
+
+    def update(self, channels=None, watches=None, anomalies=None):
+        '''
+        Replaces the stream parameters.  Arguments that are None keep their
+        current value.  May be called from another thread.  A previous
+        update that has not taken over yet is abandoned.
+        '''
+        with self._lock:
+            if self._closed:
+                return
+            base = self._pending or self._current
+            if base.anomalies is not None:
+                generation = self._generation(None, None,
+                        base.anomalies if anomalies is None else anomalies)
+            else:
+                generation = self._generation(
+                        base.channels if channels is None else channels,
+                        base.watches if watches is None else watches, None)
+            old, self._pending = self._pending, generation
+        if old is not None:
+            old.stop()
+        generation.start()
+
+    def _remap(self, generation, line):
+        m = _tag_re.match(line)
+        if m is not None:
+            tag = generation.tags.get(int(m.group(1)))
+            if tag is None:
+                return line
+            return '{}{}{}'.format(line[:m.start(1)], tag, line[m.end(1):])
+        if '"tag"' not in line:
+            return line
+        # the tag is not first; only the top-level one may be rewritten
+        try:
+            msg = json.loads(line, object_pairs_hook=collections.OrderedDict)
+        except ValueError:
+            return line
+        tag = isinstance(msg, dict) and msg.get('tag')
+        if type(tag) is not int or tag not in generation.tags:
+            return line
+        msg['tag'] = generation.tags[tag]
+        return json.dumps(msg, separators=(',', ':'))
+
+    def _remember(self, line):
+        if not self.dedupe:
+            return
+        self._recent.append(line)
+        self._recent_set.add(line)
+        if len(self._recent) > self.dedupe:
+            self._recent_set.discard(self._recent.popleft())
+
+    def _take_over(self, generation):
+        with self._lock:
+            if self._pending is not generation:
+                return False
+            old, self._current, self._pending = self._current, generation, None
+        old.stop()
+        self.switches += 1
+        logger.info('live stream updated')
+        return True
+
+    def _deliver(self, generation, line):
+        # returns the line to yield, or None for a repeat from the overlap
+        generation.delivered += 1
+        if self.switches and generation.delivered <= self.dedupe \
+                and line in self._recent_set:
+            self.duplicates += 1
+            return None
+        self._remember(line)
+        return line
+
+    def _switch(self, generation, held):
+        # makes `generation` current and yields the messages it delivered
+        # while the old one was still draining
+        if self._take_over(generation):
+            for line in held:
+                line = self._deliver(generation, line)
+                if line is not None:
+                    yield line
+        del held[:]
+
+    def _caught_up(self, line, held):
+        if self.dedupe and len(held) >= self.dedupe:
+            return True
+        if line not in self._recent_set:
+            return False
+        return scan_op(line.encode('utf-8')) in _hit_ops
+
+    def __iter__(self):
+        self._current.start()
+        held = []       # messages of the pending update, remapped
+        held_by = None
+        deadline = None
+        try:
+            while True:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.time())
+                try:
+                    generation, item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    generation, item = None, None
+                with self._lock:
+                    pending = self._pending
+                if held_by is not None and held_by is not pending:
+                    # abandoned, or took over when the old stream ended
+                    del held[:]
+                    held_by = deadline = None
+                if generation is None:
+                    if held_by is not None:
+                        for line in self._switch(held_by, held):
+                            yield line
+                        held_by = deadline = None
+                    continue
+                if generation.stopping.is_set():
+                    continue
+                current = self._current
+                if item is _end or isinstance(item, _Error):
+                    if generation is current:
+                        if pending is not None and item is _end:
+                            # the old stream ended first; let the new one take over
+                            for line in self._switch(pending, held):
+                                yield line
+                            held_by = deadline = None
+                            continue
+                        if isinstance(item, _Error):
+                            reraise(*item.exc_info)
+                        return
+                    if isinstance(item, _Error):
+                        logger.error('live stream update failed: {}'.format(item.exc_info[1]))
+                    with self._lock:
+                        if self._pending is generation:
+                            self._pending = None
+                    generation.stop()
+                    continue
+                line = self._remap(generation, item)
+                if generation is not current:
+                    if generation is not pending:
+                        continue
+                    # keep draining the current stream until this one overlaps it
+                    if held_by is None:
+                        held_by = generation
+                        deadline = time.time() + self.grace
+                    held.append(line)
+                    if self._caught_up(line, held):
+                        for line in self._switch(generation, held):
+                            yield line
+                        held_by = deadline = None
+                    continue
+                line = self._deliver(generation, line)
+                if line is not None:
+                    yield line
+        finally:
+            self.close()
+
+    def close(self):
+        'Closes the current stream and any pending update.'
+        with self._lock:
+            self._closed = True
+            generations = [g for g in (self._current, self._pending) if g is not None]
+            self._pending = None
+        for generation in generations:
+            generation.stop()
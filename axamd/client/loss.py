@@ -0,0 +1,299 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Loss accounting from MISSED and RAD MISSED reports.
+
+A LossTracker watches a stream's raw records as its record filter.  Hits
+are counted per tag (or, given the stream's anomalies, per module) by
+scanning the raw bytes; MISSED and RAD MISSED reports are decoded and
+their counters added up.  Counts are kept in windows of `window` seconds,
+of which the last `windows` are kept per key in a ring buffer.  The
+stream as a whole has the key None; tagless reports only count there.
+Windows in which nothing arrived are not recorded.
+
+Each window derives:
+
+    lost             missed + dropped + rlimit, plus the sra_ counters of
+                     RAD MISSED
+    delivered_ratio  hits / filtered (None before the first report)
+    loss_ratio       lost / (lost + hits)
+    rlimit_pressure  (rlimit + sra_rlimit) / (lost + hits)
+
+Callbacks registered with on() run when a closed window crosses a
+threshold, e.g. to raise a stream's rate_limit or split it.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.loss import LossTracker
+c = Client('https://axamd.sie-remote.net', apikey)
+tracker = LossTracker(window=60, windows=60)
+tracker.on('rlimit_pressure', 0.1, lambda key, w: logger.warning('rate limited'))
+for line in c.sra(channels=[212], watches=['ch=212'], report_interval=10,
+        record_filter=tracker):
+    ...
+print(tracker.totals())
+```
+'''
+
+import collections
+import json
+import threading
+import time
+
+from .exceptions import AXAMDException
+from .prefilter import scan_op, scan_tag
+
+REPORT_FIELDS = {
+    'MISSED': ('missed', 'dropped', 'rlimit', 'filtered'),
+    'RAD MISSED': ('sra_missed', 'sra_dropped', 'sra_rlimit', 'sra_filtered',
+        'dropped', 'rlimit', 'filtered'),
+}
+
+COUNTERS = ('missed', 'dropped', 'rlimit', 'filtered',
+        'sra_missed', 'sra_dropped', 'sra_rlimit', 'sra_filtered')
+
+METRICS = ('lost', 'delivered_ratio', 'loss_ratio', 'rlimit_pressure')
+
+_hit_ops = frozenset([b'WATCH HIT', b'ANOMALY HIT'])
+_report_ops = dict((op.encode('utf-8'), op) for op in REPORT_FIELDS)
+
+class Window:
+    '''
+    Counts of one window.
+
+    Attributes:
+        start (float): Start of the window (seconds since the epoch).
+        end (float): End of the window.
+        hits (int): Watch and anomaly hits delivered.
+        reports (int): MISSED and RAD MISSED reports.
+        counters (dict): Sums of the report counters, see COUNTERS.
+    '''
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.hits = 0
+        self.reports = 0
+        self.counters = dict((name, 0) for name in COUNTERS)
+
+    def add(self, other):
+        'Adds the counts of another window.'
+        self.hits += other.hits
+        self.reports += other.reports
+        for name in COUNTERS:
+            self.counters[name] += other.counters[name]
+
+    @property
+    def lost(self):
+        c = self.counters
+        return c['missed'] + c['dropped'] + c['rlimit'] + \
+                c['sra_missed'] + c['sra_dropped'] + c['sra_rlimit']
+
+    @property
+    def delivered_ratio(self):
+        if not self.reports:
+            return None
+        filtered = self.counters['filtered']
+        return filtered and float(self.hits) / filtered or 0.0
+
+    @property
+    def loss_ratio(self):
+        lost = self.lost
+        return lost and float(lost) / (lost + self.hits) or 0.0
+
+    @property
+    def rlimit_pressure(self):
+        rlimit = self.counters['rlimit'] + self.counters['sra_rlimit']
+        return rlimit and float(rlimit) / (self.lost + self.hits) or 0.0
+
+    def metric(self, name):
+        'Returns the value of one of METRICS.'
+        if name not in METRICS:
+            raise AXAMDException('Unknown loss metric: {!r}'.format(name))
+        return getattr(self, name)
+
+    def __repr__(self):
+        return '<Window {}-{} hits={} lost={} loss_ratio={:.3f} rlimit_pressure={:.3f}>'.format(
+                self.start, self.end, self.hits, self.lost, self.loss_ratio,
+                self.rlimit_pressure)
+
+class _Threshold:
+    def __init__(self, metric, above, callback, key):
+        self.metric = metric
+        self.above = above
+        self.callback = callback
+        self.key = key
+        self.crossed = False
+
+class LossTracker:
+    '''
+    Accounts hits and loss reports of one stream in windows.  Use it as
+    the stream's record filter, or call observe() with each message.
+    '''
+    def __init__(self, anomalies=None, window=60.0, windows=60, record_filter=None,
+            clock=time.time):
+        '''
+        Args:
+            anomalies (list[Anomaly]): The RAD stream's anomalies; hits are
+                then keyed by module name instead of tag.
+            window (float): Window length in seconds.
+            windows (int): Closed windows kept per key.
+            record_filter (RecordFilter): Filter applied after accounting.
+            clock (callable): Returns the current time in seconds.
+        '''
+        if window <= 0 or windows < 1:
+            raise AXAMDException('Window length and count must be positive')
+        self.window = window
+        self.windows = windows
+        self.record_filter = record_filter
+        self._clock = clock
+        self._modules = {}
+        for i, anomaly in enumerate(anomalies or []):
+            self._modules[str(i + 1).encode('utf-8')] = anomaly.module
+        self._current = None
+        self._open = {}
+        self._closed = {}
+        self._thresholds = []
+        self._lock = threading.Lock()
+
+    def on(self, metric, above, callback, key=None):
+        '''
+        Calls callback(key, window) when a closed window of `key` has
+        `metric` above `above`, after one that did not.
+
+        Args:
+            metric (string): One of METRICS.
+            above (float): Threshold.
+            callback (callable): Called with the key and the Window.
+            key: Tag or module name, or None for the whole stream.
+        '''
+        if metric not in METRICS:
+            raise AXAMDException('Unknown loss metric: {!r}'.format(metric))
+        with self._lock:
+            self._thresholds.append(_Threshold(metric, above, callback, key))
+
+    def _key(self, tag):
+        if tag is None or tag == b'"*"':
+            return None
+        if tag in self._modules:
+            return self._modules[tag]
+        return int(tag)
+
+    def _roll(self, now):
+        # moves to the window of `now`; returns the callbacks due
+        start = now - now % self.window
+        if self._current == start:
+            return []
+        due = self._close()
+        self._current = start
+        return due
+
+    def _close(self):
+        due = []
+        for key, window in self._open.items():
+            ring = self._closed.get(key)
+            if ring is None:
+                ring = self._closed[key] = collections.deque(maxlen=self.windows)
+            ring.append(window)
+            for threshold in self._thresholds:
+                if threshold.key != key:
+                    continue
+                value = window.metric(threshold.metric)
+                above = value is not None and value > threshold.above
+                if above and not threshold.crossed:
+                    due.append((threshold.callback, key, window))
+                threshold.crossed = above
+        self._open = {}
+        self._current = None
+        return due
+
+    def _window(self, key):
+        window = self._open.get(key)
+        if window is None:
+            window = self._open[key] = Window(self._current, self._current + self.window)
+        return window
+
+    def observe(self, line):
+        '''
+        Accounts one message (string or raw bytes).  Returns it unchanged.
+        '''
+        raw = line if isinstance(line, bytes) else line.encode('utf-8')
+        op = scan_op(raw)
+        if op in _hit_ops:
+            self._count(self._key(scan_tag(raw)), None)
+        elif op in _report_ops:
+            msg = json.loads(raw.decode('utf-8'))
+            tag = msg.get('tag')
+            key = self._key(None if tag is None else json.dumps(tag).encode('utf-8'))
+            self._count(key, [(name, msg.get(name) or 0)
+                for name in REPORT_FIELDS[_report_ops[op]]])
+        return line
+
+    def _count(self, key, counters):
+        with self._lock:
+            due = self._roll(self._clock())
+            keys = key is None and (None,) or (None, key)
+            for k in keys:
+                window = self._window(k)
+                if counters is None:
+                    window.hits += 1
+                else:
+                    window.reports += 1
+                    for name, value in counters:
+                        window.counters[name] += value
+        for callback, k, window in due:
+            callback(k, window)
+
+    def __call__(self, line):
+        'Accounts a raw record and applies the record filter, if any.'
+        self.observe(line)
+        return self.record_filter is None or self.record_filter(line)
+
+    def flush(self):
+        '''
+        Closes the open windows, e.g. at the end of the stream, running any
+        callbacks due.
+        '''
+        with self._lock:
+            due = self._close()
+        for callback, key, window in due:
+            callback(key, window)
+
+    def keys(self):
+        'Returns the keys seen so far; None is the whole stream.'
+        with self._lock:
+            return list(set(self._closed) | set(self._open))
+
+    def history(self, key=None):
+        'Returns the closed windows of `key`, oldest first.'
+        with self._lock:
+            return list(self._closed.get(key, ()))
+
+    def totals(self, key=None):
+        '''
+        Returns a Window adding up the closed windows of `key` in the ring
+        buffer and its open window.
+        '''
+        with self._lock:
+            windows = list(self._closed.get(key, ()))
+            if key in self._open:
+                windows.append(self._open[key])
+        if not windows:
+            return None
+        total = Window(windows[0].start, windows[-1].end)
+        for window in windows:
+            total.add(window)
+        return total
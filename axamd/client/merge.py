@@ -0,0 +1,253 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Approximately time-ordered merge of several concurrent streams.
+
+Each stream is read by its own thread.  Messages are held in a heap keyed
+on their `time` field until the low watermark, the earliest of the latest
+times seen on each stream less the reorder window, passes them; a stream
+that lags behind holds back the others rather than having its messages
+arrive late.  A stream that delivers nothing for `idle` seconds is no
+longer waited for until it delivers again.  A message that arrives after
+messages later than it were emitted is passed on at once and flagged as
+late.  Messages without a time (status messages such as MISSED) are passed
+on at once.  When every stream is idle or has ended, the held messages are
+flushed.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.merge import merge
+c = Client('https://axamd.sie-remote.net', apikey)
+streams = [c.sra(channels=[ch], watches=['ch={}'.format(ch)]) for ch in (204, 212)]
+for m in merge(streams, window=2.0):
+    process(m.line, late=m.late)
+```
+'''
+
+import collections
+import heapq
+import re
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .batch import parse_time_ns
+from .six_mini import reraise
+
+class Merged(collections.namedtuple('Merged', ['line', 'time', 'source', 'late'])):
+    '''
+    A merged message: the line, its time in nanoseconds since the epoch
+    (None if it has none), the index of the stream it came from, and whether
+    it arrived too late to be emitted in order.
+    '''
+    __slots__ = ()
+
+_time_field = re.compile(r'"time"\s*:\s*"([^"]+)"')
+
+def message_time(line):
+    '''
+    Returns the `time` field of a JSON message in nanoseconds since the
+    epoch, or None if it has none.
+    '''
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
+    m = _time_field.search(line)
+    if m is None:
+        return None
+    try:
+        return parse_time_ns(m.group(1))
+    except ValueError:
+        return None
+
+_end = object()
+
+class _Error:
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+class Merger:
+    '''
+    Iterates over the messages of several streams in approximate time
+    order, yielding Merged tuples.
+
+    Attributes:
+        emitted (int): Messages yielded.
+        late (int): Messages yielded out of order.
+        watermark (int): Time (ns) up to which messages have been released.
+    '''
+    def __init__(self, streams, window=1.0, max_pending=100000, queue_size=10000,
+            time_of=message_time, idle=5.0, clients=()):
+        '''
+        Args:
+            streams (list[iterable]): Streams to merge, e.g. from Client.sra().
+            window (float): Reorder window in seconds of message time.
+            max_pending (int): Most messages held for reordering; the
+                earliest is released when it is exceeded.
+            queue_size (int): Most messages buffered between the stream
+                threads and the merge.
+            time_of (callable): Returns a message's time in ns, or None.
+            idle (float): Wall-clock seconds without a message after which
+                a stream is not waited for.
+            clients (list[Client]): Clients of the streams, closed when
+                iteration stops early so that reader threads blocked on
+                quiet streams return.
+        '''
+        self.streams = list(streams)
+        self.clients = list(clients)
+        self.window = window
+        self.idle = idle
+        self.max_pending = max(1, max_pending)
+        self.time_of = time_of
+        self.emitted = 0
+        self.late = 0
+        self.watermark = None
+        self._queue = queue.Queue(max(1, queue_size))
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def _read(self, index, stream):
+        try:
+            for line in stream:
+                if not self._put((index, line)):
+                    return
+        except Exception:
+            if not self._stopping.is_set():
+                self._put((index, _Error(sys.exc_info())))
+            return
+        finally:
+            if self._stopping.is_set():
+                _close(stream)
+        self._put((index, _end))
+
+    def _put(self, item):
+        while not self._stopping.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _start(self):
+        for index, stream in enumerate(self.streams):
+            t = threading.Thread(target=self._read, args=(index, stream),
+                    name='axamd-merge-{}'.format(index))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _stop(self):
+        self._stopping.set()
+        for client in self.clients:
+            client.close()
+        for stream in self.streams:
+            _close(stream)
+
+    def _low_watermark(self, latest, arrived, active):
+        # Returns the time up to which every stream still delivering has
+        # caught up (None while one has yet to deliver, infinity if all are
+        # idle) and the seconds until the next stream turns idle.
+        now = time.time()
+        low, wait = float('inf'), None
+        for i in active:
+            left = arrived[i] + self.idle - now
+            if left <= 0:
+                continue
+            wait = left if wait is None else min(wait, left)
+            if latest[i] is None:
+                low = None
+            elif low is not None:
+                low = min(low, latest[i])
+        return low, wait
+
+    def _emit(self, t, index, line):
+        late = self.watermark is not None and t < self.watermark
+        if late:
+            self.late += 1
+        else:
+            self.watermark = t
+        self.emitted += 1
+        return Merged(line, t, index, late)
+
+    def __iter__(self):
+        window = int(self.window * 1e9)
+        heap = []
+        seq = 0
+        latest = [None] * len(self.streams)
+        arrived = [time.time()] * len(self.streams)
+        active = set(range(len(self.streams)))
+        wait = self.idle
+        self._start()
+        try:
+            while active:
+                try:
+                    index, item = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    item = None
+                if item is _end:
+                    active.discard(index)
+                elif isinstance(item, _Error):
+                    reraise(*item.exc_info)
+                elif item is not None:
+                    arrived[index] = time.time()
+                    t = self.time_of(item)
+                    if t is None:
+                        self.emitted += 1
+                        yield Merged(item, None, index, False)
+                    elif self.watermark is not None and t < self.watermark:
+                        yield self._emit(t, index, item)
+                    else:
+                        heapq.heappush(heap, (t, seq, index, item))
+                        seq += 1
+                        if latest[index] is None or t > latest[index]:
+                            latest[index] = t
+
+                low, wait = self._low_watermark(latest, arrived, active)
+                while heap and ((low is not None and heap[0][0] <= low - window) or
+                        len(heap) > self.max_pending):
+                    t, _, index, line = heapq.heappop(heap)
+                    yield self._emit(t, index, line)
+            while heap:
+                t, _, index, line = heapq.heappop(heap)
+                yield self._emit(t, index, line)
+        finally:
+            if active:
+                self._stop()
+            else:
+                self._stopping.set()
+
+def _close(stream):
+    # fails while the stream's thread is inside it; that thread then closes
+    # it with its next message
+    close = getattr(stream, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except ValueError:
+            pass
+
+def merge(streams, window=1.0, **kwargs):
+    '''
+    Returns an iterator over Merged messages of `streams` in approximate
+    time order; see Merger for the arguments.
+    '''
+    return iter(Merger(streams, window=window, **kwargs))
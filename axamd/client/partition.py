@@ -0,0 +1,479 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Consistent-hash partitioning of one stream across cooperating consumers.
+
+A Relay reads one upstream stream and listens on a TCP or Unix domain
+socket.  Each PartitionConsumer connects with a node name and receives the
+messages whose partition key (rrname, src address or tag) hashes to it on a
+HashRing.  When consumers join or leave only the keys of the affected ring
+segments move.  Hits without the key (IP hits have no rrname) are
+partitioned by another key, or spread round-robin if they have none.
+Loss reports (MISSED and RAD MISSED) go to every consumer.  The relay
+starts reading the stream once `min_consumers` consumers have connected.
+
+Example usage:
+
+```python
+# on the host holding the upstream stream
+from axamd.client import Client
+from axamd.client.partition import Relay
+c = Client('https://axamd.sie-remote.net', apikey)
+relay = Relay(c.sra(channels=[212], watches=['ch=212']), 'relay-host:5150')
+relay.run()
+
+# on each worker
+from axamd.client.partition import PartitionConsumer
+for line in PartitionConsumer('relay-host:5150', 'worker-1'):
+    ...
+```
+'''
+
+import bisect
+import hashlib
+import logging
+import os
+import re
+import socket
+import stat
+import struct
+import threading
+import time
+
+from .exceptions import AXAMDException
+from .prefilter import scan_op, scan_tag
+from .sinks import Sink, SinkError, ThreadedSink
+
+logger = logging.getLogger(__name__)
+
+KEYS = ('rrname', 'src', 'tag')
+
+_rrname_re = re.compile(br'"rrname"\s*:\s*"([^"]*)"')
+_src_re = re.compile(br'"src"\s*:\s*"([^"]*)"')
+
+_broadcast_ops = frozenset([b'MISSED', b'RAD MISSED'])
+
+def partition_key(line, by='rrname'):
+    '''
+    Returns the partition key of a raw message as bytes, or None if the
+    message has none.
+
+    Args:
+        line (bytes or string): Message.
+        by (string): One of KEYS.
+    '''
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    if by == 'tag':
+        return scan_tag(line)
+    m = (by == 'src' and _src_re or _rrname_re).search(line)
+    if m is None:
+        return None
+    if by == 'rrname':
+        return m.group(1).lower()
+    return m.group(1)
+
+def _hash(data):
+    return struct.unpack('>Q', hashlib.md5(data).digest()[:8])[0]
+
+class HashRing:
+    '''
+    A consistent-hash ring with `replicas` points per node.
+    '''
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def _node_points(self, node):
+        name = node.encode('utf-8')
+        return [_hash(name + b'#' + str(i).encode()) for i in range(self.replicas)]
+
+    def add(self, node):
+        'Adds a node to the ring.'
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for point in self._node_points(node):
+            # on a collision the lexically smaller node keeps the point
+            if point in self._owners:
+                self._owners[point] = min(self._owners[point], node)
+                continue
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        'Removes a node from the ring.'
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        nodes = sorted(self._nodes)
+        self._points = []
+        self._owners = {}
+        self._nodes = set()
+        for other in nodes:
+            self.add(other)
+
+    @property
+    def nodes(self):
+        'The set of nodes on the ring.'
+        return frozenset(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def node_for(self, key):
+        '''
+        Returns the node owning `key` (bytes), or None if the ring is empty.
+        '''
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key))
+        if i == len(self._points):
+            i = 0
+        return self._owners[self._points[i]]
+
+def parse_address(address):
+    '''
+    Returns (family, address) for 'unix:PATH' or 'HOST:PORT'.
+    '''
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise AXAMDException('Expected unix:PATH or HOST:PORT: {}'.format(address))
+    return socket.AF_INET, (host.strip('[]') or '127.0.0.1', int(port))
+
+def _remove_stale(path):
+    # removes a Unix socket left behind by a server that has exited
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise AXAMDException('{}: exists and is not a socket'.format(path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise AXAMDException('{}: another server is listening'.format(path))
+
+def listen(address, backlog=64, mode=None):
+    '''
+    Returns a socket listening on 'unix:PATH' or 'HOST:PORT'.  A Unix
+    socket left behind by a server that has exited is replaced, and gets
+    permissions `mode` (e.g. 0o600) if given before anyone can connect.
+
+    Raises:
+        AXAMDException: if the address is invalid, or a server is already
+            listening on the Unix socket.
+        socket.error: if the address cannot be bound.
+    '''
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        _remove_stale(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    if family == socket.AF_UNIX and mode is not None:
+        os.chmod(address, mode)
+    sock.listen(backlog)
+    return sock
+
+def close_listener(sock):
+    'Closes a socket from listen(), removing its path if it is a Unix socket.'
+    path = None
+    try:
+        if sock.family == socket.AF_UNIX:
+            path = sock.getsockname()
+        sock.close()
+    except socket.error:
+        pass
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+class _Connection(Sink):
+    def __init__(self, sock):
+        self._sock = sock
+
+    def write_batch(self, lines):
+        data = b''.join((isinstance(l, bytes) and l or l.encode('utf-8')) + b'\n' for l in lines)
+        try:
+            self._sock.sendall(data)
+        except socket.error as e:
+            raise SinkError(str(e))
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+class Relay:
+    '''
+    Serves one upstream stream to partition consumers.
+
+    Attributes:
+        address: Bound address, e.g. ('127.0.0.1', port) or a path.
+        relayed (int): Messages routed to one consumer.
+        broadcast (int): Loss reports sent to every consumer.
+        dropped (int): Messages dropped because no consumer was connected
+            or a consumer's queue was full.
+    '''
+    def __init__(self, stream, address, by='rrname', replicas=64, queue_size=10000,
+            block=True, min_consumers=1, mode=0o600):
+        '''
+        Args:
+            stream (iterable): Upstream messages, e.g. from Client.sra().
+            address (string): 'unix:PATH' or 'HOST:PORT' to listen on.
+            by (string): Partition key, one of KEYS.
+            replicas (int): Ring points per consumer.
+            queue_size (int): Messages queued per consumer.
+            block (bool): Wait for a slow consumer instead of dropping.
+            min_consumers (int): Consumers run() waits for before reading
+                the stream.
+            mode (int): Permissions of the Unix socket.  Anyone who can
+                connect receives part of the stream; the default admits
+                only the relay's user.
+        Raises:
+            AXAMDException: if `by` or `address` is invalid, or another
+                server listens on the Unix socket.
+        '''
+        if by not in KEYS:
+            raise AXAMDException('Partition key must be one of {}'.format(', '.join(KEYS)))
+        self.stream = stream
+        self.by = by
+        self.min_consumers = min_consumers
+        self.relayed = 0
+        self.broadcast = 0
+        self.dropped = 0
+        self._fallback = tuple(k for k in KEYS if k not in (by, 'tag'))
+        self._next = 0
+        self._queue_size = queue_size
+        self._block = block
+        self._ring = HashRing(replicas=replicas)
+        self._consumers = {}
+        self._lock = threading.Lock()
+        self._joined = threading.Condition(self._lock)
+        self._stopping = threading.Event()
+        self._listener = listen(address, mode=mode)
+        self.address = self._listener.getsockname()
+        self._acceptor = threading.Thread(target=self._accept, name='axamd-relay-accept')
+        self._acceptor.daemon = True
+        self._acceptor.start()
+
+    @property
+    def consumers(self):
+        'Names of the connected consumers.'
+        with self._lock:
+            return sorted(self._consumers)
+
+    def _accept(self):
+        while not self._stopping.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.error:
+                return
+            t = threading.Thread(target=self._serve, args=(conn,), name='axamd-relay-consumer')
+            t.daemon = True
+            t.start()
+
+    def _serve(self, conn):
+        f = conn.makefile('rb')
+        try:
+            name = f.readline().strip().decode('utf-8')
+        except (socket.error, UnicodeDecodeError):
+            name = None
+        if not name:
+            f.close()
+            conn.close()
+            return
+        sink = ThreadedSink(_Connection(conn), queue_size=self._queue_size, block=self._block)
+        with self._lock:
+            old = self._consumers.pop(name, None)
+            self._consumers[name] = sink
+            self._ring.add(name)
+            self._joined.notify_all()
+        if old is not None:
+            old.close()
+        logger.info('partition consumer {} joined, {} connected'.format(name, len(self._ring)))
+        try:
+            # the consumer sends nothing more; EOF means it left
+            while f.read(4096):
+                pass
+        except socket.error:
+            pass
+        f.close()
+        self._remove(name, sink)
+
+    def _remove(self, name, sink):
+        with self._lock:
+            if self._consumers.get(name) is not sink:
+                return
+            del self._consumers[name]
+            self._ring.remove(name)
+        try:
+            sink.close()
+        except SinkError:
+            pass
+        logger.info('partition consumer {} left, {} connected'.format(name, len(self._ring)))
+
+    def _send(self, name, sink, line):
+        dropped = sink.dropped
+        try:
+            sink.write(line)
+        except SinkError:
+            self._remove(name, sink)
+            return False
+        if sink.dropped != dropped:
+            self.dropped += 1
+        return True
+
+    def _key(self, line):
+        key = partition_key(line, self.by)
+        for by in self._fallback:
+            if key is not None:
+                break
+            key = partition_key(line, by)
+        return key
+
+    def relay(self, line):
+        '''
+        Sends a loss report to every consumer, and any other message to the
+        consumer owning its key, or to the next consumer in turn if it has
+        none.
+        '''
+        raw = isinstance(line, bytes) and line or line.encode('utf-8')
+        key = self._key(raw)
+        if key is None and scan_op(raw) in _broadcast_ops:
+            with self._lock:
+                consumers = list(self._consumers.items())
+            if not consumers:
+                self.dropped += 1
+                return
+            for name, sink in consumers:
+                self._send(name, sink, line)
+            self.broadcast += 1
+            return
+        while True:
+            with self._lock:
+                if key is not None:
+                    name = self._ring.node_for(key)
+                else:
+                    names = sorted(self._consumers)
+                    name = names and names[self._next % len(names)] or None
+                    self._next += 1
+                sink = self._consumers.get(name)
+            if sink is None:
+                self.dropped += 1
+                return
+            # a consumer that failed is removed, and the key moves on
+            if self._send(name, sink, line):
+                self.relayed += 1
+                return
+
+    def wait_for_consumers(self, count, timeout=None):
+        '''
+        Waits until `count` consumers are connected.  Returns False if
+        `timeout` expires or the relay is closed first.
+        '''
+        deadline = timeout is not None and time.time() + timeout or None
+        with self._joined:
+            while len(self._consumers) < count and not self._stopping.is_set():
+                wait = 0.5
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        break
+                self._joined.wait(wait)
+            return not self._stopping.is_set() and len(self._consumers) >= count
+
+    def run(self):
+        '''
+        Waits for min_consumers consumers, then relays the upstream stream
+        until it ends or close() is called.
+        '''
+        try:
+            if not self.wait_for_consumers(self.min_consumers):
+                return
+            for line in self.stream:
+                if self._stopping.is_set():
+                    break
+                self.relay(line)
+        finally:
+            self.close()
+
+    def close(self):
+        'Stops accepting consumers and disconnects them.'
+        self._stopping.set()
+        close_listener(self._listener)
+        with self._lock:
+            consumers = list(self._consumers.values())
+            self._consumers = {}
+        for sink in consumers:
+            try:
+                sink.close()
+            except SinkError:
+                pass
+
+class PartitionConsumer:
+    '''
+    Receives one partition of a Relay's stream.  Iterating yields the
+    messages as strings until the relay disconnects, then closes the
+    connection.
+    '''
+    def __init__(self, address, name, timeout=None):
+        '''
+        Args:
+            address (string): Relay address, 'unix:PATH' or 'HOST:PORT'.
+            name (string): Node name; stable names keep their partitions
+                across reconnects.
+            timeout (float): Connect and read timeout in seconds.
+        '''
+        self.name = name
+        family, address = parse_address(address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        self._sock.sendall(name.encode('utf-8') + b'\n')
+
+    def __iter__(self):
+        f = self._sock.makefile('rb')
+        try:
+            for line in f:
+                yield line.rstrip(b'\n').decode('utf-8')
+        finally:
+            f.close()
+            self.close()
+
+    def close(self):
+        'Disconnects from the relay.'
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
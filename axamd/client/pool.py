@@ -0,0 +1,251 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Clients for many API keys sharing one connection pool.
+
+A ClientPool holds one requests session, and so one pool of connections,
+per server.  pool.client(apikey) returns a Client for that key which sends
+its X-API-Key with each request over the shared connections.  For each key
+the pool caches list_channels() and list_anomalies() results, limits the
+number of concurrent streams and counts usage.
+
+Example usage:
+
+```python
+from axamd.client.pool import ClientPool
+pool = ClientPool('https://axamd.sie-remote.net', max_streams=4)
+for customer in customers:
+    c = pool.client(customer.apikey)
+    start_thread(c.sra, channels=[212], watches=customer.watches)
+...
+print(pool.usage(customer.apikey).messages)
+```
+'''
+
+import copy
+import threading
+import time
+import weakref
+
+from .client import Client, requests_retry_session
+from .exceptions import AXAMDException
+
+class StreamLimitExceeded(AXAMDException):
+    'Raised when an API key already has its maximum number of streams open.'
+
+class Usage:
+    '''
+    Usage counters of one API key.
+
+    Attributes:
+        streams (int): Streams started.
+        active (int): Streams currently open.
+        rejected (int): Streams refused by the concurrency limit.
+        messages (int): Messages delivered.
+        catalog_requests (int): Channel and anomaly lists fetched.
+        catalog_hits (int): Channel and anomaly lists served from the cache.
+    '''
+    def __init__(self):
+        self.streams = 0
+        self.active = 0
+        self.rejected = 0
+        self.messages = 0
+        self.catalog_requests = 0
+        self.catalog_hits = 0
+
+    def copy(self):
+        return copy.copy(self)
+
+    def __repr__(self):
+        return '<Usage streams={} active={} rejected={} messages={} catalog_requests={} catalog_hits={}>'.format(
+                self.streams, self.active, self.rejected, self.messages,
+                self.catalog_requests, self.catalog_hits)
+
+class _Tenant:
+    # shared state of every client of one API key
+    def __init__(self, apikey, max_streams, block):
+        self.apikey = apikey
+        self.max_streams = max_streams
+        self.block = block
+        self.usage = Usage()
+        self.catalog = {}
+        self.lock = threading.Lock()
+        self.slot = threading.Condition(self.lock)
+
+    def acquire(self):
+        with self.lock:
+            while self.max_streams is not None and self.usage.active >= self.max_streams:
+                if not self.block:
+                    self.usage.rejected += 1
+                    raise StreamLimitExceeded('API key already has {} streams open'.format(
+                        self.max_streams))
+                self.slot.wait()
+            self.usage.active += 1
+            self.usage.streams += 1
+
+    def release(self):
+        with self.lock:
+            self.usage.active -= 1
+            self.slot.notify()
+
+class PooledClient(Client):
+    '''
+    A Client of a ClientPool.  Streams count towards the limit and usage of
+    its API key, and catalog requests are cached per key.
+    '''
+    def __init__(self, pool, tenant):
+        Client.__init__(self, pool.server, tenant.apikey, retries=pool.retries,
+                retry_backoff=pool.retry_backoff, proxy=pool.proxy,
+                profiler=pool.profiler, session=pool.session,
+                compression=pool.compression)
+        self._pool = pool
+        self._tenant = tenant
+
+    def _stream(self, uri, **kwargs):
+        tenant = self._tenant
+        tenant.acquire()
+        try:
+            for line in Client._stream(self, uri, **kwargs):
+                with tenant.lock:
+                    tenant.usage.messages += 1
+                yield line
+        finally:
+            tenant.release()
+
+    def _get(self, uri, timeout=None):
+        tenant = self._tenant
+        now = time.time()
+        with tenant.lock:
+            cached = tenant.catalog.get(uri)
+            if cached is not None and cached[0] > now:
+                tenant.usage.catalog_hits += 1
+                return copy.deepcopy(cached[1])
+        value = Client._get(self, uri, timeout=timeout)
+        with tenant.lock:
+            tenant.usage.catalog_requests += 1
+            if self._pool.catalog_ttl:
+                tenant.catalog[uri] = (now + self._pool.catalog_ttl, value)
+        return copy.deepcopy(value)
+
+    def fork(self):
+        '''
+        Returns a new client of the same API key and pool.
+        '''
+        return self._pool._register(PooledClient(self._pool, self._tenant))
+
+class ClientPool:
+    '''
+    Creates clients for any number of API keys of one server, sharing one
+    session.
+    '''
+    def __init__(self, server, retries=3, retry_backoff=0.3, proxy=None,
+            profiler=None, compression=True, pool_maxsize=10, max_streams=None,
+            block=False, catalog_ttl=300):
+        '''
+        Args:
+            server (string): Server URI
+            retries, retry_backoff, proxy, profiler, compression: as for
+                Client.
+            pool_maxsize (int): Connections kept open to the server.
+            max_streams (int): Default limit of concurrent streams per key;
+                None for no limit.
+            block (bool): Wait for a stream of the key to end, rather than
+                raise StreamLimitExceeded, when the limit is reached.
+            catalog_ttl (float): Seconds to cache list_channels() and
+                list_anomalies() results; 0 disables the cache.
+        '''
+        self.server = server
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.proxy = proxy
+        self.profiler = profiler
+        self.compression = compression
+        self.max_streams = max_streams
+        self.block = block
+        self.catalog_ttl = catalog_ttl
+        self.session = requests_retry_session(retries=retries,
+                backoff_factor=retry_backoff, pool_maxsize=pool_maxsize)
+        self._tenants = {}
+        self._clients = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _tenant(self, apikey, max_streams=None):
+        with self._lock:
+            tenant = self._tenants.get(apikey)
+            if tenant is None:
+                if max_streams is None:
+                    max_streams = self.max_streams
+                tenant = self._tenants[apikey] = _Tenant(apikey, max_streams, self.block)
+            elif max_streams is not None:
+                with tenant.lock:
+                    tenant.max_streams = max_streams
+                    tenant.slot.notify_all()
+            return tenant
+
+    def client(self, apikey, max_streams=None):
+        '''
+        Returns a new client for `apikey`.  Clients of the same key share its
+        limit, usage and catalog cache.
+
+        Args:
+            apikey (string): API key
+            max_streams (int): Set the concurrency limit of this key,
+                overriding the pool default.
+        '''
+        return self._register(PooledClient(self, self._tenant(apikey, max_streams)))
+
+    def _register(self, client):
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def usage(self, apikey=None):
+        '''
+        Returns a copy of the Usage of `apikey`, or a dict of the Usage of
+        every key if apikey is None.
+        '''
+        with self._lock:
+            tenants = dict(self._tenants)
+        if apikey is not None:
+            if apikey not in tenants:
+                return Usage()
+            tenant = tenants[apikey]
+            with tenant.lock:
+                return tenant.usage.copy()
+        out = {}
+        for key, tenant in tenants.items():
+            with tenant.lock:
+                out[key] = tenant.usage.copy()
+        return out
+
+    def invalidate(self, apikey=None):
+        'Drops the cached catalog of `apikey`, or of every key.'
+        with self._lock:
+            tenants = [self._tenants[apikey]] if apikey in self._tenants \
+                    else apikey is None and list(self._tenants.values()) or []
+        for tenant in tenants:
+            with tenant.lock:
+                tenant.catalog.clear()
+
+    def close(self):
+        '''
+        Ends every stream of the pool's clients and closes the shared
+        connections.
+        '''
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        self.session.close()
@@ -0,0 +1,127 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Fast-path classification of raw AXA JSON records.
+
+AXAMD emits compact JSON with the `tag`, `op` and (for hits) `channel`
+members ahead of any nested objects, so these can be scanned out of the raw
+bytes without decoding the whole record.  A RecordFilter decides whether a
+record is passed on, dropped or handed to a route before any json.loads.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.prefilter import RecordFilter
+c = Client('https://axamd.sie-remote.net', apikey)
+f = RecordFilter(drop_ops=['MISSED', 'RAD MISSED'])
+for line in c.sra(channels=[212], watches=['ch=212'], record_filter=f):
+    ...
+```
+'''
+
+import re
+
+_tag_re = re.compile(br'"tag"\s*:\s*("\*"|[0-9]+)')
+_op_re = re.compile(br'"op"\s*:\s*"([^"]*)"')
+_channel_re = re.compile(br'"channel"\s*:\s*"([^"]*)"')
+
+def _bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return str(s).encode('utf-8')
+
+def _tag_bytes(tag):
+    if tag == '*':
+        return b'"*"'
+    return _bytes(int(tag))
+
+def _channel_bytes(channel):
+    if isinstance(channel, int):
+        return _bytes('ch{}'.format(channel))
+    return _bytes(channel)
+
+def scan_op(line):
+    'Returns the op of a raw record as bytes, or None if it is not found.'
+    m = _op_re.search(line)
+    return m and m.group(1)
+
+def scan_tag(line):
+    'Returns the tag of a raw record as bytes (b\'"*"\' for none), or None.'
+    m = _tag_re.search(line)
+    return m and m.group(1)
+
+def scan_channel(line):
+    'Returns the channel of a raw record as bytes, or None if it has none.'
+    m = _channel_re.search(line)
+    return m and m.group(1)
+
+class RecordFilter:
+    '''
+    Selects raw records by op, tag and channel without decoding them.
+
+    A record is passed if its op is in `ops` (when given) and not in
+    `drop_ops`, its tag is in `tags` (when given) and, for records that
+    carry a channel, its channel is in `channels` (when given).  Records
+    whose op has a route are handed to the route and not passed on.
+    Records for which a member cannot be found are not filtered on it.
+    '''
+    def __init__(self, ops=None, drop_ops=None, tags=None, channels=None, routes=None):
+        '''
+        Args:
+            ops (list[string]): Ops to keep.
+            drop_ops (list[string]): Ops to drop.
+            tags (list[int or '*']): Tags to keep.
+            channels (list[int or string]): Channels (212 or 'ch212') to keep.
+            routes (dict): Maps op to a callable taking the raw record bytes.
+        '''
+        self._ops = ops is not None and frozenset(_bytes(o) for o in ops) or None
+        self._drop_ops = frozenset(_bytes(o) for o in drop_ops or ())
+        self._tags = tags is not None and frozenset(_tag_bytes(t) for t in tags) or None
+        self._channels = channels is not None and \
+                frozenset(_channel_bytes(c) for c in channels) or None
+        self._routes = dict((_bytes(op), fn) for op, fn in (routes or {}).items())
+        self.passed = 0
+        self.dropped = 0
+        self.routed = 0
+
+    def __call__(self, line):
+        '''
+        Classifies a raw record (bytes, without the record separator).
+        Returns True if the record should be passed on.
+        '''
+        if self._ops is not None or self._drop_ops or self._routes:
+            op = scan_op(line)
+            if op is not None:
+                if op in self._routes:
+                    self.routed += 1
+                    self._routes[op](line)
+                    return False
+                if op in self._drop_ops or \
+                        (self._ops is not None and op not in self._ops):
+                    self.dropped += 1
+                    return False
+        if self._tags is not None:
+            tag = scan_tag(line)
+            if tag is not None and tag not in self._tags:
+                self.dropped += 1
+                return False
+        if self._channels is not None:
+            channel = scan_channel(line)
+            if channel is not None and channel not in self._channels:
+                self.dropped += 1
+                return False
+        self.passed += 1
+        return True
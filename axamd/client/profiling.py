@@ -0,0 +1,170 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Sampled hot-path timing for streams.
+
+A Profiler counts every event of each stage (network read, framing,
+decode, validation, enrichment, projection, consumer callback, output
+write) but only times one event in `every`, so the overhead stays small
+enough to leave enabled on a production host.  Totals are extrapolated from
+the sampled events.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.profiling import Profiler
+profiler = Profiler(every=100)
+c = Client('https://axamd.sie-remote.net', apikey, profiler=profiler)
+for line in c.sra(channels=[212], watches=['ch=212']):
+    ...
+print(profiler.summary())
+```
+'''
+
+from __future__ import print_function
+
+import cProfile
+import signal
+import sys
+import timeit
+
+STAGES = ('read', 'frame', 'decode', 'validate', 'enrich', 'project', 'callback', 'write')
+
+clock = timeit.default_timer
+
+class _Stage:
+    __slots__ = ('events', 'samples', 'seconds')
+
+    def __init__(self):
+        self.events = 0
+        self.samples = 0
+        self.seconds = 0.0
+
+class Profiler:
+    '''
+    Collects sampled per-stage timings and, optionally, a cProfile trace.
+    '''
+    def __init__(self, every=100, cprofile=False):
+        '''
+        Args:
+            every (int): Time one event in `every` per stage.
+            cprofile (bool): Also run cProfile while enabled.
+        '''
+        self.every = max(1, int(every))
+        self.stages = dict((name, _Stage()) for name in STAGES)
+        self._cprofile = cprofile and cProfile.Profile() or None
+        self._started = clock()
+        self._running = self._cprofile is not None
+        if self._running:
+            self._cprofile.enable()
+
+    def sample(self, stage):
+        '''
+        Counts an event of `stage`.  Returns True if it should be timed.
+        '''
+        s = self.stages[stage]
+        s.events += 1
+        return s.events % self.every == 0
+
+    def record(self, stage, seconds):
+        'Adds a timed sample of `stage`.'
+        s = self.stages[stage]
+        s.samples += 1
+        s.seconds += seconds
+
+    def timed(self, stage, iterable):
+        '''
+        Wraps an iterable, timing sampled calls to next() as `stage`.  Only
+        items returned count as events.
+        '''
+        s = self.stages[stage]
+        it = iter(iterable)
+        while True:
+            if (s.events + 1) % self.every == 0:
+                t = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                self.record(stage, clock() - t)
+            else:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            s.events += 1
+            yield item
+
+    def estimate(self, stage):
+        '''
+        Returns the estimated total seconds spent in `stage`.
+        '''
+        s = self.stages[stage]
+        if not s.samples:
+            return 0.0
+        return s.seconds / s.samples * s.events
+
+    def summary(self):
+        '''
+        Returns a human-readable table of per-stage timings.
+        '''
+        elapsed = clock() - self._started
+        lines = ['{:<10} {:>12} {:>10} {:>12} {:>12} {:>7}'.format(
+            'stage', 'events', 'samples', 'mean (us)', 'total (s)', 'share')]
+        for name in STAGES:
+            s = self.stages[name]
+            if not s.events:
+                continue
+            mean = s.samples and s.seconds / s.samples * 1e6 or 0.0
+            total = self.estimate(name)
+            lines.append('{:<10} {:>12} {:>10} {:>12.2f} {:>12.3f} {:>6.1f}%'.format(
+                name, s.events, s.samples, mean, total,
+                elapsed and 100.0 * total / elapsed or 0.0))
+        lines.append('elapsed {:.3f}s'.format(elapsed))
+        return '\n'.join(lines)
+
+    def dump(self, filename):
+        '''
+        Writes the cProfile statistics collected so far to `filename` in
+        pstats format.
+        '''
+        if self._cprofile is None:
+            return
+        try:
+            self._cprofile.dump_stats(filename)
+        finally:
+            if self._running:
+                self._cprofile.enable()
+
+    def stop(self):
+        'Stops cProfile collection.'
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._running = False
+
+    def install_signal_handler(self, filename=None, signum=None, stream=None):
+        '''
+        Prints the summary to `stream` (default stderr), and dumps the
+        cProfile statistics to `filename` if given, when `signum` (default
+        SIGUSR1) is received.  Must be called from the main thread.
+        '''
+        if signum is None:
+            signum = signal.SIGUSR1
+        def _handler(signum, frame):
+            print(self.summary(), file=stream or sys.stderr)
+            if filename:
+                self.dump(filename)
+        signal.signal(signum, _handler)
@@ -0,0 +1,114 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Field projection of stream messages.
+
+A Projection compiles dotted field paths (`nmsg.message.rrname`; numeric
+components index lists) once and reduces each message to those fields, as
+compact JSON keyed by path or as tab-separated values in path order.
+Missing fields are null in JSON and empty in TSV.
+
+Example usage:
+
+```python
+from axamd.client import Client
+c = Client('https://axamd.sie-remote.net', apikey)
+for line in c.sra(channels=[212], watches=['ch=212'],
+        fields=['time', 'channel', 'src', 'nmsg.message.rrname'], fields_format='tsv'):
+    ...
+```
+'''
+
+import collections
+import json
+
+from .exceptions import AXAMDException
+
+FORMATS = ('json', 'tsv')
+
+_missing = object()
+
+def _compile(path):
+    if not path or any(not part for part in path.split('.')):
+        raise AXAMDException('Invalid field path: {!r}'.format(path))
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
+
+def _get(obj, path):
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(obj, list) or part >= len(obj):
+                return _missing
+        elif not isinstance(obj, dict) or part not in obj:
+            return _missing
+        obj = obj[part]
+    return obj
+
+def _tsv(value):
+    if value is _missing or value is None:
+        return ''
+    if not isinstance(value, type(u'')):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return json.dumps(value, separators=(',', ':'))
+        return str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class Projection:
+    '''
+    Reduces JSON messages to a list of fields.
+    '''
+    def __init__(self, fields, format='json'):
+        '''
+        Args:
+            fields (list[string]): Dotted field paths.
+            format (string): 'json' or 'tsv'.
+        Raises:
+            AXAMDException: if a path or the format is invalid.
+        '''
+        if format not in FORMATS:
+            raise AXAMDException('Projection format must be one of {}'.format(', '.join(FORMATS)))
+        if not fields:
+            raise AXAMDException('At least one field is required')
+        self.fields = list(fields)
+        self.format = format
+        self._paths = [_compile(f) for f in self.fields]
+        self._decoder = json.JSONDecoder()
+
+    def values(self, message):
+        '''
+        Returns the values of the fields in `message` (a string or a
+        decoded dict), with None for missing fields.
+        '''
+        if not isinstance(message, dict):
+            message = self._decoder.decode(message)
+        values = []
+        for path in self._paths:
+            value = _get(message, path)
+            values.append(None if value is _missing else value)
+        return values
+
+    def header(self):
+        'Returns a TSV header line naming the fields.'
+        return '\t'.join(self.fields)
+
+    def __call__(self, message):
+        '''
+        Returns the projection of `message` (a string or a decoded dict) as
+        a string in the configured format.
+        '''
+        values = self.values(message)
+        if self.format == 'tsv':
+            return '\t'.join(_tsv(v) for v in values)
+        return json.dumps(collections.OrderedDict(zip(self.fields, values)),
+                separators=(',', ':'))
@@ -0,0 +1,264 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Replay of captured streams through the client pipeline.
+
+A capture is a file of messages, one per line, as written by axamd_client
+(RFC 7464 record separators are allowed).  Plain files are read through
+mmap; files ending in .gz, .bz2 or .xz are decompressed as they are read.
+Records go through the same framing, filtering, decoding, validation,
+enrichment and projection as a live stream.
+
+Captures are replayed as fast as possible, or paced by the messages' `time`
+field at `speed` times the original rate.  With `workers` greater than one
+the files are processed in parallel by worker processes; messages of each
+file stay in order, but files are interleaved.
+
+Example usage:
+
+```python
+from axamd.client.replay import ReplayClient
+c = ReplayClient(['sra-2018-01-01.json.gz', 'sra-2018-01-02.json.gz'], workers=2)
+for line in c.sra(fields=['time', 'src'], fields_format='tsv'):
+    ...
+```
+'''
+
+import bz2
+import gzip
+import mmap
+import multiprocessing
+import os
+import time
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from .client import _records
+from .exceptions import AXAMDException
+from .merge import message_time
+from .projection import Projection
+
+_openers = {
+    '.gz': gzip.open,
+    '.bz2': bz2.BZ2File,
+}
+if lzma is not None:
+    _openers['.xz'] = lzma.open
+
+def _file_chunks(path, size=1 << 20):
+    '''
+    Yields the contents of a capture in chunks of up to `size` bytes,
+    followed by a newline terminating any unterminated last record.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.xz' and lzma is None:
+        raise AXAMDException('{}: reading .xz captures requires the lzma module'.format(path))
+    if ext in _openers:
+        f = _openers[ext](path, 'rb')
+        try:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+    else:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for offset in range(0, len(mm), size):
+                        yield mm[offset:offset + size]
+                finally:
+                    mm.close()
+    yield b'\n'
+
+class _Expired(Exception):
+    pass
+
+class _Pacer:
+    # a record filter that sleeps until each record is due, raising
+    # _Expired rather than sleeping past the deadline
+    def __init__(self, speed, record_filter=None, deadline=None):
+        self.speed = speed
+        self.record_filter = record_filter
+        self.deadline = deadline
+        self._origin = None
+
+    def __call__(self, line):
+        t = message_time(line)
+        if t is not None:
+            now = time.time()
+            if self._origin is None:
+                self._origin = (t, now)
+            else:
+                due = self._origin[1] + (t - self._origin[0]) / 1e9 / self.speed
+                if self.deadline is not None and due >= self.deadline:
+                    time.sleep(max(0, self.deadline - now))
+                    raise _Expired()
+                if due > now:
+                    time.sleep(due - now)
+        return self.record_filter is None or self.record_filter(line)
+
+class _Failure:
+    def __init__(self, message):
+        self.message = message
+
+def _worker(tasks, results, options, batch_size):
+    while True:
+        path = tasks.get()
+        if path is None:
+            results.put(None)
+            return
+        try:
+            batch = []
+            for line in _records(_file_chunks(path), **options):
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    results.put(batch)
+                    batch = []
+            if batch:
+                results.put(batch)
+        except Exception as e:
+            results.put(_Failure('{}: {}: {}'.format(path, e.__class__.__name__, e)))
+
+def _parallel(paths, workers, options, batch_size=1000):
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        ctx = multiprocessing
+    tasks = ctx.Queue()
+    results = ctx.Queue(workers * 4)
+    for path in paths:
+        tasks.put(path)
+    for _ in range(workers):
+        tasks.put(None)
+    # forked workers inherit the pipeline objects, e.g. an Enricher's maps
+    procs = [ctx.Process(target=_worker, args=(tasks, results, options, batch_size))
+            for _ in range(workers)]
+    for p in procs:
+        p.daemon = True
+        p.start()
+    try:
+        running = workers
+        while running:
+            item = results.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, _Failure):
+                raise AXAMDException(item.message)
+            else:
+                for line in item:
+                    yield line
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+def replay(paths, speed=None, workers=1, profiler=None, record_filter=None,
+        max_messages=None, deadline=None, output_validator=None, enricher=None,
+        fields=None, fields_format='json'):
+    '''
+    Yields the messages of captures run through the client pipeline.
+
+    Args:
+        paths (list[string]): Capture files.
+        speed (float): Pace by message time at this multiple of the
+            original rate; as fast as possible if None.
+        workers (int): Worker processes for parallel replay.
+        profiler (Profiler): Collects sampled timings (one worker only).
+        record_filter, max_messages, deadline, output_validator, enricher,
+        fields, fields_format: as for Client.sra().
+    Raises:
+        AXAMDException: if a capture cannot be read, or pacing, a profiler
+            or an output validator is combined with several workers.
+    '''
+    if speed is not None and speed <= 0:
+        raise AXAMDException('Replay speed must be positive')
+    if workers > 1 and (speed is not None or profiler is not None or output_validator is not None):
+        raise AXAMDException('Paced replay, profiling and output validation need a single worker')
+    if speed is not None:
+        record_filter = _Pacer(speed, record_filter, deadline)
+    options = {
+        'record_filter': record_filter,
+        'output_validator': output_validator,
+        'enricher': enricher,
+        'projection': fields is not None and Projection(fields, fields_format) or None,
+    }
+    if workers > 1:
+        lines = _parallel(list(paths), workers, options)
+    else:
+        lines = (line for path in paths
+                for line in _records(_file_chunks(path), profiler, **options))
+    count = 0
+    try:
+        for line in lines:
+            if deadline is not None and time.time() >= deadline:
+                return
+            yield line
+            count += 1
+            if max_messages is not None and count >= max_messages:
+                return
+    except _Expired:
+        return
+
+class ReplayClient:
+    '''
+    Stands in for a Client, serving sra() and rad() from captures.  Stream
+    parameters that only concern the server (channels, watches, anomalies,
+    rate_limit, ...) are ignored.
+    '''
+    _options = ('record_filter', 'max_messages', 'deadline', 'output_validator',
+            'enricher', 'fields', 'fields_format')
+
+    def __init__(self, paths, speed=None, workers=1, profiler=None):
+        '''
+        Args:
+            paths (list[string]): Capture files.
+            speed (float): See replay().
+            workers (int): See replay().
+            profiler (Profiler): Collects sampled stream timings.
+        '''
+        self.paths = list(paths)
+        self.speed = speed
+        self.workers = workers
+        self._profiler = profiler
+
+    def _replay(self, params):
+        options = dict((k, params[k]) for k in self._options if k in params)
+        return replay(self.paths, speed=self.speed, workers=self.workers,
+                profiler=self._profiler, **options)
+
+    def sra(self, channels=[], watches=[], **params):
+        'Replays the captures; see Client.sra() for the pipeline arguments.'
+        return self._replay(params)
+
+    def rad(self, anomalies=[], **params):
+        'Replays the captures; see Client.rad() for the pipeline arguments.'
+        return self._replay(params)
+
+    def list_channels(self, timeout=None):
+        raise AXAMDException('Channels cannot be listed from captures')
+
+    def list_anomalies(self, timeout=None):
+        raise AXAMDException('Anomalies cannot be listed from captures')
+
+    def close(self):
+        pass
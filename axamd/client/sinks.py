@@ -0,0 +1,498 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Output sinks for stream messages.
+
+A sink takes messages (strings without a trailing newline) and writes them
+somewhere: a file, a rotating file, a TCP, UDP or Unix domain socket, or
+the standard input of a subprocess.  A ThreadedSink moves the writes to a
+dedicated thread fed by a bounded queue and writes in batches, so a slow
+destination only stalls the stream once the queue is full; with
+block=False, messages that do not fit in the queue are dropped and counted
+instead.  A FanOut copies each message to several sinks.
+
+open_sink() builds a sink from a specification string:
+
+    -                           standard output
+    PATH or file:PATH           file, appended to
+    rotate:PATH?size=N&count=N  file, rotated to PATH.1 ... PATH.count
+                                when it reaches N bytes
+    tcp:HOST:PORT               TCP connection, one message per line
+    udp:HOST:PORT               UDP, one datagram per message
+    unix:PATH                   Unix domain stream socket
+    unixgram:PATH               Unix domain datagram socket
+    pipe:COMMAND                standard input of a shell command
+
+Sizes accept a k, M or G suffix.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.sinks import open_sinks
+c = Client('https://axamd.sie-remote.net', apikey)
+with open_sinks(['/var/log/axamd/sra.json', 'tcp:collector:5140']) as sink:
+    for line in c.sra(channels=[212], watches=['ch=212']):
+        sink.write(line)
+```
+'''
+
+import abc
+import errno
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from .exceptions import AXAMDException
+
+class SinkError(AXAMDException):
+    'Raised when a sink cannot be opened or written.'
+
+_stdout_lock = threading.Lock()
+
+def _encode(line):
+    if not isinstance(line, bytes):
+        line = line.encode('utf-8')
+    return line
+
+def _join(lines, terminator=b'\n'):
+    return b''.join(_encode(line) + terminator for line in lines)
+
+def parse_size(value):
+    '''
+    Parses a byte count with an optional k, M or G suffix.
+    '''
+    value = str(value).strip()
+    scale = 1
+    if value and value[-1] in 'kKmMgG':
+        scale = 1024 ** ('kmg'.index(value[-1].lower()) + 1)
+        value = value[:-1]
+    try:
+        size = int(value) * scale
+    except ValueError:
+        raise SinkError('Invalid size: {}'.format(value))
+    if size <= 0:
+        raise SinkError('Size must be positive: {}'.format(value))
+    return size
+
+class Sink(abc.ABCMeta('_Sink', (object,), {})):
+    '''
+    Abstract base class of sinks.  Subclasses implement write_batch().
+
+    Attributes:
+        terminator (bytes): Written after each message by stream sinks;
+            empty for messages that carry their own framing.
+        dropped (int): Messages dropped instead of written.
+    '''
+    terminator = b'\n'
+    dropped = 0
+
+    def write(self, line):
+        'Writes one message.'
+        self.write_batch([line])
+
+    @abc.abstractmethod
+    def write_batch(self, lines):
+        '''
+        Writes a list of messages.
+
+        Raises:
+            SinkError: if the destination cannot be written.
+        '''
+
+    def flush(self):
+        'Flushes buffered output.'
+
+    def close(self):
+        'Flushes and releases the destination.'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e, v, tb):
+        self.close()
+
+class FileSink(Sink):
+    '''
+    Appends messages to a buffered file, or to standard output if path is
+    `-`.
+    '''
+    def __init__(self, path, buffering=65536):
+        self.path = path
+        if path == '-':
+            self._file = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            try:
+                self._file = open(path, 'ab', buffering)
+            except (IOError, OSError) as e:
+                raise SinkError('{}: {}'.format(path, e))
+
+    def write_batch(self, lines):
+        data = _join(lines, self.terminator)
+        if self.path == '-':
+            with _stdout_lock:
+                self._file.write(data)
+                self._file.flush()
+        else:
+            self._file.write(data)
+
+    def flush(self):
+        if self.path != '-':
+            self._file.flush()
+
+    def close(self):
+        if self.path == '-':
+            return
+        self._file.close()
+
+class RotatingFileSink(FileSink):
+    '''
+    Appends messages to a file, renaming it to path.1 (and older files to
+    path.2 ... path.count) when it would exceed max_bytes.
+    '''
+    def __init__(self, path, max_bytes, count=5, buffering=65536):
+        '''
+        Args:
+            path (string): File name.
+            max_bytes (int): Size at which to rotate.
+            count (int): Number of rotated files to keep.
+        '''
+        if path == '-':
+            raise SinkError('Cannot rotate standard output')
+        FileSink.__init__(self, path, buffering)
+        self.max_bytes = max_bytes
+        self.count = count
+        self._buffering = buffering
+        self._size = os.path.getsize(path)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.count - 1, 0, -1):
+            src = '{}.{}'.format(self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '{}.{}'.format(self.path, i + 1))
+        if self.count > 0:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.unlink(self.path)
+        self._file = open(self.path, 'ab', self._buffering)
+        self._size = 0
+
+    def write_batch(self, lines):
+        data = _join(lines, self.terminator)
+        if self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+class _SocketSink(Sink):
+    def __init__(self, family, kind, address):
+        self.address = address
+        self._family = family
+        self._kind = kind
+        self._sock = None
+        self._connect()
+
+    def _connect(self):
+        if self._family == socket.AF_INET:
+            if self._kind == socket.SOCK_STREAM:
+                self._sock = socket.create_connection(self.address)
+                return
+            family, kind, proto, _, address = socket.getaddrinfo(
+                    self.address[0], self.address[1], 0, self._kind)[0]
+            self._sock = socket.socket(family, kind, proto)
+            self._sock.connect(address)
+            return
+        self._sock = socket.socket(self._family, self._kind)
+        try:
+            self._sock.connect(self.address)
+        except socket.error:
+            self._sock.close()
+            raise
+
+    def _send(self, data):
+        try:
+            self._sock.sendall(data)
+        except socket.error as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                raise SinkError('{}: {}'.format(self.address, e))
+            # reconnect once to survive a restarted collector
+            self._sock.close()
+            try:
+                self._connect()
+                self._sock.sendall(data)
+            except socket.error as e:
+                raise SinkError('{}: {}'.format(self.address, e))
+
+    def write_batch(self, lines):
+        if self._kind == socket.SOCK_STREAM:
+            self._send(_join(lines, self.terminator))
+            return
+        for line in lines:
+            try:
+                self._sock.send(_encode(line))
+            except socket.error as e:
+                if e.errno != errno.ECONNREFUSED:
+                    raise SinkError('{}: {}'.format(self.address, e))
+
+    def close(self):
+        self._sock.close()
+
+class TCPSink(_SocketSink):
+    'Writes one message per line to a TCP connection.'
+    def __init__(self, host, port):
+        _SocketSink.__init__(self, socket.AF_INET, socket.SOCK_STREAM, (host, int(port)))
+
+class UDPSink(_SocketSink):
+    'Sends each message as one UDP datagram.'
+    def __init__(self, host, port):
+        _SocketSink.__init__(self, socket.AF_INET, socket.SOCK_DGRAM, (host, int(port)))
+
+class UnixSink(_SocketSink):
+    '''
+    Writes one message per line to a Unix domain stream socket, or one
+    message per datagram if datagram is set.
+    '''
+    def __init__(self, path, datagram=False):
+        _SocketSink.__init__(self, socket.AF_UNIX,
+                datagram and socket.SOCK_DGRAM or socket.SOCK_STREAM, path)
+
+class PipeSink(Sink):
+    'Writes one message per line to the standard input of a shell command.'
+    def __init__(self, command):
+        self.command = command
+        self._proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+
+    def write_batch(self, lines):
+        try:
+            self._proc.stdin.write(_join(lines, self.terminator))
+        except (IOError, OSError) as e:
+            raise SinkError('{}: {}'.format(self.command, e))
+
+    def flush(self):
+        try:
+            self._proc.stdin.flush()
+        except (IOError, OSError) as e:
+            raise SinkError('{}: {}'.format(self.command, e))
+
+    def close(self):
+        try:
+            self._proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        self._proc.wait()
+
+_close = object()
+
+class ThreadedSink(Sink):
+    '''
+    Writes to another sink from a dedicated thread.  Messages are queued
+    and written in batches of up to batch_size.  When the queue is full,
+    write() waits for room, or drops the message if block is not set.
+
+    Attributes:
+        dropped (int): Messages dropped because the queue was full.
+        written (int): Messages written to the sink.
+    '''
+    def __init__(self, sink, queue_size=10000, batch_size=512, block=True):
+        '''
+        Args:
+            sink (Sink): Destination.
+            queue_size (int): Maximum number of queued messages.
+            batch_size (int): Maximum number of messages per write.
+            block (bool): Wait for room in the queue; if not set, drop
+                messages while it is full.
+        '''
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.block = block
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+        self._queue = queue.Queue(max(1, queue_size))
+        self._thread = threading.Thread(target=self._run, name='axamd-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _close:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is _close
+            if done:
+                batch.pop()
+            if self.error is None:
+                # after a failure keep draining so writers never block
+                try:
+                    if batch:
+                        self.sink.write_batch(batch)
+                        self.written += len(batch)
+                    if done or q.empty():
+                        self.sink.flush()
+                except Exception as e:
+                    self.error = e
+            if done:
+                return
+
+    def _check(self):
+        if self.error is not None:
+            e = self.error
+            raise isinstance(e, SinkError) and e or SinkError(str(e))
+
+    def write(self, line):
+        self._check()
+        if self.block:
+            self._queue.put(line)
+        else:
+            try:
+                self._queue.put_nowait(line)
+            except queue.Full:
+                self.dropped += 1
+
+    def write_batch(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        '''
+        Writes the queued messages and closes the sink.
+
+        Raises:
+            SinkError: if a write failed.
+        '''
+        if self._thread.is_alive():
+            self._queue.put(_close)
+            self._thread.join()
+        self.sink.close()
+        self._check()
+
+class FanOut(Sink):
+    'Copies every message to each of several sinks.'
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, line):
+        for sink in self.sinks:
+            sink.write(line)
+
+    def write_batch(self, lines):
+        for sink in self.sinks:
+            sink.write_batch(lines)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    @property
+    def dropped(self):
+        return sum(sink.dropped for sink in self.sinks)
+
+    def close(self):
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except SinkError as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+def _host_port(spec, rest):
+    host, sep, port = rest.rpartition(':')
+    if not sep or not host or not port.isdigit():
+        raise SinkError('Expected HOST:PORT: {}'.format(spec))
+    return host.strip('[]'), int(port)
+
+def open_sink(spec, threaded=True, queue_size=10000, batch_size=512, block=True,
+        terminator=b'\n'):
+    '''
+    Opens the sink described by `spec` (see the module documentation).
+
+    Args:
+        spec (string): Sink specification.
+        threaded (bool): Wrap the sink in a ThreadedSink.
+        queue_size, batch_size, block: ThreadedSink options; with
+            block=False messages are dropped while the queue is full.
+        terminator (bytes): Written after each message, see Sink.
+    Returns:
+        Sink
+    Raises:
+        SinkError: if spec is invalid or the sink cannot be opened.
+    '''
+    scheme, sep, rest = spec.partition(':')
+    if not sep or scheme not in ('file', 'rotate', 'tcp', 'udp', 'unix', 'unixgram', 'pipe'):
+        scheme, rest = 'file', spec
+    if not rest:
+        raise SinkError('Missing destination: {}'.format(spec))
+    try:
+        if scheme == 'file':
+            sink = FileSink(rest)
+        elif scheme == 'rotate':
+            path, _, query = rest.partition('?')
+            options = parse_qs(query)
+            if 'size' not in options:
+                raise SinkError('Rotating file needs a size: {}'.format(spec))
+            count = options.get('count', ['5'])[0]
+            if not count.isdigit():
+                raise SinkError('Invalid count: {}'.format(spec))
+            sink = RotatingFileSink(path, parse_size(options['size'][0]), int(count))
+        elif scheme == 'tcp':
+            sink = TCPSink(*_host_port(spec, rest))
+        elif scheme == 'udp':
+            sink = UDPSink(*_host_port(spec, rest))
+        elif scheme in ('unix', 'unixgram'):
+            sink = UnixSink(rest, datagram=scheme == 'unixgram')
+        else:
+            sink = PipeSink(rest)
+    except (socket.error, OSError) as e:
+        raise SinkError('{}: {}'.format(spec, e))
+    sink.terminator = terminator
+    if threaded:
+        sink = ThreadedSink(sink, queue_size=queue_size, batch_size=batch_size, block=block)
+    return sink
+
+def open_sinks(specs, **kwargs):
+    '''
+    Opens each sink in `specs` with open_sink(), returning a FanOut if there
+    is more than one.
+    '''
+    sinks = []
+    try:
+        for spec in specs:
+            sinks.append(open_sink(spec, **kwargs))
+    except SinkError:
+        for sink in sinks:
+            sink.close()
+        raise
+    if len(sinks) == 1:
+        return sinks[0]
+    return FanOut(sinks)
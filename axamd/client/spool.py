@@ -0,0 +1,405 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Persistent on-disk spool between a stream and its consumer.
+
+A Spool is an append-only log of records kept in memory-mapped segment
+files.  Every record has a sequential offset; named consumers commit the
+offset they have processed and resume from it after a restart.  Disk usage
+is bounded by discarding the oldest segments.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.spool import Spool, spooled
+c = Client('https://axamd.sie-remote.net', apikey)
+spool = Spool('/var/spool/axamd')
+for line in spooled(c.sra(channels=[212], watches=['ch=212']), spool):
+    producer.send(line)     # may block without stalling the stream
+```
+'''
+
+import array
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from .exceptions import AXAMDException
+from .six_mini import reraise
+
+logger = logging.getLogger(__name__)
+
+_header = struct.Struct('>II')  # length, crc32
+_suffix = '.seg'
+
+class SpoolError(AXAMDException):
+    'Raised when a spool cannot be opened or read.'
+
+class _Segment:
+    def __init__(self, path, base, size=None):
+        self.path = path
+        self.base = base
+        self.positions = array.array('L')
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self._file = open(path, 'r+b')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.mm = mmap.mmap(self._file.fileno(), self.size) if self.size else None
+        self.end = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def recover(self):
+        'Rebuilds the index, stopping at the first empty or damaged record.'
+        pos = 0
+        while pos + _header.size <= self.size:
+            length, crc = _header.unpack_from(self.mm, pos)
+            start = pos + _header.size
+            if length == 0 or start + length > self.size:
+                break
+            if zlib.crc32(self.mm[start:start + length]) & 0xffffffff != crc:
+                logger.warning('{}: damaged record at byte {}, discarding the rest'.format(self.path, pos))
+                self.mm[pos:self.size] = b'\0' * (self.size - pos)
+                break
+            self.positions.append(pos)
+            pos = start + length
+        self.end = pos
+
+    def room(self, n):
+        return self.end + _header.size + n <= self.size
+
+    def append(self, data):
+        pos = self.end
+        _header.pack_into(self.mm, pos, len(data), zlib.crc32(data) & 0xffffffff)
+        start = pos + _header.size
+        self.mm[start:start + len(data)] = data
+        self.positions.append(pos)
+        self.end = start + len(data)
+
+    def read(self, i):
+        pos = self.positions[i]
+        length, _ = _header.unpack_from(self.mm, pos)
+        start = pos + _header.size
+        return self.mm[start:start + length]
+
+    def flush(self):
+        if self.mm is not None:
+            self.mm.flush()
+
+    def seal(self):
+        'Trims preallocated space once the segment is no longer written.'
+        self.flush()
+        if self.end < self.size:
+            self.mm.close()
+            self._file.truncate(self.end)
+            self.size = self.end
+            self.mm = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ) \
+                    if self.size else None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self._file.close()
+
+class Spool:
+    '''
+    An append-only, segmented record log with consumer offsets.
+
+    Appends and reads may happen from different threads.  Readers block
+    until records are available or the spool is closed for writing.
+    '''
+    def __init__(self, directory, segment_size=64 << 20, max_bytes=1 << 30, sync=False):
+        '''
+        Args:
+            directory (string): Spool directory, created if missing.
+            segment_size (int): Bytes preallocated per segment file.
+            max_bytes (int): Disk usage above which the oldest segments
+                are discarded.
+            sync (bool): Flush segments to disk after every append.
+        '''
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.sync = sync
+        self.discarded = 0
+        self._segments = []
+        self._cond = threading.Condition()
+        self._writing = True
+        self._consumer_dir = os.path.join(directory, 'consumers')
+        if not os.path.isdir(self._consumer_dir):
+            os.makedirs(self._consumer_dir)
+        self._recover()
+
+    def _recover(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(_suffix))
+        for name in names:
+            try:
+                base = int(name[:-len(_suffix)])
+            except ValueError:
+                raise SpoolError('{}: not a spool segment'.format(name))
+            segment = _Segment(os.path.join(self.directory, name), base)
+            segment.recover()
+            self._segments.append(segment)
+        for segment in self._segments[:-1]:
+            segment.seal()
+        if not self._segments:
+            self._roll(0)
+
+    def _roll(self, need):
+        base = self.next_offset if self._segments else 0
+        if self._segments:
+            self._segments[-1].seal()
+        size = max(self.segment_size, need + _header.size)
+        path = os.path.join(self.directory, '{:020d}{}'.format(base, _suffix))
+        self._segments.append(_Segment(path, base, size))
+        self._enforce_limit()
+
+    def _consumed(self):
+        consumers = os.listdir(self._consumer_dir)
+        consumers = [c for c in consumers if not c.endswith('.tmp')]
+        if not consumers:
+            return 0
+        return min(self.position(c) for c in consumers)
+
+    def _enforce_limit(self):
+        consumed = self._consumed()
+        while len(self._segments) > 1 and \
+                self._segments[1].base <= consumed:
+            segment = self._segments.pop(0)
+            segment.close()
+            os.unlink(segment.path)
+        while len(self._segments) > 1 and self.disk_usage() > self.max_bytes:
+            segment = self._segments.pop(0)
+            self.discarded += len(segment)
+            logger.warning('{}: spool full, discarding {} records'.format(segment.path, len(segment)))
+            segment.close()
+            os.unlink(segment.path)
+
+    def disk_usage(self):
+        'Returns the bytes allocated by segment files.'
+        return sum(s.size for s in self._segments)
+
+    @property
+    def first_offset(self):
+        'Offset of the oldest record still in the spool.'
+        return self._segments[0].base
+
+    @property
+    def next_offset(self):
+        'Offset the next appended record will get.'
+        last = self._segments[-1]
+        return last.base + len(last)
+
+    def append(self, record):
+        '''
+        Appends a record (string or bytes) and returns its offset.
+        '''
+        if not isinstance(record, bytes):
+            record = record.encode('utf-8')
+        with self._cond:
+            if not self._segments:
+                raise SpoolError('{}: spool is closed'.format(self.directory))
+            if not self._segments[-1].room(len(record)):
+                self._roll(len(record))
+            segment = self._segments[-1]
+            segment.append(record)
+            if self.sync:
+                segment.flush()
+            self._cond.notify_all()
+            return segment.base + len(segment) - 1
+
+    def _locate(self, offset):
+        # Returns (offset, segment) of the first record at or after
+        # `offset`.  Offsets discarded, or lost with the damaged tail of a
+        # segment before a crash, move on to the next record.
+        segments = self._segments
+        i = len(segments) - 1
+        while i > 0 and segments[i].base > offset:
+            i -= 1
+        while offset >= segments[i].base + len(segments[i]):
+            i += 1
+        return max(offset, segments[i].base), segments[i]
+
+    def read(self, offset, timeout=None):
+        '''
+        Returns (offset, record) for the record at `offset`, or for the
+        next record still in the spool if `offset` has been discarded or
+        was lost in a crash.  Blocks until the record is written.  Returns
+        None if the spool is closed for writing and has no such record, or
+        if `timeout` expires.
+        '''
+        with self._cond:
+            while not self._segments or offset >= self.next_offset:
+                if not self._writing or not self._segments:
+                    return None
+                if not self._cond.wait(timeout) and timeout is not None:
+                    return None
+            offset, segment = self._locate(offset)
+            return offset, segment.read(offset - segment.base)
+
+    def iter_from(self, offset):
+        '''
+        Yields (offset, record) pairs from `offset` until the spool is
+        closed for writing and all records have been read.
+        '''
+        while True:
+            result = self.read(offset)
+            if result is None:
+                return
+            offset, record = result
+            yield offset, record
+            offset += 1
+
+    def _consumer_path(self, consumer):
+        return os.path.join(self._consumer_dir, consumer)
+
+    def position(self, consumer):
+        '''
+        Returns the next offset `consumer` should read.
+        '''
+        try:
+            with open(self._consumer_path(consumer)) as f:
+                offset = int(f.read())
+        except (IOError, OSError, ValueError):
+            offset = 0
+        return max(offset, self.first_offset)
+
+    def commit(self, consumer, offset):
+        '''
+        Records that `consumer` has processed every record before `offset`.
+        '''
+        path = self._consumer_path(consumer)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def finish(self):
+        '''
+        Closes the spool for writing; blocked readers return once drained.
+        '''
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+    def flush(self):
+        with self._cond:
+            for segment in self._segments:
+                segment.flush()
+
+    def close(self):
+        self.finish()
+        with self._cond:
+            for segment in self._segments:
+                segment.flush()
+                segment.close()
+            self._segments = []
+
+class _Pump(threading.Thread):
+    def __init__(self, lines, spool):
+        super(_Pump, self).__init__()
+        self.daemon = True
+        self.lines = lines
+        self.spool = spool
+        self.exc_info = None
+        self._stopping = threading.Event()
+
+    def run(self):
+        try:
+            for line in self.lines:
+                if self._stopping.is_set():
+                    break
+                self.spool.append(line)
+        except Exception:
+            if not self._stopping.is_set():
+                self.exc_info = sys.exc_info()
+        finally:
+            _close(self.lines)
+            self.spool.finish()
+
+    def stop(self):
+        self._stopping.set()
+        # succeeds unless the thread is inside the iterator; it then closes
+        # it after the next line
+        _close(self.lines)
+
+def _close(lines):
+    close = getattr(lines, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except ValueError:
+            pass
+
+def spooled(lines, spool, consumer='default', commit_every=1000, commit_interval=1.0):
+    '''
+    Decouples a stream from its consumer through a spool.
+
+    `lines` is read into the spool by a background thread as fast as it
+    arrives.  Records are yielded starting at the consumer's committed
+    offset, so records left unprocessed by a previous run are replayed
+    first.  A record counts as processed when the next one is requested;
+    the offset is committed every `commit_every` records or
+    `commit_interval` seconds, and when the iterator ends or is closed.
+    After a crash, up to that many processed records are replayed.
+
+    When the iterator is closed early, reading `lines` stops and `lines`
+    is closed.  A thread blocked in a quiet stream only notices with the
+    next line; use Client.close() to end it at once.
+
+    Args:
+        lines (iterable): Strings as returned by Client.sra() or Client.rad().
+        spool (Spool): Spool to write through.
+        consumer (string): Name under which the offset is committed.
+        commit_every (int): Records processed between commits.
+        commit_interval (float): Seconds between commits.
+    Returns:
+        iterator returning strings
+    Raises:
+        Any exception raised by `lines`, once the spool has been drained.
+    '''
+    pump = _Pump(lines, spool)
+    pump.start()
+    done = committed = spool.position(consumer)
+    committed_at = time.time()
+    try:
+        for offset, record in spool.iter_from(committed):
+            # every record before `offset` has been processed
+            done = offset
+            if done - committed >= commit_every or \
+                    time.time() - committed_at >= commit_interval:
+                spool.commit(consumer, done)
+                committed, committed_at = done, time.time()
+            yield record.decode('utf-8')
+            done = offset + 1
+        pump.join()
+    finally:
+        pump.stop()
+        if done > committed:
+            spool.commit(consumer, done)
+    if pump.exc_info:
+        reraise(*pump.exc_info)
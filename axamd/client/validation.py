@@ -0,0 +1,185 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Sampled validation of stream output against axa-json-schema.yaml.
+
+Validating against the full schema evaluates its top-level `oneOf` over
+every message definition.  The op codes of those definitions are disjoint,
+so an OutputValidator instead compiles one validator per definition and
+dispatches on the message's `op`.  Only one message in `every` is
+validated, and failures are counted per op.
+
+Example usage:
+
+```python
+from axamd.client import Client
+from axamd.client.validation import OutputValidator
+validator = OutputValidator(every=1000)
+c = Client('https://axamd.sie-remote.net', apikey)
+for line in c.sra(channels=[212], watches=['ch=212'], output_validator=validator):
+    ...
+print(validator.validated, validator.failed, validator.failures)
+```
+'''
+
+import json
+import logging
+import sys
+
+from .exceptions import AXAMDException, ValidationError
+from .six_mini import reraise
+
+try:
+    import pkg_resources
+    import yaml
+    import jsonschema
+    import jsonschema.validators
+except ImportError:
+    jsonschema = None
+
+logger = logging.getLogger(__name__)
+
+def _op_enum(definition):
+    op = definition.get('properties', {}).get('op', {})
+    if 'enum' in op:
+        return op['enum']
+    ops = []
+    for alternative in op.get('oneOf', []) + op.get('anyOf', []):
+        ops.extend(alternative.get('enum', []))
+    return ops
+
+class OutputValidator:
+    '''
+    Validates a sample of stream messages with per-op validators compiled
+    from the AXA JSON schema.
+
+    Attributes:
+        seen (int): Messages offered to the validator.
+        validated (int): Messages validated.
+        failed (int): Validated messages that did not conform.
+        failures (dict): Failure counts by op.
+        last_error (string): Description of the most recent failure.
+    '''
+    def __init__(self, every=1, raise_errors=False, on_failure=None, schema=None):
+        '''
+        Args:
+            every (int): Validate one message in `every`.
+            raise_errors (bool): Raise ValidationError on failures.
+            on_failure (callable): Called with (message, error) on failures.
+            schema (dict): Schema to use instead of axa-json-schema.yaml.
+        Raises:
+            AXAMDException: if PyYAML or jsonschema is not installed.
+        '''
+        if jsonschema is None:
+            raise AXAMDException('Output validation requires PyYAML and jsonschema')
+        if schema is None:
+            f = pkg_resources.resource_stream(__name__, 'axa-json-schema.yaml')
+            try:
+                schema = yaml.safe_load(f)
+            finally:
+                f.close()
+        self.every = max(1, int(every))
+        self.raise_errors = raise_errors
+        self.on_failure = on_failure
+        self.seen = 0
+        self.validated = 0
+        self.failed = 0
+        self.failures = {}
+        self.last_error = None
+        self._schema = schema
+        self._cls = jsonschema.validators.validator_for(schema)
+        self._definitions = {}
+        for alternative in schema.get('oneOf', []):
+            name = alternative['$ref'].split('/')[-1]
+            for op in _op_enum(schema['definitions'][name]):
+                self._definitions[op] = name
+        self._validators = {}
+
+    def _validator(self, op):
+        if op not in self._validators:
+            name = self._definitions.get(op)
+            if name is None:
+                return None
+            schema = self._schema
+            subschema = {
+                'allOf': [
+                    {
+                        'type': 'object',
+                        'properties': schema.get('properties', {}),
+                        'required': schema.get('required', []),
+                    },
+                    {'$ref': '#/definitions/{}'.format(name)},
+                ],
+                'definitions': schema['definitions'],
+            }
+            if '$schema' in schema:
+                subschema['$schema'] = schema['$schema']
+            self._validators[op] = self._cls(subschema)
+        return self._validators[op]
+
+    def _fail(self, op, message, error):
+        self.failed += 1
+        self.failures[op] = self.failures.get(op, 0) + 1
+        self.last_error = '{}: {}'.format(op, error)
+        logger.debug('invalid message: {}'.format(self.last_error))
+        if self.on_failure is not None:
+            self.on_failure(message, error)
+
+    def __call__(self, message):
+        '''
+        Offers a message (string or parsed dict) for validation.  Returns
+        False if it was validated and does not conform, True otherwise.
+
+        Raises:
+            ValidationError: if raise_errors is set and validation fails.
+        '''
+        self.seen += 1
+        if self.seen % self.every:
+            return True
+        self.validated += 1
+        try:
+            instance = json.loads(message) if not isinstance(message, dict) else message
+        except ValueError as e:
+            self._fail(None, message, e)
+            if self.raise_errors:
+                reraise(ValidationError, ValidationError(e), sys.exc_info()[2])
+            return False
+
+        op = instance.get('op') if isinstance(instance, dict) else None
+        validator = self._validator(op)
+        if validator is None:
+            error = 'unknown op {!r}'.format(op)
+            self._fail(op, message, error)
+            if self.raise_errors:
+                raise ValidationError(error)
+            return False
+
+        error = next(iter(validator.iter_errors(instance)), None)
+        if error is None:
+            return True
+        self._fail(op, message, error.message)
+        if self.raise_errors:
+            raise ValidationError(error.message)
+        return False
+
+    def summary(self):
+        '''
+        Returns a one-line description of the counters.
+        '''
+        return 'validated {} of {} messages, {} invalid{}'.format(
+                self.validated, self.seen, self.failed,
+                self.failures and ' ({})'.format(', '.join(
+                    '{}: {}'.format(op, n) for op, n in sorted(self.failures.items(), key=str)))
+                or '')
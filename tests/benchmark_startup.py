@@ -0,0 +1,68 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Time to first message, with and without Client.preconnect().
+
+Runs the stand-in server with a per-connection latency (standing in for
+DNS, TCP and TLS setup) and, for each run, starts a client, spends `work`
+seconds on other startup work (configuration, validation, enrichment
+tables), opens a stream and waits for its first message.
+
+    python -m tests.benchmark_startup --runs 20 --latency 0.05 --work 0.05
+'''
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from axamd.client import Client
+from axamd.client.profiling import clock
+from tests.fakeserver import FakeServer
+
+def _run(uri, preconnect, work):
+    start = clock()
+    client = Client(uri, 'key')
+    if preconnect:
+        client.preconnect()
+    time.sleep(work)
+    stream = client.sra([212], ['ch=212'])
+    next(stream)
+    elapsed = clock() - start
+    stream.close()
+    return elapsed
+
+def _summary(name, times):
+    times = sorted(times)
+    return '{:<12} median {:7.1f} ms  min {:7.1f} ms  max {:7.1f} ms'.format(name,
+            times[len(times) // 2] * 1000, times[0] * 1000, times[-1] * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05,
+            help='Seconds before the server serves a new connection')
+    parser.add_argument('--work', type=float, default=0.05,
+            help='Seconds of other startup work per run')
+    args = parser.parse_args()
+
+    with FakeServer(['{"tag":1,"op":"WATCH HIT"}']) as server:
+        server.latency = args.latency
+        for name, preconnect in (('serial', False), ('preconnect', True)):
+            times = [_run(server.uri, preconnect, args.work) for _ in range(args.runs)]
+            print(_summary(name, times))
+
+if __name__ == '__main__':
+    main()
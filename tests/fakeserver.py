@@ -0,0 +1,170 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A stand-in AXAMD server for offline tests.
+
+Stream requests are answered with the configured records framed per
+RFC 7464, channel and anomaly listings with the configured dicts.  Each
+request's path, headers and decoded JSON body are kept in `requests`.
+'''
+
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.connections += 1
+        if fake.latency:
+            # stands in for the TCP and TLS handshakes of a new connection
+            time.sleep(fake.latency)
+        BaseHTTPRequestHandler.setup(self)
+
+    def _record(self, body=None):
+        self.server.fake.requests.append({
+            'path': self.path,
+            'headers': dict(self.headers.items()),
+            'body': body,
+            })
+
+    def _send_json(self, status, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        fake = self.server.fake
+        self._record()
+        if self.path == '/v1/sra/channels':
+            self._send_json(200, fake.channels)
+        elif self.path == '/v1/rad/anomalies':
+            self._send_json(200, fake.anomalies)
+        else:
+            self._send_json(404, {'status': 404, 'type': 'not-found', 'title': 'Not Found'})
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode('utf-8'))
+        self._record(body)
+        if self.path not in ('/v1/sra/stream', '/v1/rad/stream'):
+            self._send_json(404, {'status': 404, 'type': 'not-found', 'title': 'Not Found'})
+            return
+        if fake.problem:
+            self._send_json(fake.problem['status'], fake.problem)
+            return
+
+        encoding = None
+        accept = self.headers.get('Accept-Encoding', '')
+        if fake.encoder and fake.encoder[0] in [e.strip() for e in accept.split(',')]:
+            encoding, compressor = fake.encoder[0], fake.encoder[1]()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json-seq')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        records = fake.records
+        if callable(records):
+            records = records(body)
+        try:
+            for record in records:
+                if not isinstance(record, bytes):
+                    record = record.encode('utf-8')
+                data = b'\x1e' + record + b'\n'
+                if encoding:
+                    data = compressor.compress(data)
+                self.wfile.write(data)
+                self.wfile.flush()
+                if fake.delay:
+                    time.sleep(fake.delay)
+            if encoding:
+                self.wfile.write(compressor.flush())
+            if fake.hold:
+                fake.release.wait(fake.hold)
+        except (IOError, OSError):
+            pass
+        self.close_connection = True
+
+class FakeServer:
+    '''
+    Runs the stand-in server on an ephemeral localhost port.
+
+    Attributes:
+        records (list[string]): Records returned by stream requests, or a
+            callable returning them given the decoded request body.
+        delay (float): Seconds to sleep between records.
+        hold (float): Seconds to keep the stream open after the last record.
+        encoder (tuple): (content-coding, compressor factory) used when the
+            client accepts that coding.
+        problem (dict): Problem report returned instead of a stream.
+        latency (float): Seconds before a new connection is served.
+        connections (int): Connections accepted.
+    '''
+    def __init__(self, records=(), channels=None, anomalies=None):
+        self.records = callable(records) and records or list(records)
+        self.channels = channels or {'ch212': {'description': 'test channel'}}
+        self.anomalies = anomalies or {'test_anom': {'description': 'test anomaly'}}
+        self.delay = 0
+        self.hold = 0
+        self.encoder = None
+        self.problem = None
+        self.latency = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.requests = []
+        self.release = threading.Event()
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    @property
+    def uri(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.release.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, e, v, tb):
+        self.stop()
@@ -0,0 +1,115 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from axamd.client import batch
+from axamd.client.exceptions import AXAMDException
+
+ip_hit = '{"tag":1,"op":"WATCH HIT","channel":"ch123","time":"1970-01-01 00:00:01.000002","af":"IPv4","src":"1.2.3.4","dst":"5.6.7.8","ttl":255,"proto":"UDP","src_port":123,"dst_port":456,"payload":"3q2+7w=="}'
+nmsg_hit = '{"tag":2,"op":"WATCH HIT","channel":"ch204","field_idx":1,"val_idx":0,"vname":"SIE","mname":"dnsdedupe","time":"1970-01-01 00:00:02.5","nmsg":{"time":"1970-01-01 00:00:02.5","vname":"SIE","mname":"dnsdedupe","message":{"rrname":"example.com.","rrtype":"A"}}}'
+missed = '{"tag":"*","op":"MISSED","missed":2,"dropped":3,"rlimit":4,"filtered":5,"last_report":6}'
+
+class TestParseTime(unittest.TestCase):
+    def test_nanoseconds(self):
+        self.assertEqual(batch.parse_time_ns('1970-01-01 00:00:01.000000002'), 1000000002)
+
+    def test_short_fraction(self):
+        self.assertEqual(batch.parse_time_ns('1970-01-01 00:01:00.5'), 60500000000)
+
+    def test_no_fraction(self):
+        self.assertEqual(batch.parse_time_ns('1970-01-02 00:00:00'), 86400 * 10**9)
+
+    def test_date_change(self):
+        self.assertEqual(batch.parse_time_ns('2018-02-28 23:59:59.5'), 1519862399500000000)
+        self.assertEqual(batch.parse_time_ns('2018-03-01 00:00:00'), 1519862400000000000)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            batch.parse_time_ns('yesterday')
+        for s in ('2018-02-28T23:59:59', '2018-02-28 23:59:59x5'):
+            self.assertRaises(ValueError, batch.parse_time_ns, s)
+
+
+class TestListBatches(unittest.TestCase):
+    def test_columns(self):
+        batches = list(batch.iter_batches([ip_hit, missed, nmsg_hit], backend='list'))
+        self.assertEqual(len(batches), 1)
+        b = batches[0]
+        self.assertEqual(b['tag'], [1, 2])
+        self.assertEqual(b['time'], [1000002000, 2500000000])
+        self.assertEqual(b['src'], ['1.2.3.4', None])
+        self.assertEqual(b['rrname'], [None, 'example.com.'])
+        self.assertEqual(b['mname'], [None, 'dnsdedupe'])
+
+    def test_batch_size(self):
+        batches = list(batch.iter_batches([ip_hit] * 5, batch_size=2, backend='list'))
+        self.assertEqual([len(b['op']) for b in batches], [2, 2, 1])
+
+    def test_column_subset(self):
+        b, = batch.iter_batches([ip_hit], columns=['src', 'dst'], backend='list')
+        self.assertEqual(sorted(b), ['dst', 'src'])
+
+    def test_unknown_column(self):
+        with self.assertRaises(AXAMDException):
+            batch.RecordBatcher(columns=['nope'])
+
+    def test_all_ops(self):
+        b, = batch.iter_batches([ip_hit, missed], backend='list', ops=None)
+        self.assertEqual(b['op'], ['WATCH HIT', 'MISSED'])
+        self.assertEqual(b['tag'], [1, None])
+
+
+@unittest.skipIf(batch.numpy is None, 'numpy is not installed')
+class TestNumpyBatches(unittest.TestCase):
+    def test_masked_columns(self):
+        b, = batch.iter_batches([ip_hit, nmsg_hit], backend='numpy')
+        self.assertEqual(b['ttl'].dtype, batch.numpy.int64)
+        self.assertEqual(list(b['ttl'].mask), [False, True])
+        self.assertEqual(b['ttl'][0], 255)
+        self.assertEqual(list(b['time']), [1000002000, 2500000000])
+        self.assertEqual(list(b['rrname']), [None, 'example.com.'])
+
+
+@unittest.skipIf(batch.pyarrow is None, 'pyarrow is not installed')
+class TestArrowBatches(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record_batch(self):
+        b, = batch.iter_batches([ip_hit, nmsg_hit], backend='arrow')
+        self.assertEqual(b.num_rows, 2)
+        self.assertEqual(b.column(b.schema.get_field_index('ttl')).to_pylist(), [255, None])
+
+    def test_parquet_rotation(self):
+        template = os.path.join(self.dir, 'hits-{:02d}.parquet')
+        paths = batch.write_batches([ip_hit] * 5, template,
+                batch_size=2, rows_per_file=4)
+        self.assertEqual(len(paths), 2)
+        table = batch.pyarrow.parquet.read_table(paths[0])
+        self.assertEqual(table.num_rows, 4)
+
+    def test_rotation_splits_batch(self):
+        template = os.path.join(self.dir, 'hits-{:02d}.arrow')
+        paths = batch.write_batches([ip_hit] * 5, template, format='arrow',
+                batch_size=2, rows_per_file=3)
+        rows = [batch.pyarrow.ipc.open_file(batch.pyarrow.memory_map(p)).read_all().num_rows
+                for p in paths]
+        self.assertEqual(rows, [3, 2])
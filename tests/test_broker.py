@@ -0,0 +1,197 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from axamd.client import Anomaly, Client
+from axamd.client.broker import Broker, BrokerClient, _Subscriber
+from axamd.client.compression import TransferStats
+from axamd.client.exceptions import AXAMDException, ProblemDetails
+from axamd.client.prefilter import RecordFilter
+from tests.fakeserver import FakeServer
+
+def _records(body):
+    keys = body.get('watches') or [a['module'] for a in body.get('anomalies', [])]
+    hits = [json.dumps({'op': 'WATCH HIT', 'watch': w, 'n': n})
+            for w in keys for n in range(3)]
+    return hits + [json.dumps({'op': 'MISSED'}), json.dumps({'op': 'END'})]
+
+A, B = 'ip=10.0.0.1', 'ip=10.0.0.2'
+
+class TestBroker(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(_records)
+        self.server.hold = 30
+        self.server.start()
+        self.dir = tempfile.mkdtemp()
+        self.address = 'unix:' + os.path.join(self.dir, 'broker.sock')
+        self.broker = Broker(Client(self.server.uri, 'key'), self.address)
+        self.thread = threading.Thread(target=self.broker.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.broker.close()
+        self.thread.join()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def _until_end(self, it):
+        lines = []
+        for line in it:
+            msg = json.loads(line)
+            if msg['op'] == 'END':
+                return lines
+            lines.append(msg)
+        self.fail('stream ended')
+
+    def _wait(self, predicate):
+        for _ in range(100):
+            if predicate():
+                return
+            time.sleep(0.05)
+        self.fail('timed out')
+
+    def test_shared_upstream(self):
+        first = BrokerClient(self.address)
+        stream = first.sra([212], [A])
+        lines = self._until_end(stream)
+        self.assertEqual([(m['watch'], m['n']) for m in lines if 'watch' in m],
+                [(A, 0), (A, 1), (A, 2)])
+
+        second = BrokerClient(self.address, overflow='drop-old')
+        it = second.sra([212], [A])
+        reader = threading.Thread(target=lambda: list(it))
+        reader.start()
+        self._wait(lambda: list(self.broker.upstreams.values()) == [2])
+        self.assertEqual(len(self.server.requests), 1)
+
+        other = BrokerClient(self.address)
+        other_stream = other.sra([212], [B])
+        self._until_end(other_stream)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(sorted(self.broker.upstreams.values()), [1, 2])
+
+        for c in (first, second, other):
+            c.close()
+        reader.join()
+        self._wait(lambda: not self.broker.upstreams)
+
+    def test_local_pipeline(self):
+        c = BrokerClient(self.address)
+        lines = list(c.sra([212], [A], record_filter=RecordFilter(ops=['WATCH HIT']),
+                max_messages=2, fields=['n'], fields_format='tsv'))
+        self.assertEqual(lines, ['0', '1'])
+        c.close()
+        # the parameters the server saw are only the server-side ones
+        self.assertEqual(self.server.requests[0]['body']['watches'], [A])
+        self.assertNotIn('fields', self.server.requests[0]['body'])
+
+    def test_limits(self):
+        self.server.delay = 0.15
+        c = BrokerClient(self.address)
+        start = time.time()
+        lines = list(c.sra([212], [A], deadline=start + 1.0))
+        # the quiet stream after the last record stops at the deadline
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(len(lines), 5)
+
+        stats = TransferStats()
+        lines = list(c.sra([212], [A], max_bytes=1, transfer_stats=stats))
+        self.assertTrue(lines)
+        self.assertEqual(stats.compressed, stats.decompressed)
+        self.assertGreater(stats.compressed, 0)
+        c.close()
+
+    def test_rad(self):
+        c = BrokerClient(self.address)
+        lines = self._until_end(c.rad([Anomaly('x', ['dns=*.'], 'opt')]))
+        self.assertEqual([m.get('watch') for m in lines], ['x', 'x', 'x', None])
+        self.assertEqual(self.server.requests[0]['body']['anomalies'][0]['module'], 'x')
+        c.close()
+
+    def test_problem(self):
+        self.server.problem = {'status': 403, 'type': 'forbidden', 'title': 'Forbidden'}
+        c = BrokerClient(self.address)
+        with self.assertRaises(ProblemDetails):
+            list(c.sra([212], [A]))
+        self._wait(lambda: not self.broker.upstreams)
+
+    def test_socket(self):
+        path = self.address[len('unix:'):]
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        # a running broker keeps its socket
+        self.assertRaises(AXAMDException, Broker, Client(self.server.uri, 'key'), self.address)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(len(list(BrokerClient(self.address).sra([212], [A], max_messages=1))), 1)
+
+    def test_invalid_request(self):
+        with self.assertRaises(AXAMDException):
+            BrokerClient(self.address, overflow='spill')
+        c = BrokerClient(self.address)
+        c.overflow = 'spill'
+        with self.assertRaises(AXAMDException):
+            list(c.sra([212], [A]))
+
+class TestSubscriber(unittest.TestCase):
+    def _offer(self, policy):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        subscriber = _Subscriber(a, policy, size=3)
+        for n in range(5):
+            subscriber.offer(str(n))
+        return subscriber
+
+    def test_drop_new(self):
+        subscriber = self._offer('drop-new')
+        self.assertEqual(list(subscriber._queue), ['0', '1', '2'])
+        self.assertEqual(subscriber.dropped, 2)
+
+    def test_drop_old(self):
+        subscriber = self._offer('drop-old')
+        self.assertEqual(list(subscriber._queue), ['2', '3', '4'])
+        self.assertEqual(subscriber.dropped, 2)
+
+    def test_disconnect(self):
+        subscriber = self._offer('disconnect')
+        self.assertEqual(list(subscriber._queue), ['0', '1', '2'])
+        self.assertTrue(subscriber._ending)
+
+    def test_block(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        subscriber = _Subscriber(a, 'block', size=1)
+        subscriber.offer('0')
+        t = threading.Thread(target=subscriber.offer, args=('1',))
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())
+        subscriber.start()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        subscriber.finish()
+        f = b.makefile('rb')
+        self.assertEqual(f.read(), b'0\n1\n')
+        f.close()
+        b.close()
+
+if __name__ == '__main__':
+    unittest.main()
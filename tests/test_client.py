@@ -0,0 +1,250 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import threading
+import time
+import unittest
+import zlib
+
+from axamd.client import Anomaly, AXAMDException, Client, ProblemDetails
+from axamd.client.client import _frame, _reader
+from axamd.client.compression import TransferStats, decompressor
+from tests.fakeserver import FakeServer
+
+class TestFrame(unittest.TestCase):
+    def test_split_records(self):
+        chunks = [b'\x1e{"a":1}\n\x1e{"b"', b':2}\n', b'\x1e{"c":3}\n']
+        self.assertEqual(list(_frame(chunks)), [b'{"a":1}', b'{"b":2}', b'{"c":3}'])
+
+    def test_drop_incomplete(self):
+        self.assertEqual(list(_frame([b'\x1e{"a":1}\n\x1e{"b"'])), [b'{"a":1}'])
+
+    def test_skip_empty(self):
+        self.assertEqual(list(_frame([b'\n\x1e\n', b'{}\n'])), [b'{}'])
+
+
+class _Raw:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+class _Response:
+    def __init__(self, raw, headers=None):
+        self.raw = raw
+        self.headers = headers or {}
+
+class TestReader(unittest.TestCase):
+    # responses without read1(), as on Python 2
+    def test_chunked(self):
+        raw = _Raw(chunked=True, read_chunked=lambda decode_content: iter([b'ab', b'c']))
+        read = _reader(_Response(raw))
+        self.assertEqual([read(65536) for _ in range(3)], [b'ab', b'c', b''])
+
+    def test_socket(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        b.settimeout(5)
+        read = _reader(_Response(_Raw(_connection=_Raw(sock=b))))
+        a.sendall(b'abc')
+        # what has arrived, without waiting for the rest of 64 kB
+        self.assertEqual(read(65536), b'abc')
+
+    def test_length(self):
+        raw = _Raw(_connection=_Raw(sock=object()), read=lambda n, decode_content: b'x' * n)
+        read = _reader(_Response(raw, {'Content-Length': '3'}))
+        self.assertEqual(read(2), b'xx')
+
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(['{"tag":1,"op":"WATCH HIT"}']).start()
+        self.client = Client(self.server.uri, 'key')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_sra(self):
+        self.assertEqual(list(self.client.sra(channels=[212], watches=['ch=212'])),
+                ['{"tag":1,"op":"WATCH HIT"}'])
+        request = self.server.requests[0]
+        self.assertEqual(request['path'], '/v1/sra/stream')
+        self.assertEqual(request['headers']['X-API-Key'], 'key')
+        self.assertEqual(request['body'], {'channels': [212], 'watches': ['ch=212']})
+
+    def test_rad(self):
+        list(self.client.rad([Anomaly('test_anom', ['dns=*.'], 'opt=1')]))
+        self.assertEqual(self.server.requests[0]['body'], {'anomalies': [
+            {'module': 'test_anom', 'watches': ['dns=*.'], 'options': 'opt=1'}]})
+
+    def test_list_channels(self):
+        self.assertEqual(self.client.list_channels(), self.server.channels)
+
+    def test_problem(self):
+        self.server.problem = {'status': 403, 'type': 'invalid-api-key',
+                'title': 'Invalid API key'}
+        with self.assertRaises(ProblemDetails):
+            list(self.client.sra(channels=[212], watches=['ch=212']))
+
+
+class TestStreamLimits(unittest.TestCase):
+    def setUp(self):
+        self.records = ['{{"tag":1,"op":"WATCH HIT","n":{}}}'.format(i) for i in range(10)]
+        self.server = FakeServer(self.records)
+        self.server.hold = 30
+        self.server.start()
+        self.client = Client(self.server.uri, 'key')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _sra(self, **limits):
+        return list(self.client.sra(channels=[212], watches=['ch=212'], **limits))
+
+    def test_deadline(self):
+        start = time.time()
+        self.assertEqual(self._sra(deadline=start + 0.3), self.records)
+        self.assertLess(time.time() - start, 5)
+
+    def test_deadline_passed(self):
+        self.assertEqual(self._sra(deadline=time.time() - 1), [])
+        self.assertEqual(self.server.requests, [])
+
+    def test_deadline_threads(self):
+        results = {}
+        def run(i):
+            results[i] = self._sra(deadline=time.time() + 0.2 * (i + 1))
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertEqual(sorted(results), [0, 1, 2])
+        for lines in results.values():
+            self.assertEqual(lines, self.records)
+
+    def test_max_messages(self):
+        self.assertEqual(self._sra(max_messages=3), self.records[:3])
+
+    def test_max_bytes(self):
+        self.server.delay = 0.01
+        lines = self._sra(max_bytes=len(self.records[0]) * 2)
+        self.assertGreaterEqual(len(lines), 1)
+        self.assertLess(len(lines), len(self.records))
+        self.assertEqual(lines, self.records[:len(lines)])
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.records = ['{{"tag":1,"op":"WATCH HIT","n":{}}}'.format(i) for i in range(50)]
+        self.server = FakeServer(self.records).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _sra(self, client, stats):
+        return list(client.sra(channels=[212], watches=['ch=212'], transfer_stats=stats))
+
+    def test_gzip(self):
+        self.server.encoder = ('gzip', lambda: zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS))
+        stats = TransferStats()
+        self.assertEqual(self._sra(Client(self.server.uri, 'key'), stats), self.records)
+        self.assertEqual(stats.encoding, 'gzip')
+        self.assertLess(stats.compressed, stats.decompressed)
+        self.assertEqual(stats.decompressed, sum(len(r) + 2 for r in self.records))
+
+    def test_raw_deflate(self):
+        self.server.encoder = ('deflate', lambda: zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS))
+        self.assertEqual(self._sra(Client(self.server.uri, 'key'), TransferStats()), self.records)
+
+    def test_incremental(self):
+        self.server.encoder = ('gzip', lambda: _Flushing(zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)))
+        self.server.hold = 30
+        lines = []
+        for line in Client(self.server.uri, 'key').sra(channels=[212], watches=['ch=212']):
+            lines.append(line)
+            if len(lines) == len(self.records):
+                break
+        self.assertEqual(lines, self.records)
+
+    def test_disabled(self):
+        self.server.encoder = ('gzip', lambda: zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS))
+        stats = TransferStats()
+        self.assertEqual(self._sra(Client(self.server.uri, 'key', compression=False), stats), self.records)
+        self.assertEqual(stats.encoding, 'identity')
+        self.assertEqual(stats.compressed, stats.decompressed)
+        self.assertEqual(self.server.requests[0]['headers']['Accept-Encoding'], 'identity')
+
+    def test_unsupported(self):
+        with self.assertRaises(AXAMDException):
+            decompressor('compress')
+        self.assertIsNone(decompressor('identity'))
+
+
+class _Flushing:
+    # emits each record as soon as it is compressed
+    def __init__(self, obj):
+        self._obj = obj
+
+    def compress(self, data):
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class TestPreconnect(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(['{"tag":1,"op":"WATCH HIT"}'])
+        self.server.start()
+        self.client = Client(self.server.uri, 'key')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_stream_uses_connection(self):
+        self.server.latency = 0.5
+        self.client.preconnect()
+        time.sleep(0.6)
+        start = time.time()
+        self.assertEqual(len(list(self.client.sra([212], ['ch=212']))), 1)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual([r['path'] for r in self.server.requests], ['/v1/sra/stream'])
+
+    def test_prefetch(self):
+        self.client.preconnect(prefetch=True)
+        self.assertEqual(self.client.list_channels(), self.server.channels)
+        self.assertEqual(self.client.list_anomalies(), self.server.anomalies)
+        self.assertEqual(len(self.server.requests), 2)
+        # prefetched lists are used once
+        self.client.list_channels()
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_fallback_request(self):
+        # without the urllib3 pool internals a small request opens the connection
+        self.client._connect_pooled = lambda uri, timeout: False
+        self.client.preconnect()
+        self.assertEqual(len(list(self.client.sra([212], ['ch=212']))), 1)
+        self.assertEqual([r['path'] for r in self.server.requests],
+                ['/v1/sra/channels', '/v1/sra/stream'])
+
+    def test_unreachable(self):
+        server = FakeServer().start()
+        uri = server.uri
+        server.stop()
+        client = Client(uri, 'key', retries=0)
+        client.preconnect(timeout=1)
+        with self.assertRaises(Exception):
+            list(client.sra([212], ['ch=212']))
@@ -0,0 +1,101 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from axamd.client.daemon import Daemon
+from axamd.client.exceptions import AXAMDException
+from tests.fakeserver import FakeServer
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = FakeServer(['{"tag":1,"op":"WATCH HIT"}'])
+        self.server.hold = 30
+        self.server.start()
+        self.daemon = Daemon(lambda: self.config)
+
+    def tearDown(self):
+        for name in list(self.daemon.subscriptions):
+            self.daemon._stop(name)
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def _config(self, **subscriptions):
+        return {'server': self.server.uri, 'apikey': 'key',
+                'subscriptions': subscriptions}
+
+    def _output(self, name):
+        return os.path.join(self.dir, name)
+
+    def _wait_for_output(self, name):
+        for _ in range(100):
+            if os.path.exists(self._output(name)) and os.path.getsize(self._output(name)):
+                return
+            time.sleep(0.05)
+        self.fail('no output for {}'.format(name))
+
+    def test_apply_and_reload(self):
+        self.config = self._config(
+                a={'channels': [212], 'watches': ['ch=212'], 'output': self._output('a')},
+                b={'anomalies': [{'module': 'test_anom', 'watches': ['dns=*.']}],
+                    'output': self._output('b')})
+        self.assertEqual(self.daemon.apply(self.config), (['a', 'b'], []))
+        self._wait_for_output('a')
+        self._wait_for_output('b')
+        paths = sorted(r['path'] for r in self.server.requests)
+        self.assertEqual(paths, ['/v1/rad/stream', '/v1/sra/stream'])
+
+        a = self.daemon.subscriptions['a']
+        self.config['subscriptions']['b']['rate-limit'] = 10
+        self.config['subscriptions']['c'] = {'channels': [212], 'watches': ['ch=212'],
+                'output': self._output('c')}
+        self.daemon.reload()
+        self.assertIs(self.daemon.subscriptions['a'], a)
+        self.assertEqual(sorted(self.daemon.subscriptions), ['a', 'b', 'c'])
+        self._wait_for_output('c')
+        self.assertFalse(a._stopping.is_set())
+
+        del self.config['subscriptions']['c']
+        self.daemon.reload()
+        self.assertEqual(sorted(self.daemon.subscriptions), ['a', 'b'])
+
+    def test_invalid_reload_keeps_subscriptions(self):
+        self.config = self._config(a={'channels': [212], 'watches': ['ch=212'],
+            'output': self._output('a')})
+        self.daemon.apply(self.config)
+        self.config = self._config()
+        self.daemon.reload()
+        self.assertEqual(list(self.daemon.subscriptions), ['a'])
+
+    def test_pool_grows_on_reload(self):
+        config = self._config()
+        session = self.daemon._session(config, 3)
+        old = session.get_adapter(self.server.uri)
+        self.assertEqual(old._pool_maxsize, 10)
+        old.poolmanager.connection_from_url(self.server.uri)
+        self.assertIs(self.daemon._session(config, 25), session)
+        self.assertEqual(session.get_adapter(self.server.uri)._pool_maxsize, 25)
+        # the replaced pool is closed
+        self.assertEqual(len(old.poolmanager.pools), 0)
+        self.daemon._session(config, 12)
+        self.assertEqual(session.get_adapter(self.server.uri)._pool_maxsize, 25)
+
+    def test_no_subscriptions(self):
+        with self.assertRaises(AXAMDException):
+            self.daemon.apply(self._config())
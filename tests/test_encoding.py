@@ -0,0 +1,114 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import unittest
+
+from axamd.client import encoding
+from axamd.client.exceptions import AXAMDException
+
+ip_hit = '{"tag":1,"op":"WATCH HIT","channel":"ch123","time":"1970-01-01 00:00:01.000002","af":"IPv4","src":"1.2.3.4","dst":"5.6.7.8","ttl":255,"proto":"TCP","src_port":123,"dst_port":456,"flags":["SYN"],"payload":"3q2+7w=="}'
+nmsg_hit = '{"tag":2,"op":"WATCH HIT","channel":"ch204","field_idx":1,"val_idx":0,"vname":"SIE","mname":"dnsdedupe","nmsg":{"time":"1970-01-01 00:00:02.5","message":{"rrname":"example.com.","rdata":["192.0.2.1"],"custom":null}}}'
+missed = '{"tag":"*","op":"MISSED","missed":2,"dropped":-3,"rlimit":70000,"filtered":5000000000,"last_report":1.5,"ok":true}'
+long_values = json.dumps({'op': 'x' * 300, 'list': list(range(40)), 'map': dict(('k{}'.format(i), -i * 1000) for i in range(20))})
+
+class _Codec(unittest.TestCase):
+    name = None
+
+    def _round_trip(self, line):
+        frame = encoding.encode(line, self.name)
+        self.assertEqual(encoding._length.unpack(frame[:4])[0], len(frame) - 4)
+        self.assertEqual(encoding.decode(frame[4:], self.name), json.loads(line))
+        return frame
+
+    def test_round_trip(self):
+        for line in (ip_hit, nmsg_hit, missed, long_values):
+            self._round_trip(line)
+
+    def test_smaller(self):
+        for line in (ip_hit, nmsg_hit, missed):
+            self.assertLess(len(self._round_trip(line)), len(line) * 0.8)
+
+    def test_stream(self):
+        f = io.BytesIO(b''.join(encoding.encoded([ip_hit, missed], self.name)))
+        self.assertEqual(list(encoding.read_messages(f, self.name)),
+                [json.loads(ip_hit), json.loads(missed)])
+
+    def test_truncated(self):
+        frame = encoding.encode(ip_hit, self.name)
+        with self.assertRaises(AXAMDException):
+            list(encoding.read_frames(io.BytesIO(frame[:-1])))
+        with self.assertRaises(AXAMDException):
+            encoding.decode(frame[4:-1], self.name)
+
+class TestMsgpack(_Codec):
+    name = 'msgpack'
+
+    def test_builtin_format(self):
+        out = []
+        encoding._pack_msgpack({0: 'ab', 'x': [None, True, -1, 200]}, out)
+        self.assertEqual(b''.join(out), b'\x82\x00\xa2ab\xa1x\x94\xc0\xc3\xff\xcc\xc8')
+
+    @unittest.skipIf(encoding.msgpack is None, 'msgpack is not available')
+    def test_builtin_compatible(self):
+        for line in (ip_hit, nmsg_hit, missed, long_values):
+            obj = encoding.intern_keys(json.loads(line))
+            out = []
+            encoding._pack_msgpack(obj, out)
+            self.assertEqual(encoding.msgpack.unpackb(b''.join(out), raw=False,
+                strict_map_key=False), obj)
+
+class TestCBOR(_Codec):
+    name = 'cbor'
+
+    def test_builtin_format(self):
+        out = []
+        encoding._pack_cbor({0: 'ab', 'x': [None, True, -1, 500]}, out)
+        self.assertEqual(b''.join(out), b'\xa2\x00\x62ab\x61x\x84\xf6\xf5\x20\x19\x01\xf4')
+
+    def test_half_float(self):
+        self.assertEqual(encoding._unpack_cbor(encoding._Reader(b'\xf9\x3e\x00')), 1.5)
+
+    @unittest.skipIf(encoding.cbor2 is None, 'cbor2 is not available')
+    def test_builtin_compatible(self):
+        for line in (ip_hit, nmsg_hit, missed, long_values):
+            obj = encoding.intern_keys(json.loads(line))
+            out = []
+            encoding._pack_cbor(obj, out)
+            self.assertEqual(encoding.cbor2.loads(b''.join(out)), obj)
+
+class TestKeys(unittest.TestCase):
+    def test_intern(self):
+        obj = encoding.intern_keys(json.loads(nmsg_hit))
+        self.assertEqual(obj[encoding.KEYS.index('op')], 'WATCH HIT')
+        message = obj[encoding.KEYS.index('nmsg')][encoding.KEYS.index('message')]
+        self.assertIn(encoding.KEYS.index('rrname'), message)
+        self.assertIn('custom', message)
+
+    def test_unknown_index(self):
+        with self.assertRaises(AXAMDException):
+            encoding.restore_keys({len(encoding.KEYS): 1})
+
+    def test_json_passthrough(self):
+        self.assertEqual(list(encoding.encoded([ip_hit], 'json')), [ip_hit])
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(AXAMDException):
+            encoding.encode(ip_hit, 'xml')
+
+del _Codec
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from axamd.client import Client
+from axamd.client.enrich import Enricher, IPTable, LRUCache, PublicSuffixList
+from axamd.client.exceptions import AXAMDException
+from tests.fakeserver import FakeServer
+
+SOURCE = '''
+# prefix value
+10.0.0.0/8 AS1
+10.1.0.0/16 AS2
+10.1.2.0/24 AS3
+192.168.0.0-192.168.0.255 AS4
+2001:db8::/32 AS5
+'''
+
+SUFFIXES = '''
+// comment
+com
+uk
+co.uk
+*.ck
+!www.ck
+'''
+
+class TestEnrich(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'asn.iptable')
+        IPTable.compile(SOURCE.splitlines(), self.path)
+        self.table = IPTable(self.path)
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.dir)
+
+    def test_lookup(self):
+        lookup = self.table.lookup
+        self.assertEqual(lookup('10.0.0.1'), 'AS1')
+        self.assertEqual(lookup('10.1.0.0'), 'AS2')
+        self.assertEqual(lookup('10.1.2.255'), 'AS3')
+        self.assertEqual(lookup('10.1.3.0'), 'AS2')
+        self.assertEqual(lookup('10.2.0.0'), 'AS1')
+        self.assertEqual(lookup('10.255.255.255'), 'AS1')
+        self.assertEqual(lookup('192.168.0.7'), 'AS4')
+        self.assertEqual(lookup('2001:db8::1'), 'AS5')
+        self.assertIsNone(lookup('11.0.0.0'))
+        self.assertIsNone(lookup('9.255.255.255'))
+        self.assertIsNone(lookup('2001:db9::'))
+        self.assertIsNone(lookup('not an address'))
+        self.assertEqual(len(self.table), 7)
+
+    def test_invalid(self):
+        self.assertRaises(AXAMDException, IPTable.compile, ['10.0.0.0/33 x'], self.path + '2')
+        self.assertRaises(AXAMDException, IPTable.compile,
+                ['10.0.0.0-10.0.1.0 x', '10.0.1.0/24 y'], self.path + '2')
+        with open(self.path + '3', 'wb') as f:
+            f.write(b'not a table')
+        self.assertRaises(AXAMDException, IPTable, self.path + '3')
+
+    def test_public_suffixes(self):
+        psl = PublicSuffixList(SUFFIXES.splitlines())
+        self.assertEqual(psl.registrable_domain('www.Example.COM.'), 'example.com')
+        self.assertEqual(psl.registrable_domain('a.b.example.co.uk'), 'example.co.uk')
+        self.assertEqual(psl.registrable_domain('a.foo.ck'), 'a.foo.ck')
+        self.assertEqual(psl.registrable_domain('a.www.ck'), 'www.ck')
+        self.assertEqual(psl.registrable_domain('example.test'), 'example.test')
+        self.assertIsNone(psl.registrable_domain('co.uk'))
+        # a wildcard still applies next to a longer rule sharing its label
+        psl = PublicSuffixList(['*.a', 'b.c.a'])
+        self.assertEqual(psl.suffix_labels(['x', 'c', 'a']), 2)
+        self.assertEqual(psl.suffix_labels(['x', 'b', 'c', 'a']), 3)
+        self.assertEqual(psl.suffix_labels(['x', 'y', 'a']), 2)
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        calls = []
+        compute = lambda k: calls.append(k) or k.upper()
+        for key in ('a', 'b', 'a', 'c', 'b'):
+            cache.get(key, compute)
+        self.assertEqual(calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_enricher(self):
+        enricher = Enricher(ip_tables={'asn': self.path},
+                public_suffixes=PublicSuffixList(SUFFIXES.splitlines()))
+        hit = json.dumps({'tag': 1, 'op': 'WATCH HIT', 'src': '10.1.2.3', 'dst': '11.0.0.1',
+            'nmsg': {'message': {'rrname': 'www.example.co.uk.', 'rdata': ['10.0.0.9', 'x']}}})
+        with FakeServer([hit, '{"tag":"*","op":"MISSED"}']) as server:
+            lines = list(Client(server.uri, 'key').sra(channels=[212], watches=['ch=212'],
+                enricher=enricher, fields=['enrichment'], fields_format='tsv'))
+        self.assertEqual(json.loads(lines[0]), {
+            'src': {'asn': 'AS3'},
+            'rdata': {'10.0.0.9': {'asn': 'AS1'}},
+            'rrname': {'domain': 'example.co.uk'},
+            })
+        self.assertEqual(lines[1], '')
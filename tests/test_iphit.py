@@ -0,0 +1,99 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from axamd.client import iphit
+from axamd.client.exceptions import AXAMDException
+
+ip4_hit = '{"tag":1,"op":"WATCH HIT","channel":"ch25","time":"1970-01-01 00:00:01.000002","af":"IPv4","src":"192.0.2.7","dst":"10.1.2.3","ttl":64,"proto":"TCP","src_port":40000,"dst_port":23,"flags":["SYN","ACK"],"payload":"3q2+7w=="}'
+ip6_hit = '{"tag":2,"op":"WATCH HIT","channel":"ch25","af":"IPv6","src":"2001:db8::1","dst":"2001:db8:1::2","proto":"UDP","src_port":53,"dst_port":5353}'
+missed = '{"tag":"*","op":"MISSED","missed":2,"dropped":3,"rlimit":4,"filtered":5,"last_report":6}'
+
+class TestIPHit(unittest.TestCase):
+    def test_fields(self):
+        hit = iphit.IPHit(ip4_hit)
+        self.assertEqual(hit.version, 4)
+        self.assertEqual(hit.src, 0xc0000207)
+        self.assertEqual(hit.src_address, '192.0.2.7')
+        self.assertEqual(hit.dst_address, '10.1.2.3')
+        self.assertEqual(hit.time, 1000002000)
+        self.assertEqual(hit.flags, iphit.FLAGS['SYN'] | iphit.FLAGS['ACK'])
+        self.assertEqual(hit.flag_names, ['SYN', 'ACK'])
+        self.assertEqual(hit.payload, b'\xde\xad\xbe\xef')
+        self.assertFalse(hasattr(hit, '__dict__'))
+
+    def test_interned(self):
+        a, b = iphit.IPHit(ip4_hit), iphit.IPHit(json.loads(ip4_hit))
+        self.assertIs(a.proto, b.proto)
+        self.assertIs(a.channel, b.channel)
+
+    def test_not_ip_hit(self):
+        with self.assertRaises(AXAMDException):
+            iphit.IPHit(missed)
+        hits = list(iphit.iter_ip_hits([missed, ip6_hit]))
+        self.assertEqual([h.src_address for h in hits], ['2001:db8::1'])
+
+    def test_bad_flag(self):
+        with self.assertRaises(AXAMDException):
+            iphit.IPHit(ip4_hit.replace('"ACK"', '"PSH"'))
+
+class TestIPHitColumns(unittest.TestCase):
+    def setUp(self):
+        self.hits = iphit.IPHitColumns()
+        self.assertEqual(self.hits.extend([ip4_hit, missed, ip6_hit]), 2)
+
+    def test_columns(self):
+        c = self.hits.columns
+        self.assertEqual(len(self.hits), 2)
+        self.assertEqual(list(c['version']), [4, 6])
+        self.assertEqual(list(c['src_port']), [40000, 53])
+        self.assertEqual(list(c['ttl']), [64, -1])
+        self.assertEqual(list(c['time'])[1], -1)
+        self.assertEqual(self.hits.protocols, ['TCP', 'UDP'])
+        self.assertEqual(self.hits.channels, ['ch25'])
+        self.assertEqual(list(c['channel']), [1, 1])
+        self.assertEqual(self.hits.address(0), '192.0.2.7')
+        self.assertEqual(self.hits.address(1, 'dst'), '2001:db8:1::2')
+        self.assertEqual(self.hits.proto(1), 'UDP')
+        self.assertEqual(self.hits.payload(0), b'\xde\xad\xbe\xef')
+        self.assertIsNone(self.hits.payload(1))
+
+    def test_getitem(self):
+        hit = self.hits[0]
+        original = iphit.IPHit(ip4_hit)
+        for name in iphit.IPHit.__slots__:
+            self.assertEqual(getattr(hit, name), getattr(original, name), name)
+        self.assertEqual(self.hits[1].dst_address, '2001:db8:1::2')
+        self.assertIsNone(self.hits[1].ttl)
+
+    def test_in_network(self):
+        self.assertEqual(list(self.hits.in_network('192.0.2.0/24')), [True, False])
+        self.assertEqual(list(self.hits.in_network('192.0.3.0/24')), [False, False])
+        self.assertEqual(list(self.hits.in_network('10.0.0.0/8', 'dst')), [True, False])
+        self.assertEqual(list(self.hits.in_network('2001:db8::/32')), [False, True])
+        self.assertEqual(list(self.hits.in_network('2001:db8:1::/48', 'dst')), [False, True])
+        self.assertEqual(list(self.hits.in_network('0.0.0.0/0')), [True, False])
+        with self.assertRaises(AXAMDException):
+            self.hits.in_network('192.0.2.0/33')
+
+    @unittest.skipIf(iphit.numpy is None, 'NumPy is not available')
+    def test_numpy(self):
+        columns = self.hits.to_numpy()
+        self.assertEqual(list(columns['dst_port']), [23, 5353])
+        self.assertEqual(int(columns['src_lo'][0]) & 0xffffffff, 0xc0000207)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+import unittest
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from axamd.client import Anomaly, Client
+from axamd.client.live import LiveStream
+from tests.fakeserver import FakeServer
+
+def _records(body):
+    # one hit per watch and n, then a marker naming the watch list
+    keys = body.get('watches') or [a['module'] for a in body.get('anomalies', [])]
+    hits = [json.dumps({'tag': i + 1, 'op': 'WATCH HIT', 'watch': w, 'n': n}, sort_keys=True)
+            for i, w in enumerate(keys) for n in range(3)]
+    return hits + [json.dumps({'op': 'END', 'keys': keys})]
+
+A, B, C = 'ip=10.0.0.1', 'ip=10.0.0.2', 'dns=*.example.com.'
+
+class _Scripted:
+    # a client whose forks stream the lines put on their queues
+    def __init__(self):
+        self.forks = []
+
+    def fork(self):
+        fork = _ScriptedFork()
+        self.forks.append(fork)
+        return fork
+
+class _ScriptedFork:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.closed = threading.Event()
+
+    def sra(self, channels, watches, **params):
+        while True:
+            line = self.queue.get()
+            if line is None:
+                return
+            yield line
+
+    def close(self):
+        self.closed.set()
+        self.queue.put(None)
+
+def _hit(n, tag=1):
+    return json.dumps({'tag': tag, 'op': 'WATCH HIT', 'n': n})
+
+missed = '{"tag":"*","op":"MISSED","missed":1}'
+
+class TestLiveStream(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(_records)
+        self.server.hold = 30
+        self.server.start()
+        self.client = Client(self.server.uri, 'key')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _until_end(self, it):
+        lines = []
+        for line in it:
+            msg = json.loads(line)
+            if msg['op'] == 'END':
+                return lines, msg['keys']
+            lines.append(msg)
+        self.fail('stream ended')
+
+    def test_update(self):
+        stream = LiveStream(self.client, channels=[212], watches=[A, B])
+        it = iter(stream)
+        lines, keys = self._until_end(it)
+        self.assertEqual(keys, [A, B])
+        self.assertEqual([(m['tag'], m['watch']) for m in lines],
+                [(1, A)] * 3 + [(2, B)] * 3)
+
+        stream.update(watches=[C, A])
+        lines, keys = self._until_end(it)
+        self.assertEqual(keys, [C, A])
+        # A keeps tag 1; its hits repeated by the new stream are dropped
+        self.assertEqual([(m['tag'], m['watch']) for m in lines], [(3, C)] * 3)
+        self.assertEqual(stream.duplicates, 3)
+        self.assertEqual(stream.switches, 1)
+        self.assertEqual(stream.tags, {A: 1, B: 2, C: 3})
+        self.assertEqual(self.server.requests[1]['body']['watches'], [C, A])
+        self.assertEqual(self.server.requests[1]['body']['channels'], [212])
+        stream.close()
+
+    def test_drain_until_overlap(self):
+        client = _Scripted()
+        stream = LiveStream(client, channels=[212], watches=[A], grace=30)
+        it = iter(stream)
+        old = client.forks[0]
+        old.queue.put(_hit(0))
+        self.assertEqual(next(it), _hit(0))
+
+        stream.update(watches=[A, B])
+        new = client.forks[1]
+        new.queue.put(missed)
+        time.sleep(0.1)
+        # the update has not caught up; the old stream keeps delivering
+        old.queue.put(_hit(1))
+        self.assertEqual(next(it), _hit(1))
+        self.assertFalse(old.closed.is_set())
+
+        for n in (0, 1, 2):
+            new.queue.put(_hit(n))
+        self.assertEqual(next(it), missed)
+        self.assertEqual(next(it), _hit(2))
+        self.assertTrue(old.closed.is_set())
+        self.assertEqual((stream.switches, stream.duplicates), (1, 2))
+        stream.close()
+
+    def test_grace(self):
+        client = _Scripted()
+        stream = LiveStream(client, channels=[212], watches=[A], grace=0.2)
+        it = iter(stream)
+        client.forks[0].queue.put(_hit(0))
+        next(it)
+        stream.update(watches=[B])
+        client.forks[1].queue.put(missed)
+        start = time.time()
+        self.assertEqual(next(it), missed)
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertTrue(client.forks[0].closed.is_set())
+        stream.close()
+
+    def test_remap_top_level_tag(self):
+        client = _Scripted()
+        stream = LiveStream(client, channels=[212], watches=[A, B])
+        generation = stream._generation([212], [B], None)
+        self.assertEqual(stream._remap(generation, '{"tag":1,"op":"WATCH HIT"}'),
+                '{"tag":2,"op":"WATCH HIT"}')
+        self.assertEqual(json.loads(stream._remap(generation,
+            '{"op":"WATCH HIT","nmsg":{"tag":1},"tag":1}')),
+            {'op': 'WATCH HIT', 'nmsg': {'tag': 1}, 'tag': 2})
+        self.assertEqual(stream._remap(generation, '{"op":"X","nmsg":{"tag":1}}'),
+                '{"op":"X","nmsg":{"tag":1}}')
+
+    def test_rad_update(self):
+        x, y = Anomaly('x', ['dns=*.']), Anomaly('y', ['dns=*.'])
+        stream = LiveStream(self.client, anomalies=[x])
+        it = iter(stream)
+        lines, _ = self._until_end(it)
+        self.assertEqual(set(m['tag'] for m in lines), set([1]))
+        stream.update(anomalies=[y, x])
+        lines, keys = self._until_end(it)
+        self.assertEqual(keys, ['y', 'x'])
+        self.assertEqual([(m['tag'], m['watch']) for m in lines], [(2, 'y')] * 3)
+        stream.close()
@@ -0,0 +1,115 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from axamd.client import Anomaly, Client
+from axamd.client.exceptions import AXAMDException
+from axamd.client.loss import LossTracker
+from axamd.client.prefilter import RecordFilter
+from tests.fakeserver import FakeServer
+
+def hit(tag, op='WATCH HIT'):
+    return json.dumps({'tag': tag, 'op': op, 'channel': 'ch212'})
+
+def missed(missed=0, dropped=0, rlimit=0, filtered=0):
+    return json.dumps({'tag': '*', 'op': 'MISSED', 'missed': missed, 'dropped': dropped,
+        'rlimit': rlimit, 'filtered': filtered, 'last_report': 0})
+
+def rad_missed(tag='*', **counters):
+    msg = {'tag': tag, 'op': 'RAD MISSED', 'last_report': 0}
+    for name in ('sra_missed', 'sra_dropped', 'sra_rlimit', 'sra_filtered',
+            'dropped', 'rlimit', 'filtered'):
+        msg[name] = counters.get(name, 0)
+    return json.dumps(msg)
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestLossTracker(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        self.tracker = LossTracker(window=10, windows=3, clock=self.clock)
+
+    def test_window(self):
+        for line in [hit(1)] * 6 + [hit(2)] * 2:
+            self.tracker.observe(line)
+        self.tracker.observe(missed(missed=1, dropped=1, rlimit=2, filtered=16))
+        self.tracker.flush()
+        w, = self.tracker.history()
+        self.assertEqual((w.start, w.end, w.hits, w.reports, w.lost), (1000, 1010, 8, 1, 4))
+        self.assertEqual(w.delivered_ratio, 0.5)
+        self.assertAlmostEqual(w.loss_ratio, 4 / 12.0)
+        self.assertAlmostEqual(w.rlimit_pressure, 2 / 12.0)
+        self.assertEqual(self.tracker.history(1)[0].hits, 6)
+        self.assertEqual(self.tracker.history(2)[0].hits, 2)
+        self.assertIsNone(self.tracker.history(2)[0].delivered_ratio)
+        self.assertEqual(sorted(self.tracker.keys(), key=str), [1, 2, None])
+
+    def test_ring(self):
+        for i in range(5):
+            self.tracker.observe(hit(1))
+            self.tracker.observe(missed(rlimit=i))
+            self.clock.now += 10
+        self.tracker.flush()
+        history = self.tracker.history()
+        self.assertEqual([w.counters['rlimit'] for w in history], [2, 3, 4])
+        self.assertEqual([w.start for w in history], [1020, 1030, 1040])
+        totals = self.tracker.totals()
+        self.assertEqual((totals.hits, totals.counters['rlimit']), (3, 9))
+
+    def test_threshold(self):
+        calls = []
+        self.tracker.on('rlimit_pressure', 0.5, lambda key, w: calls.append((key, w.start)))
+        for rlimit in (0, 10, 10, 0, 10):
+            self.tracker.observe(hit(1))
+            self.tracker.observe(missed(rlimit=rlimit, filtered=rlimit + 1))
+            self.clock.now += 10
+        self.tracker.flush()
+        # called when crossing, not again while above
+        self.assertEqual(calls, [(None, 1010), (None, 1040)])
+        with self.assertRaises(AXAMDException):
+            self.tracker.on('nope', 1, None)
+
+    def test_rad_modules(self):
+        tracker = LossTracker(anomalies=[Anomaly('ip_probe'), Anomaly('brand_sentry')],
+                clock=self.clock)
+        tracker.observe(hit(2, 'ANOMALY HIT'))
+        tracker.observe(rad_missed(sra_missed=1, sra_rlimit=2, dropped=3, rlimit=4))
+        tracker.observe(rad_missed(tag=1, rlimit=1))
+        tracker.flush()
+        total = tracker.totals()
+        self.assertEqual((total.lost, total.hits, total.reports), (11, 1, 2))
+        self.assertAlmostEqual(total.rlimit_pressure, 7 / 12.0)
+        self.assertEqual(tracker.totals('brand_sentry').hits, 1)
+        self.assertEqual(tracker.totals('ip_probe').counters['rlimit'], 1)
+
+    def test_record_filter(self):
+        records = [hit(1), missed(missed=5, filtered=10), hit(1)]
+        with FakeServer(records) as server:
+            tracker = LossTracker(record_filter=RecordFilter(drop_ops=['MISSED']),
+                    clock=self.clock)
+            lines = list(Client(server.uri, 'key').sra([212], ['ch=212'],
+                record_filter=tracker))
+        self.assertEqual(lines, [hit(1), hit(1)])
+        total = tracker.totals()
+        self.assertEqual((total.hits, total.lost, total.delivered_ratio), (2, 5, 0.2))
+
+if __name__ == '__main__':
+    unittest.main()
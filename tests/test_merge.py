@@ -0,0 +1,103 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+import unittest
+
+from axamd.client.merge import Merger, merge, message_time
+
+def _hit(seconds, n=0):
+    return json.dumps({'tag': 1, 'op': 'WATCH HIT', 'n': n,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds)) + '.000000500'})
+
+def _times(merged):
+    return [m.time // 1000000000 for m in merged]
+
+class TestMerge(unittest.TestCase):
+    def test_message_time(self):
+        self.assertEqual(message_time(_hit(1)), 1000000500)
+        self.assertEqual(message_time(b'{"time": "1970-01-01 00:00:02"}'), 2000000000)
+        self.assertIsNone(message_time('{"op":"MISSED"}'))
+
+    def test_sorted_streams(self):
+        a = [_hit(t) for t in (1, 4, 5, 9)]
+        b = [_hit(t) for t in (2, 3, 6, 7, 8)]
+        merged = list(merge([a, b], window=100))
+        self.assertEqual(_times(merged), list(range(1, 10)))
+        self.assertFalse(any(m.late for m in merged))
+        self.assertEqual(sorted(m.source for m in merged), [0] * 4 + [1] * 5)
+
+    def test_reorder_window(self):
+        merged = list(merge([[_hit(t) for t in (10, 12, 11, 20, 13, 30, 14)]], window=5))
+        self.assertEqual(_times(merged), [10, 11, 12, 13, 20, 14, 30])
+        self.assertEqual([m.late for m in merged], [False] * 5 + [True, False])
+
+    def test_untimed(self):
+        merged = list(merge([['{"op":"MISSED"}', _hit(1)]], window=5))
+        self.assertEqual([m.time for m in merged], [None, 1000000500])
+
+    def test_max_pending(self):
+        merger = Merger([[_hit(t) for t in (5, 4, 3, 2, 1)]], window=100, max_pending=2)
+        merged = list(merger)
+        self.assertEqual(_times(merged), [3, 2, 1, 4, 5])
+        self.assertEqual(merger.late, 2)
+        self.assertEqual(merger.emitted, 5)
+
+    def test_idle_flush(self):
+        def slow():
+            yield _hit(1)
+            time.sleep(0.5)
+            yield _hit(2)
+        start = time.time()
+        it = merge([slow()], window=0.1, idle=0.1)
+        self.assertEqual(next(it).time, 1000000500)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(_times(it), [2])
+
+    def test_lagging_stream(self):
+        def lagging():
+            time.sleep(0.3)
+            for t in (2, 5):
+                yield _hit(t)
+        fast = [_hit(t) for t in (1, 3, 4, 6, 7)]
+        merger = Merger([fast, lagging()], window=0, idle=5)
+        self.assertEqual(_times(merger), [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(merger.late, 0)
+
+    def test_close_streams(self):
+        class Quiet:
+            def __init__(self):
+                self.closed = threading.Event()
+            def __iter__(self):
+                yield _hit(1)
+                self.closed.wait(10)
+            def close(self):
+                self.closed.set()
+        quiet = Quiet()
+        merger = Merger([quiet], window=0, idle=0.1)
+        it = iter(merger)
+        self.assertEqual(_times([next(it)]), [1])
+        it.close()
+        self.assertTrue(quiet.closed.is_set())
+        merger._threads[0].join(5)
+        self.assertFalse(merger._threads[0].is_alive())
+
+    def test_error(self):
+        def failing():
+            yield _hit(1)
+            raise IOError('stream failed')
+        with self.assertRaises(IOError):
+            list(merge([failing()], window=5))
@@ -0,0 +1,153 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from axamd.client.exceptions import AXAMDException
+from axamd.client.partition import HashRing, PartitionConsumer, Relay, partition_key
+from axamd.client.sinks import Sink
+
+class _NullSink(Sink):
+    def write_batch(self, lines):
+        pass
+
+def _hit(i):
+    return json.dumps({'tag': 1, 'op': 'WATCH HIT', 'channel': 'ch212',
+        'src': '10.0.0.{}'.format(i % 250), 'nmsg': {'message': {'rrname': 'host{}.example.com.'.format(i)}}})
+
+class TestHashRing(unittest.TestCase):
+    def test_partition_key(self):
+        line = _hit(7)
+        self.assertEqual(partition_key(line), b'host7.example.com.')
+        self.assertEqual(partition_key(line, 'src'), b'10.0.0.7')
+        self.assertEqual(partition_key(line.encode('utf-8'), 'tag'), b'1')
+        self.assertIsNone(partition_key('{"op":"MISSED"}'))
+
+    def test_balance_and_movement(self):
+        keys = [str(i).encode() for i in range(3000)]
+        ring = HashRing(['a', 'b', 'c'])
+        before = dict((k, ring.node_for(k)) for k in keys)
+        counts = dict((n, list(before.values()).count(n)) for n in 'abc')
+        self.assertTrue(all(n > 500 for n in counts.values()), counts)
+
+        ring.add('d')
+        after = dict((k, ring.node_for(k)) for k in keys)
+        moved = [k for k in keys if before[k] != after[k]]
+        self.assertTrue(all(after[k] == 'd' for k in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+        ring.remove('d')
+        self.assertEqual(dict((k, ring.node_for(k)) for k in keys), before)
+        self.assertIsNone(HashRing().node_for(b'x'))
+
+
+class TestRelay(unittest.TestCase):
+    def _consume(self, consumer, out):
+        for line in consumer:
+            out.append(line)
+
+    def test_relay(self):
+        start = threading.Event()
+        lines = [_hit(i) for i in range(200)] + ['{"tag":"*","op":"MISSED"}']
+        def upstream():
+            start.wait(10)
+            for line in lines:
+                yield line
+        relay = Relay(upstream(), '127.0.0.1:0')
+        address = '{}:{}'.format(*relay.address)
+        outputs = {}
+        threads = []
+        for name in ('a', 'b'):
+            outputs[name] = []
+            consumer = PartitionConsumer(address, name, timeout=10)
+            t = threading.Thread(target=self._consume, args=(consumer, outputs[name]))
+            t.start()
+            threads.append(t)
+        for _ in range(100):
+            if relay.consumers == ['a', 'b']:
+                break
+            time.sleep(0.02)
+        start.set()
+        relay.run()
+        for t in threads:
+            t.join(10)
+
+        a, b = outputs['a'], outputs['b']
+        self.assertEqual(a[-1], lines[-1])
+        self.assertEqual(b[-1], lines[-1])
+        self.assertEqual(sorted(a[:-1] + b[:-1]), sorted(lines[:-1]))
+        self.assertTrue(a[:-1] and b[:-1])
+        self.assertEqual((relay.relayed, relay.broadcast, relay.dropped), (200, 1, 0))
+
+    def test_no_consumers(self):
+        relay = Relay(iter([_hit(1)]), '127.0.0.1:0', min_consumers=0)
+        relay.run()
+        self.assertEqual(relay.dropped, 1)
+
+    def test_waits_for_consumer(self):
+        relay = Relay(iter([_hit(1), _hit(2)]), '127.0.0.1:0')
+        t = threading.Thread(target=relay.run)
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())
+        consumer = PartitionConsumer('{}:{}'.format(*relay.address), 'a', timeout=10)
+        t.join(10)
+        self.assertEqual(list(consumer), [_hit(1), _hit(2)])
+        self.assertEqual(relay.dropped, 0)
+
+    def test_keyless_hits(self):
+        relay = Relay(iter([]), '127.0.0.1:0', min_consumers=0)
+        sent = dict((name, []) for name in ('a', 'b'))
+        relay._send = lambda name, sink, line: sent[name].append(line) or True
+        relay._consumers = {'a': _NullSink(), 'b': _NullSink()}
+        relay._ring.add('a')
+        relay._ring.add('b')
+        ip_hits = [json.dumps({'tag': 1, 'op': 'WATCH HIT', 'src': '10.0.0.{}'.format(i)})
+                for i in range(100)]
+        anonymous = '{"tag":1,"op":"WATCH HIT"}'
+        for line in ip_hits + ip_hits + [anonymous, anonymous, '{"tag":"*","op":"MISSED"}']:
+            relay.relay(line)
+        self.assertEqual((relay.relayed, relay.broadcast), (202, 1))
+        # keyed by src: the same hits go to the same consumer both times
+        a = sent['a'][:-2]
+        self.assertEqual(a[:len(a) // 2], a[len(a) // 2:])
+        self.assertTrue(a and len(a) < 200)
+        self.assertEqual(sent['a'][-2:], [anonymous, '{"tag":"*","op":"MISSED"}'])
+        self.assertEqual(sent['b'][-2:], [anonymous, '{"tag":"*","op":"MISSED"}'])
+        relay.close()
+
+    def test_unix_socket(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, 'relay.sock')
+        # left behind by a relay that was killed
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        relay = Relay(iter([]), 'unix:' + path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertRaises(AXAMDException, Relay, iter([]), 'unix:' + path)
+        relay.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_invalid(self):
+        self.assertRaises(AXAMDException, Relay, iter([]), '127.0.0.1:0', by='qname')
+        self.assertRaises(AXAMDException, Relay, iter([]), 'nowhere')
@@ -0,0 +1,90 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+
+from axamd.client.pool import ClientPool, StreamLimitExceeded
+from tests.fakeserver import FakeServer
+
+records = ['{"tag":1,"op":"WATCH HIT","n":%d}' % i for i in range(3)]
+
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(records).start()
+        self.pool = ClientPool(self.server.uri, max_streams=1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_keys_per_request(self):
+        a, b = self.pool.client('key-a'), self.pool.client('key-b')
+        self.assertIs(a._new_session(), b._new_session())
+        self.assertEqual(len(list(a.sra([212], ['ch=212']))), 3)
+        self.assertEqual(len(list(b.sra([212], ['ch=212']))), 3)
+        self.assertEqual([r['headers']['X-API-Key'] for r in self.server.requests],
+                ['key-a', 'key-b'])
+
+    def test_catalog_cache(self):
+        a, b = self.pool.client('key-a'), self.pool.client('key-b')
+        channels = a.list_channels()
+        channels['changed'] = True
+        self.assertEqual(a.list_channels(), self.server.channels)
+        self.assertEqual(self.pool.client('key-a').list_channels(), self.server.channels)
+        b.list_channels()
+        a.list_anomalies()
+        self.assertEqual(len(self.server.requests), 3)
+        usage = self.pool.usage('key-a')
+        self.assertEqual((usage.catalog_requests, usage.catalog_hits), (2, 2))
+        self.pool.invalidate('key-a')
+        a.list_channels()
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_limit(self):
+        self.server.hold = 30
+        a = self.pool.client('key-a')
+        first = a.sra([212], ['ch=212'])
+        next(first)
+        with self.assertRaises(StreamLimitExceeded):
+            next(a.fork().sra([212], ['ch=212']))
+        # other keys have their own limit
+        other = self.pool.client('key-b').sra([212], ['ch=212'])
+        next(other)
+        first.close()
+        other.close()
+        self.assertEqual(len(list(a.sra([212], ['ch=212'], max_messages=3))), 3)
+        usage = self.pool.usage()
+        self.assertEqual((usage['key-a'].streams, usage['key-a'].active,
+            usage['key-a'].rejected, usage['key-a'].messages), (2, 0, 1, 4))
+        self.assertEqual(usage['key-b'].messages, 1)
+
+    def test_block(self):
+        self.server.hold = 30
+        pool = ClientPool(self.server.uri, max_streams=1, block=True)
+        self.addCleanup(pool.close)
+        first = pool.client('key-a').sra([212], ['ch=212'])
+        next(first)
+        result = []
+        waiting = pool.client('key-a').sra([212], ['ch=212'], max_messages=1)
+        t = threading.Thread(target=lambda: result.extend(waiting))
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())
+        first.close()
+        t.join(10)
+        self.assertEqual(len(result), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from axamd.client import Client
+from axamd.client.prefilter import RecordFilter, scan_op, scan_tag, scan_channel
+from tests.fakeserver import FakeServer
+
+whit = b'{"tag":1,"op":"WATCH HIT","channel":"ch123","time":"1970-01-01 00:00:01.000002","af":"IPv4","src":"1.2.3.4","dst":"5.6.7.8","ttl":255,"proto":"UDP","src_port":123,"dst_port":456,"payload":"3q2+7w=="}'
+whit2 = b'{"tag":2,"op":"WATCH HIT","channel":"ch212","time":"1970-01-01 00:00:01.000002","af":"IPv4","src":"1.2.3.4","dst":"5.6.7.8","ttl":255,"proto":"UDP","src_port":123,"dst_port":456,"payload":"3q2+7w=="}'
+missed = b'{"tag":"*","op":"MISSED","missed":2,"dropped":3,"rlimit":4,"filtered":5,"last_report":6}'
+
+class TestScan(unittest.TestCase):
+    def test_scan(self):
+        self.assertEqual(scan_op(whit), b'WATCH HIT')
+        self.assertEqual(scan_tag(whit), b'1')
+        self.assertEqual(scan_tag(missed), b'"*"')
+        self.assertEqual(scan_channel(whit), b'ch123')
+        self.assertIsNone(scan_channel(missed))
+
+
+class TestRecordFilter(unittest.TestCase):
+    def test_drop_ops(self):
+        f = RecordFilter(drop_ops=['MISSED'])
+        self.assertTrue(f(whit))
+        self.assertFalse(f(missed))
+        self.assertEqual((f.passed, f.dropped), (1, 1))
+
+    def test_ops(self):
+        f = RecordFilter(ops=['MISSED'])
+        self.assertFalse(f(whit))
+        self.assertTrue(f(missed))
+
+    def test_tags(self):
+        f = RecordFilter(tags=[2, '*'])
+        self.assertFalse(f(whit))
+        self.assertTrue(f(whit2))
+        self.assertTrue(f(missed))
+
+    def test_channels(self):
+        f = RecordFilter(channels=[212])
+        self.assertFalse(f(whit))
+        self.assertTrue(f(whit2))
+        self.assertTrue(f(missed))
+
+    def test_routes(self):
+        routed = []
+        f = RecordFilter(routes={'MISSED': routed.append})
+        self.assertFalse(f(missed))
+        self.assertEqual(routed, [missed])
+        self.assertEqual(f.routed, 1)
+
+
+class TestClientFilter(unittest.TestCase):
+    def test_stream(self):
+        with FakeServer([whit, missed, whit2]) as server:
+            c = Client(server.uri, 'key')
+            lines = list(c.sra(channels=[123], watches=['ch=123'],
+                record_filter=RecordFilter(drop_ops=['MISSED'])))
+        self.assertEqual(lines, [whit.decode('utf-8'), whit2.decode('utf-8')])
+        self.assertNotIn('record_filter', server.requests[0]['body'])
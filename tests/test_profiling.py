@@ -0,0 +1,71 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from axamd.client import Client
+from axamd.client.profiling import Profiler
+from tests.fakeserver import FakeServer
+
+class TestProfiler(unittest.TestCase):
+    def test_sampling(self):
+        p = Profiler(every=3)
+        self.assertEqual([p.sample('read') for _ in range(6)],
+                [False, False, True, False, False, True])
+        p.record('read', 0.5)
+        p.record('read', 1.5)
+        self.assertEqual(p.stages['read'].events, 6)
+        self.assertAlmostEqual(p.estimate('read'), 6.0)
+
+    def test_timed(self):
+        p = Profiler(every=2)
+        self.assertEqual(list(p.timed('frame', range(5))), list(range(5)))
+        self.assertEqual(p.stages['frame'].events, 5)
+        self.assertEqual(p.stages['frame'].samples, 2)
+
+    def test_summary(self):
+        p = Profiler(every=1)
+        p.sample('decode')
+        p.record('decode', 0.001)
+        summary = p.summary()
+        self.assertIn('decode', summary)
+        self.assertNotIn('write', summary)
+
+    def test_dump(self):
+        d = tempfile.mkdtemp()
+        try:
+            p = Profiler(cprofile=True)
+            sum(range(1000))
+            p.stop()
+            fn = os.path.join(d, 'stats')
+            p.dump(fn)
+            pstats.Stats(fn)
+        finally:
+            shutil.rmtree(d)
+
+
+class TestClientProfiling(unittest.TestCase):
+    def test_stream_stages(self):
+        records = ['{{"tag":1,"op":"WATCH HIT","n":{}}}'.format(i) for i in range(10)]
+        profiler = Profiler(every=1)
+        with FakeServer(records) as server:
+            c = Client(server.uri, 'key', profiler=profiler)
+            self.assertEqual(list(c.sra(channels=[212], watches=['ch=212'])), records)
+        for stage in ('read', 'frame', 'decode', 'callback'):
+            self.assertGreater(profiler.stages[stage].samples, 0, stage)
+        self.assertEqual(profiler.stages['decode'].events, 10)
@@ -0,0 +1,52 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from axamd.client import Client
+from axamd.client.exceptions import AXAMDException
+from axamd.client.projection import Projection
+from tests.fakeserver import FakeServer
+
+HIT = json.dumps({'tag': 1, 'op': 'WATCH HIT', 'channel': 'ch212',
+    'time': '2018-01-01 00:00:00.5', 'src': '10.0.0.1', 'dst': '10.0.0.2',
+    'nmsg': {'message': {'rrname': 'a\tb.example.com.', 'rdata': ['1.2.3.4', '5.6.7.8']}}})
+
+class TestProjection(unittest.TestCase):
+    def test_json(self):
+        p = Projection(['time', 'nmsg.message.rrname', 'nmsg.message.rdata.1', 'an'])
+        self.assertEqual(p(HIT), '{"time":"2018-01-01 00:00:00.5",'
+                '"nmsg.message.rrname":"a\\tb.example.com.",'
+                '"nmsg.message.rdata.1":"5.6.7.8","an":null}')
+
+    def test_tsv(self):
+        p = Projection(['tag', 'src', 'nmsg.message.rrname', 'nmsg.message.rdata', 'an'], 'tsv')
+        self.assertEqual(p(HIT), '1\t10.0.0.1\ta\\tb.example.com.\t["1.2.3.4","5.6.7.8"]\t')
+        self.assertEqual(p.header(), 'tag\tsrc\tnmsg.message.rrname\tnmsg.message.rdata\tan')
+
+    def test_missing(self):
+        p = Projection(['nmsg.message.rdata.5', 'src.x', 'tag.0'])
+        self.assertEqual(p.values(json.loads(HIT)), [None, None, None])
+
+    def test_invalid(self):
+        self.assertRaises(AXAMDException, Projection, ['a..b'])
+        self.assertRaises(AXAMDException, Projection, [])
+        self.assertRaises(AXAMDException, Projection, ['a'], 'csv')
+
+    def test_client(self):
+        with FakeServer([HIT, '{"tag":"*","op":"MISSED","missed":3}']) as server:
+            lines = list(Client(server.uri, 'key').sra(channels=[212], watches=['ch=212'],
+                fields=['op', 'src'], fields_format='tsv'))
+        self.assertEqual(lines, ['WATCH HIT\t10.0.0.1', 'MISSED\t'])
@@ -0,0 +1,93 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bz2
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from axamd.client.exceptions import AXAMDException
+from axamd.client.prefilter import RecordFilter
+from axamd.client.replay import ReplayClient, replay
+
+def _hit(n, seconds=0.0):
+    return json.dumps({'tag': 1, 'op': 'WATCH HIT', 'n': n,
+        'time': '2018-01-01 00:00:{:09.6f}'.format(seconds)})
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lines = [_hit(i) for i in range(50)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, data, opener=open):
+        path = os.path.join(self.dir, name)
+        with opener(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_formats(self):
+        data = '\n'.join(self.lines).encode('utf-8')
+        paths = [
+            self._write('plain.json', data),    # no trailing newline
+            self._write('rs.json', b''.join(b'\x1e' + l.encode('utf-8') + b'\n' for l in self.lines)),
+            self._write('c.json.gz', data + b'\n', gzip.open),
+            self._write('c.json.bz2', data + b'\n', bz2.BZ2File),
+            self._write('empty.json', b''),
+            ]
+        self.assertEqual(list(replay(paths)), self.lines * 4)
+
+    def test_pipeline(self):
+        path = self._write('a.json', ('\n'.join(self.lines + ['{"tag":"*","op":"MISSED"}']) + '\n').encode())
+        c = ReplayClient([path])
+        lines = list(c.sra(channels=[212], watches=['ch=212'], rate_limit=10,
+            record_filter=RecordFilter(drop_ops=['MISSED']), fields=['n'], fields_format='tsv',
+            max_messages=5))
+        self.assertEqual(lines, ['0', '1', '2', '3', '4'])
+        self.assertRaises(AXAMDException, c.list_channels)
+
+    def test_workers(self):
+        paths = [self._write('{}.json'.format(i),
+            ('\n'.join(_hit(i * 1000 + n) for n in range(500)) + '\n').encode()) for i in range(4)]
+        lines = list(replay(paths, workers=3, fields=['n']))
+        self.assertEqual(sorted(json.loads(l)['n'] for l in lines),
+                sorted(i * 1000 + n for i in range(4) for n in range(500)))
+        by_file = [[json.loads(l)['n'] for l in lines if json.loads(l)['n'] // 1000 == i] for i in range(4)]
+        self.assertEqual(by_file, [sorted(f) for f in by_file])
+
+    def test_worker_error(self):
+        path = self._write('bad.json.gz', b'not gzip')
+        with self.assertRaises(AXAMDException):
+            list(replay([path, path], workers=2))
+
+    def test_paced(self):
+        path = self._write('a.json', ('\n'.join([_hit(0, 0.0), _hit(1, 0.4), _hit(2, 0.6)]) + '\n').encode())
+        start = time.time()
+        self.assertEqual(len(list(replay([path], speed=2.0))), 3)
+        self.assertGreaterEqual(time.time() - start, 0.28)
+        self.assertRaises(AXAMDException, list, replay([path], speed=1.0, workers=2))
+
+    def test_paced_deadline(self):
+        later = json.dumps({'tag': 1, 'op': 'WATCH HIT', 'n': 1, 'time': '2018-01-01 01:00:00.000000'})
+        path = self._write('a.json', ('\n'.join([_hit(0), later, _hit(2)]) + '\n').encode())
+        start = time.time()
+        # an hour-long gap in the capture does not outlast the deadline
+        self.assertEqual(len(list(replay([path], speed=1.0, deadline=start + 0.3))), 1)
+        self.assertLess(time.time() - start, 1.0)
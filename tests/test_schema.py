@@ -107,6 +107,19 @@ class TestClientConfigSchema(TestSchema, unittest.TestCase):
     def test_report_interval(self):
         self._test_integer('report-interval', minimum=1)
 
+    def test_subscriptions(self):
+        self._test({'subscriptions': {
+            'sra': {'channels': [212], 'watches': ['ch=212'], 'output': '-'},
+            'rad': {'anomalies': [{'module': 'test_anom', 'watches': ['dns=*.']}],
+                'rate-limit': 10, 'output': ['/tmp/rad.json', 'tcp:localhost:5140']},
+            }})
+        self._test_invalid({'subscriptions': []})
+        self._test_invalid({'subscriptions': {'x': {'channels': [212], 'output': []}}})
+        self._test_invalid({'subscriptions': {'x': {'channels': 'ch212'}}})
+        self._test_invalid({'subscriptions': {'x': {'anomalies': [{'module': 'a'}]}}})
+        self._test_invalid({'subscriptions': {'x': {'channels': [212],
+            'anomalies': [{'module': 'a', 'watches': []}]}}})
+
 
 class TestSRAStreamParamSchema(TestSchema, unittest.TestCase):
     @classmethod
@@ -0,0 +1,206 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from axamd.client.sinks import FanOut, Sink, SinkError, ThreadedSink, \
+        open_sink, open_sinks, parse_size
+
+class _ListSink(Sink):
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def write_batch(self, lines):
+        self.batches.append(list(lines))
+
+    def close(self):
+        self.closed = True
+
+class _SlowSink(_ListSink):
+    def __init__(self):
+        _ListSink.__init__(self)
+        self.release = threading.Event()
+
+    def write_batch(self, lines):
+        self.release.wait(10)
+        _ListSink.write_batch(self, lines)
+
+class _FailingSink(_ListSink):
+    def write_batch(self, lines):
+        raise IOError('disk full')
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _read(self, name):
+        with open(os.path.join(self.dir, name), 'rb') as f:
+            return f.read()
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('10'), 10)
+        self.assertEqual(parse_size('2k'), 2048)
+        self.assertEqual(parse_size('1M'), 1 << 20)
+        self.assertRaises(SinkError, parse_size, 'x')
+        self.assertRaises(SinkError, parse_size, '0')
+
+    def test_file(self):
+        path = os.path.join(self.dir, 'out')
+        with open_sink(path) as sink:
+            sink.write('{"a":1}')
+            sink.write(u'{"b":"\u00e9"}')
+        self.assertEqual(self._read('out'), u'{"a":1}\n{"b":"\u00e9"}\n'.encode('utf-8'))
+
+    def test_terminator(self):
+        path = os.path.join(self.dir, 'out')
+        with open_sink(path, terminator=b'') as sink:
+            sink.write(b'\x00\x00\x00\x01a')
+            sink.write(b'\x00\x00\x00\x01b')
+        self.assertEqual(self._read('out'), b'\x00\x00\x00\x01a\x00\x00\x00\x01b')
+
+    def test_rotate(self):
+        path = os.path.join(self.dir, 'out')
+        with open_sink('rotate:{}?size=20&count=2'.format(path), threaded=False) as sink:
+            for i in range(8):
+                sink.write('message {}'.format(i))
+        self.assertEqual(self._read('out'), b'message 6\nmessage 7\n')
+        self.assertEqual(self._read('out.1'), b'message 4\nmessage 5\n')
+        self.assertEqual(self._read('out.2'), b'message 2\nmessage 3\n')
+        self.assertFalse(os.path.exists(path + '.3'))
+
+    def test_tcp(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        received = []
+        def serve():
+            conn, _ = listener.accept()
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+            conn.close()
+        t = threading.Thread(target=serve)
+        t.start()
+        with open_sink('tcp:127.0.0.1:{}'.format(listener.getsockname()[1])) as sink:
+            for i in range(100):
+                sink.write(str(i))
+        t.join(10)
+        listener.close()
+        self.assertEqual(b''.join(received).split(b'\n')[:-1], [str(i).encode() for i in range(100)])
+
+    def test_udp(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        with open_sink('udp:127.0.0.1:{}'.format(receiver.getsockname()[1])) as sink:
+            sink.write('one')
+            sink.write('two')
+        self.assertEqual([receiver.recv(100), receiver.recv(100)], [b'one', b'two'])
+        receiver.close()
+
+    def test_unixgram(self):
+        path = os.path.join(self.dir, 'sock')
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        receiver.settimeout(5)
+        with open_sink('unixgram:' + path) as sink:
+            sink.write('one')
+        self.assertEqual(receiver.recv(100), b'one')
+        receiver.close()
+
+    def test_pipe(self):
+        path = os.path.join(self.dir, 'out')
+        with open_sink('pipe:cat > {}'.format(path)) as sink:
+            sink.write('one')
+            sink.write('two')
+        self.assertEqual(self._read('out'), b'one\ntwo\n')
+
+    def test_invalid(self):
+        self.assertRaises(SinkError, open_sink, 'tcp:nohost')
+        self.assertRaises(SinkError, open_sink, 'rotate:/tmp/x')
+        self.assertRaises(SinkError, open_sink, 'unix:' + os.path.join(self.dir, 'missing'))
+        self.assertRaises(SinkError, open_sink, os.path.join(self.dir, 'missing', 'out'))
+
+    def test_batching(self):
+        inner = _SlowSink()
+        sink = ThreadedSink(inner, batch_size=10)
+        for i in range(25):
+            sink.write(i)
+        inner.release.set()
+        sink.close()
+        self.assertTrue(inner.closed)
+        self.assertEqual(sum(inner.batches, []), list(range(25)))
+        self.assertTrue(all(len(b) <= 10 for b in inner.batches))
+        self.assertLess(len(inner.batches), 25)
+        self.assertEqual(sink.written, 25)
+
+    def test_drop_when_full(self):
+        inner = _SlowSink()
+        sink = ThreadedSink(inner, queue_size=5, batch_size=1, block=False)
+        for i in range(20):
+            sink.write(i)
+        self.assertGreater(sink.dropped, 0)
+        inner.release.set()
+        sink.close()
+        self.assertEqual(sink.written + sink.dropped, 20)
+
+    def test_block_when_full(self):
+        inner = _SlowSink()
+        sink = ThreadedSink(inner, queue_size=5, batch_size=1, block=True)
+        writer = threading.Thread(target=lambda: [sink.write(i) for i in range(20)])
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        inner.release.set()
+        writer.join(10)
+        sink.close()
+        self.assertEqual((sink.written, sink.dropped), (20, 0))
+
+    def test_error(self):
+        sink = ThreadedSink(_FailingSink(), queue_size=2, block=True)
+        with self.assertRaises(SinkError):
+            for i in range(100):
+                sink.write(i)
+        self.assertRaises(SinkError, sink.close)
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, Sink)
+
+    def test_fan_out(self):
+        a, b = _ListSink(), _ListSink()
+        with FanOut([a, b]) as sink:
+            sink.write('x')
+        self.assertEqual(a.batches, [['x']])
+        self.assertEqual(b.batches, [['x']])
+        self.assertTrue(a.closed and b.closed)
+        self.assertEqual(sink.dropped, 0)
+
+    def test_open_sinks(self):
+        paths = [os.path.join(self.dir, name) for name in ('a', 'b')]
+        with open_sinks(paths) as sink:
+            self.assertIsInstance(sink, FanOut)
+            sink.write('x')
+        self.assertEqual(self._read('a'), b'x\n')
+        self.assertEqual(self._read('b'), b'x\n')
@@ -0,0 +1,163 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from axamd.client.spool import Spool, spooled
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _records(self, n):
+        return ['{{"tag":1,"op":"WATCH HIT","n":{}}}'.format(i) for i in range(n)]
+
+    def test_append_read(self):
+        spool = Spool(self.dir)
+        for i, record in enumerate(self._records(3)):
+            self.assertEqual(spool.append(record), i)
+        spool.finish()
+        self.assertEqual([r for _, r in spool.iter_from(1)],
+                [r.encode('utf-8') for r in self._records(3)[1:]])
+        spool.close()
+
+    def test_segments_and_recovery(self):
+        records = self._records(50)
+        spool = Spool(self.dir, segment_size=256)
+        for record in records:
+            spool.append(record)
+        self.assertGreater(len([n for n in os.listdir(self.dir) if n.endswith('.seg')]), 1)
+        spool.close()
+
+        spool = Spool(self.dir, segment_size=256)
+        self.assertEqual(spool.next_offset, 50)
+        spool.finish()
+        self.assertEqual([r.decode('utf-8') for _, r in spool.iter_from(0)], records)
+        spool.close()
+
+    def test_damaged_tail(self):
+        spool = Spool(self.dir, segment_size=4096)
+        for record in self._records(3):
+            spool.append(record)
+        segment = spool._segments[-1]
+        segment.mm[segment.positions[2] + 8] ^= 0xff
+        spool.close()
+
+        with self.assertLogs('axamd.client.spool', 'WARNING'):
+            spool = Spool(self.dir, segment_size=4096)
+        self.assertEqual(spool.next_offset, 2)
+        self.assertEqual(spool.append('next'), 2)
+        spool.close()
+
+    def test_damaged_middle_segment(self):
+        records = self._records(30)
+        spool = Spool(self.dir, segment_size=256)
+        for record in records:
+            spool.append(record)
+        first = spool._segments[0]
+        lost = len(first) - 1
+        path, pos = first.path, first.positions[1] + 8
+        spool.close()
+        with open(path, 'r+b') as f:
+            f.seek(pos)
+            f.write(b'!')
+
+        with self.assertLogs('axamd.client.spool', 'WARNING'):
+            spool = Spool(self.dir, segment_size=256)
+        spool.finish()
+        out = [r.decode('utf-8') for _, r in spool.iter_from(0)]
+        self.assertEqual(out, records[:1] + records[1 + lost:])
+        spool.close()
+
+    def test_max_bytes(self):
+        spool = Spool(self.dir, segment_size=256, max_bytes=1024)
+        with self.assertLogs('axamd.client.spool', 'WARNING'):
+            for record in self._records(100):
+                spool.append(record)
+        self.assertLessEqual(spool.disk_usage(), 1024)
+        self.assertGreater(spool.discarded, 0)
+        self.assertEqual(spool.read(0)[0], spool.first_offset)
+        spool.close()
+
+    def test_consumed_segments_removed(self):
+        spool = Spool(self.dir, segment_size=256)
+        for record in self._records(10):
+            spool.append(record)
+        spool.commit('c', spool.next_offset)
+        for record in self._records(10):
+            spool.append(record)
+        self.assertEqual(spool.first_offset, 6)
+        spool.close()
+
+    def test_spooled_resume(self):
+        records = self._records(5)
+        spool = Spool(self.dir)
+        out = []
+        for line in spooled(iter(records), spool):
+            out.append(line)
+            if len(out) == 2:
+                break
+        spool.close()
+        self.assertEqual(out, records[:2])
+
+        # the second record was never committed and is replayed
+        spool = Spool(self.dir)
+        self.assertEqual(spool.position('default'), 1)
+        self.assertEqual(list(spooled(iter([]), spool)), records[1:])
+        spool.close()
+
+    def test_spooled_commit_batching(self):
+        records = self._records(5)
+        spool = Spool(self.dir)
+        positions = []
+        lines = spooled(iter(records), spool, commit_every=2, commit_interval=3600)
+        for line in lines:
+            positions.append(spool.position('default'))
+        self.assertEqual(positions, [0, 0, 2, 2, 4])
+        self.assertEqual(spool.position('default'), 5)
+        spool.close()
+
+    def test_spooled_close_stops_pump(self):
+        closed = threading.Event()
+        def lines():
+            try:
+                for record in self._records(1000000):
+                    yield record
+            finally:
+                closed.set()
+        spool = Spool(self.dir)
+        out = spooled(lines(), spool)
+        next(out)
+        out.close()
+        self.assertTrue(closed.wait(10))
+        spool.close()
+
+    def test_spooled_error(self):
+        def lines():
+            yield 'one'
+            raise ValueError('boom')
+        spool = Spool(self.dir)
+        out = []
+        with self.assertRaises(ValueError):
+            for line in spooled(lines(), spool):
+                out.append(line)
+        self.assertEqual(out, ['one'])
+        spool.close()
@@ -0,0 +1,64 @@
+# Copyright (c) 2018 by Farsight Security, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from axamd.client import Client, ValidationError
+from axamd.client.validation import OutputValidator
+from tests.fakeserver import FakeServer
+from tests.test_schema import axa_json_strings
+
+class TestOutputValidator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.validator = OutputValidator()
+
+    def setUp(self):
+        self.validator.failures.clear()
+
+    def test_valid_messages(self):
+        for s in axa_json_strings:
+            self.assertTrue(self.validator(s), self.validator.last_error)
+
+    def test_invalid_messages(self):
+        self.assertFalse(self.validator('{"tag":1,"op":"MISSED","missed":2}'))
+        self.assertFalse(self.validator('{"tag":1,"op":"WATCH HIT","channel":"212","af":"IPv4"}'))
+        self.assertFalse(self.validator('{"tag":0,"op":"USER"}'))
+        self.assertFalse(self.validator('{"tag":1,"op":"BOGUS"}'))
+        self.assertFalse(self.validator('not json'))
+        self.assertEqual(self.validator.failures, {'MISSED': 1, 'WATCH HIT': 1,
+            'USER': 1, 'BOGUS': 1, None: 1})
+
+    def test_sampling(self):
+        v = OutputValidator(every=3, schema=self.validator._schema)
+        for _ in range(7):
+            v('{"tag":1,"op":"BOGUS"}')
+        self.assertEqual((v.seen, v.validated, v.failed), (7, 2, 2))
+
+    def test_raise(self):
+        v = OutputValidator(raise_errors=True, schema=self.validator._schema)
+        with self.assertRaises(ValidationError):
+            v('{"tag":1,"op":"MISSED"}')
+
+
+class TestClientValidation(unittest.TestCase):
+    def test_stream(self):
+        failures = []
+        v = OutputValidator(on_failure=lambda m, e: failures.append(m))
+        records = ['{"tag":1,"op":"USER","name":"test user"}', '{"tag":1,"op":"MISSED"}']
+        with FakeServer(records) as server:
+            c = Client(server.uri, 'key')
+            self.assertEqual(list(c.sra(channels=[212], watches=['ch=212'],
+                output_validator=v)), records)
+        self.assertEqual(failures, records[1:])